@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+# async/await 構文を使うため Python 3.8 以降でのみ読み込む
+
+import asyncio
+import time
+
+from cmonkey.aio import AsyncIntegrationClient, aiohttp
+
+
+def bench_asyncio(server, args, report):
+    if aiohttp is None:
+        print('%-24s skipped (aiohttp is not installed)' % 'asyncio/list')
+        return
+
+    async def run():
+        async with AsyncIntegrationClient(server.entry_point) as client:
+            async def call(i):
+                started = time.time()
+                await client.listVirtualMachines(page=1, pagesize=20)
+                return time.time() - started
+            started = time.time()
+            latencies = await asyncio.gather(*[
+                call(i) for i in range(args.requests)
+            ])
+            return latencies, time.time() - started
+
+    latencies, elapsed = asyncio.run(run())
+    report('asyncio/list', latencies, elapsed, None, 0)
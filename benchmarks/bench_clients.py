@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from cmonkey import (
+    CookieClient,
+    IntegrationClient,
+    PollingPolicy,
+    SignatureClient,
+    imap_ordered,
+)
+from cmonkey.fakeserver import FakeCloudStack
+
+APIKEY = 'bench-apikey'
+SECRETKEY = 'bench-secretkey'
+USERNAME = 'admin'
+PASSWORD = 'password'
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = int(round((len(sorted_values) - 1) * p / 100.0))
+    return sorted_values[index]
+
+
+def _clients(entry_point, workers):
+    options = {
+        'pool_maxsize': workers,
+        'polling_policy': PollingPolicy.fixed(0.01),
+    }
+    return [
+        ('signature', SignatureClient(entry_point, APIKEY, SECRETKEY,
+                                      **options)),
+        ('cookie', CookieClient(entry_point, USERNAME, PASSWORD,
+                                **options)),
+        ('integration', IntegrationClient(entry_point, **options)),
+    ]
+
+
+def _timed(func):
+    def call(arg):
+        started = time.time()
+        func(arg)
+        return time.time() - started
+    return call
+
+
+def _measure(server, name, func, args, workers, trace_memory=False):
+    stats_before = server.stats()
+    # tracemalloc は遅くなるので指定されたときだけ使う
+    trace_memory = trace_memory and tracemalloc is not None
+    if trace_memory:
+        tracemalloc.start()
+    started = time.time()
+    latencies = list(imap_ordered(_timed(func), args, workers))
+    elapsed = time.time() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    stats_after = server.stats()
+    _report(name, latencies, elapsed, peak,
+            stats_after['logins'] - stats_before['logins'])
+
+
+def _report(name, latencies, elapsed, peak, logins):
+    latencies = sorted(latencies)
+    memory = '-' if peak is None else '%.1f' % (peak / 1024.0 / 1024.0)
+    print('%-24s %8.1f %8.2f %8.2f %8s %6d' % (
+        name,
+        len(latencies) / elapsed,
+        _percentile(latencies, 50) * 1000,
+        _percentile(latencies, 99) * 1000,
+        memory,
+        logins,
+    ))
+
+
+def _bench_clients(server, args):
+    for name, client in _clients(server.entry_point, args.workers):
+        # 最初のケースはログインの分も含む
+        _measure(
+            server,
+            '%s/list' % name,
+            lambda i: client.listVirtualMachines(page=1, pagesize=20),
+            range(args.requests),
+            args.workers,
+            args.trace_memory,
+        )
+        _measure(
+            server,
+            '%s/list_all' % name,
+            lambda i: client.list_all('listVirtualMachines', pagesize=100),
+            range(max(args.requests // 20, 1)),
+            args.workers,
+            args.trace_memory,
+        )
+        _measure(
+            server,
+            '%s/async_job' % name,
+            lambda i: client.deployVirtualMachine(zoneid='zone-0'),
+            range(max(args.requests // 10, 1)),
+            args.workers,
+            args.trace_memory,
+        )
+
+
+def _cli_command(server, *options):
+    return [
+        sys.executable, '-c', 'from cmonkey.cmd import main; main()',
+        '-e', server.entry_point,
+        '-a', APIKEY,
+        '-s', SECRETKEY,
+    ] + list(options)
+
+
+def _bench_cli(server, args):
+    # プロセスの起動を含めた 1 回あたりの時間
+    command = _cli_command(server, 'listZones')
+    _measure(
+        server,
+        'cli/invoke',
+        lambda i: subprocess.check_output(command),
+        range(args.cli_runs),
+        1,
+    )
+    batch_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt',
+                                             delete=False)
+    try:
+        for i in range(args.requests):
+            batch_file.write('listVirtualMachines page=1 pagesize=20\n')
+        batch_file.close()
+        command = _cli_command(server, '--batch', batch_file.name,
+                               '--parallel', str(args.workers))
+        stats_before = server.stats()
+        started = time.time()
+        subprocess.check_output(command)
+        elapsed = time.time() - started
+        stats_after = server.stats()
+        # 行毎の時間は取れないので全体の時間から求める
+        per_request = elapsed / args.requests
+        _report('cli/batch', [per_request] * args.requests, elapsed, None,
+                stats_after['logins'] - stats_before['logins'])
+    finally:
+        os.remove(batch_file.name)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark of cmonkey clients against a fake CloudStack',
+    )
+    arg_parser.add_argument(
+        '-n', '--requests',
+        type=int,
+        required=False, default=500,
+        help='Requests per case (default: 500)',
+    )
+    arg_parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        required=False, default=8,
+        help='Concurrent requests (default: 8)',
+    )
+    arg_parser.add_argument(
+        '--items',
+        type=int,
+        required=False, default=1000,
+        help='Items returned by list commands (default: 1000)',
+    )
+    arg_parser.add_argument(
+        '--job-duration',
+        type=float,
+        required=False, default=0.05,
+        help='Seconds until asynchronous jobs finish (default: 0.05)',
+    )
+    arg_parser.add_argument(
+        '--latency',
+        type=float,
+        required=False, default=0.0,
+        help='Server side latency per request (default: 0.0)',
+    )
+    arg_parser.add_argument(
+        '--cli-runs',
+        type=int,
+        required=False, default=10,
+        help='CLI invocations (default: 10)',
+    )
+    arg_parser.add_argument(
+        '--trace-memory',
+        action='store_true',
+        required=False, default=False,
+        help='Measure peak memory with tracemalloc (slower)',
+    )
+    args = arg_parser.parse_args()
+
+    server = FakeCloudStack(
+        apikey=APIKEY,
+        secretkey=SECRETKEY,
+        username=USERNAME,
+        password=PASSWORD,
+        items=args.items,
+        job_duration=args.job_duration,
+        latency=args.latency,
+    )
+    with server:
+        print('%-24s %8s %8s %8s %8s %6s' % (
+            'case', 'req/s', 'p50(ms)', 'p99(ms)', 'mem(MB)', 'logins',
+        ))
+        _bench_clients(server, args)
+        _bench_cli(server, args)
+        if sys.version_info >= (3, 8):
+            # async/await 構文を使うため別のモジュールにしている
+            from bench_asyncio import bench_asyncio
+            bench_asyncio(server, args, _report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+import argparse
+import json
+import tracemalloc
+
+from cmonkey.compact import Projection
+
+
+def _vm(i):
+    # listVirtualMachines の 1 件に近い大きさのもの
+    return {
+        'id': '%08x-646c-11e3-a767-080027c9399e' % i,
+        'name': 'vm%d' % i,
+        'displayname': 'vm%d' % i,
+        'account': 'admin',
+        'domainid': '0b0dbb58-646c-11e3-a767-080027c9399e',
+        'domain': 'ROOT',
+        'created': '2014-01-01T00:00:00+0900',
+        'state': 'Running',
+        'haenable': False,
+        'zoneid': 'zone-%d' % (i % 4),
+        'zonename': 'zone%d' % (i % 4),
+        'templateid': 'template-%d' % (i % 10),
+        'templatename': 'CentOS 6.5',
+        'serviceofferingid': 'offering-%d' % (i % 5),
+        'serviceofferingname': 'Small Instance',
+        'cpunumber': 1,
+        'cpuspeed': 500,
+        'memory': 512,
+        'guestosid': 'guestos-1',
+        'rootdeviceid': 0,
+        'rootdevicetype': 'ROOT',
+        'hypervisor': 'KVM',
+        'nic': [{
+            'id': 'nic-%d' % i,
+            'networkid': 'network-%d' % (i % 4),
+            'netmask': '255.255.255.0',
+            'gateway': '10.0.0.1',
+            'ipaddress': '10.0.%d.%d' % (i // 250 % 250, i % 250),
+            'traffictype': 'Guest',
+            'type': 'Isolated',
+            'isdefault': True,
+            'macaddress': '02:00:%02x:%02x:00:01' % (i // 256 % 256, i % 256),
+        }],
+        'securitygroup': [],
+        'affinitygroup': [{'id': 'affinity-1', 'name': 'web'}],
+        'tags': [
+            {'key': 'role', 'value': 'web'},
+            {'key': 'owner', 'value': 'infra'},
+        ],
+    }
+
+
+def _page(start, stop):
+    # サーバから受け取った JSON を毎回デコードするのと同じ状態にする
+    return json.loads(json.dumps([_vm(i) for i in range(start, stop)]))
+
+
+def _pages(count, pagesize):
+    for start in range(0, count, pagesize):
+        yield _page(start, min(start + pagesize, count))
+
+
+def _measure(name, load, count):
+    tracemalloc.start()
+    items = load()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('%-10s %8d %10.1f %10.0f' % (
+        name,
+        len(items),
+        current / 1024.0 / 1024.0,
+        current / float(count),
+    ))
+    return current
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Memory of list results with and without projection',
+    )
+    arg_parser.add_argument(
+        '-n', '--items',
+        type=int,
+        required=False, default=50000,
+        help='Virtual machines (default: 50000)',
+    )
+    arg_parser.add_argument(
+        '--fields',
+        required=False, default='id,name,state,zonename',
+        help='Projected fields (default: id,name,state,zonename)',
+    )
+    args = arg_parser.parse_args()
+    fields = args.fields.split(',')
+
+    print('%-10s %8s %10s %10s' % ('case', 'items', 'MB', 'bytes/item'))
+    full = _measure(
+        'full',
+        lambda: [vm for page in _pages(args.items, 500) for vm in page],
+        args.items,
+    )
+    compact = _measure(
+        'compact',
+        lambda: Projection(fields).project(
+            vm for page in _pages(args.items, 500) for vm in page
+        ),
+        args.items,
+    )
+    print('ratio: %.1fx' % (full / float(compact)))
+
+
+if __name__ == '__main__':
+    main()
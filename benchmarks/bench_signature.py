@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+import argparse
+import base64
+import hashlib
+import hmac
+import timeit
+
+from six.moves.urllib import parse
+
+from cmonkey import SignatureBuilder
+
+APIKEY = 'B1glHBDDvXwKz4XkLXhd_Hk5-Fp8RZfukbE4shWk2p9nRjPvtMLTtNtawtD1H-a4kh06P0U5eRBELVOl6OAThg'
+SECRETKEY = 'VpznCS2q7t9-Sd8QJJwW_VLm_IX1g3ua9fMasSyD8jD5XBXso3heVG6_3PUcQi5lVWZXXYKoJwcWukv0V7DvCQ'
+
+
+def _naive_build(params):
+    # 最適化する前の SignatureBuilder.build と同じ処理
+    if 'apikey' not in [k.lower() for k in params.keys()]:
+        params['apikey'] = APIKEY
+    quoted_params = dict([
+        (k, parse.quote(v, safe=''))
+        for k, v in params.items()
+    ])
+    lower_pairs = [
+        ('%s=%s' % (k, v)).lower()
+        for k, v in quoted_params.items()
+    ]
+    sorted_pairs = sorted(lower_pairs)
+    query_string = '&'.join(sorted_pairs)
+    sha1hash = hmac.new(
+        SECRETKEY.encode(),
+        query_string.encode(),
+        hashlib.sha1,
+    )
+    return base64.b64encode(sha1hash.digest())
+
+
+def _params(i):
+    return {
+        'command': 'listVirtualMachines',
+        'response': 'json',
+        'zoneid': '0b0dbb58-646c-11e3-a767-080027c9399e',
+        'state': 'Running',
+        'page': str(i % 100 + 1),
+        'pagesize': '500',
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Microbenchmark of SignatureBuilder',
+    )
+    arg_parser.add_argument(
+        '-n', '--number',
+        type=int,
+        required=False, default=20000,
+        help='Requests signed per measurement (default: 20000)',
+    )
+    arg_parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        required=False, default=5,
+        help='Measurements (default: 5)',
+    )
+    args = arg_parser.parse_args()
+
+    params_list = [_params(i) for i in range(args.number)]
+    builder = SignatureBuilder(APIKEY, SECRETKEY)
+
+    # 同じ署名になることを確認しておく
+    for params in params_list[:100]:
+        expected = _naive_build(dict(params))
+        assert builder.build(dict(params)) == expected
+
+    cases = [
+        ('naive', lambda: [_naive_build(dict(p)) for p in params_list]),
+        ('build', lambda: [builder.build(dict(p)) for p in params_list]),
+        ('build_many', lambda: builder.build_many(
+            [dict(p) for p in params_list]
+        )),
+    ]
+    baseline = None
+    for name, func in cases:
+        elapsed = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        per_request = elapsed / args.number * 1e6
+        baseline = baseline or per_request
+        print('%-12s %8.2f usec/request  x%.2f' % (
+            name,
+            per_request,
+            baseline / per_request,
+        ))
+
+
+if __name__ == '__main__':
+    main()
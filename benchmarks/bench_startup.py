@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from cmonkey.cmd import _daemon_client
+from cmonkey.daemon import Daemon, forward
+from cmonkey.fakeserver import FakeCloudStack
+
+# コマンドラインツールの起動にかける時間の目標 (ミリ秒)
+TARGET_MSEC = 100.0
+
+
+def _median_msec(command, runs):
+    elapsed = []
+    for _i in range(runs):
+        started = time.time()
+        subprocess.check_call(command, stdout=subprocess.PIPE)
+        elapsed.append((time.time() - started) * 1000)
+    elapsed.sort()
+    return elapsed[len(elapsed) // 2]
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Startup time of the cmonkey command line tool',
+    )
+    arg_parser.add_argument(
+        '-r', '--runs',
+        type=int,
+        required=False, default=20,
+        help='Process launches per case (default: 20)',
+    )
+    args = arg_parser.parse_args()
+
+    baseline = _median_msec(_python('pass'), args.runs)
+    print('%-28s %8.1f ms' % ('python (baseline)', baseline))
+    cases = [
+        ('import requests', _python('import requests')),
+        ('import cmonkey.cmd', _python('import cmonkey.cmd')),
+    ]
+    socket_path = os.path.join(tempfile.mkdtemp(), 'cmonkey.sock')
+    with FakeCloudStack() as server:
+        cli = _python(
+            'import sys; from cmonkey.cmd import main; main()'
+        ) + ['-t', 'integration', '-e', server.entry_point,
+             '--socket', socket_path]
+        cases.append(('cmonkey listZones', cli + ['listZones']))
+        results = [
+            (name, _median_msec(command, args.runs))
+            for name, command in cases
+        ]
+        daemon = Daemon(socket_path, _daemon_client).bind()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            results.append((
+                'cmonkey listZones (daemon)',
+                _median_msec(cli + ['listZones'], args.runs),
+            ))
+            forward_msec = _forward_msec(socket_path, server, args.runs)
+        finally:
+            daemon.shutdown()
+            thread.join()
+    failed = False
+    for name, elapsed in results:
+        # インタプリタ自体の起動時間を除いて目標と比べる
+        overhead = elapsed - baseline
+        verdict = 'ok' if overhead < TARGET_MSEC else 'SLOW'
+        failed = failed or (name != 'import requests' and verdict != 'ok')
+        print('%-28s %8.1f ms  (+%.1f ms) %s' % (
+            name, elapsed, overhead, verdict))
+    # プロセスの起動を除いた daemon 経由の 1 回あたりの時間
+    print('%-28s %8.1f ms' % ('forward to daemon', forward_msec))
+    sys.exit(1 if failed else 0)
+
+
+def _forward_msec(socket_path, server, runs):
+    client_spec = {
+        'authentication_type': 'integration',
+        'entry_point': server.entry_point,
+    }
+    elapsed = []
+    for _i in range(runs):
+        started = time.time()
+        forward(socket_path, client_spec, 'listZones', {})
+        elapsed.append((time.time() - started) * 1000)
+    elapsed.sort()
+    return elapsed[len(elapsed) // 2]
+
+
+if __name__ == '__main__':
+    main()
@@ -6,14 +6,18 @@ import hmac
 import hashlib
 import base64
 import collections
+import random
 import sys
 import time
+import threading
 from abc import ABCMeta, abstractmethod
 
 import six
 from six.moves.urllib import parse
 from six.moves import range
-import requests
+from six.moves import queue
+
+# requests と concurrent.futures は読み込みに時間がかかるため使うときに読み込む
 
 LOG = logging.getLogger(__name__)
 
@@ -30,12 +34,17 @@ class ApiResponse(collections.namedtuple('ApiResponse',
                                          [
                                              'status_code',
                                              'headers',
-                                             'content_body'
+                                             'content_body',
+                                             'job',
                                          ]
                                          )):
     pass
 
 
+# 非同期 API の結果は待ち合わせたときだけ入る
+ApiResponse.__new__.__defaults__ = (None, )
+
+
 class ApiRequest(collections.namedtuple('ApiRequest',
                                         [
                                             'method',
@@ -49,21 +58,155 @@ class ApiRequest(collections.namedtuple('ApiRequest',
 
 class RequestMixin(object):
 
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 timeout=None, max_retries=0, retry_backoff=0.1,
+                 throttle=None, lightweight=False, cassette=None):
+        self.timeout = timeout
+        self.throttle = throttle
+        self.lightweight = lightweight
+        # cmonkey.cassette の CassetteRecorder / CassettePlayer
+        self.cassette = cassette
+        self._pool_options = {
+            'pool_connections': pool_connections,
+            'pool_maxsize': pool_maxsize,
+            'pool_block': pool_block,
+        }
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._http_session = None
+        self._http_session_lock = threading.Lock()
 
-    def request(self, method=None, params=None, headers=None, data=None):
+    @property
+    def session(self):
+        # 最初のリクエストまで作らない
+        session = self._http_session
+        if session is None:
+            with self._http_session_lock:
+                if self._http_session is None:
+                    self._http_session = self._new_session() \
+                        if self.cassette is None \
+                        else self.cassette.session(self._new_session)
+                session = self._http_session
+        return session
+
+    def _new_session(self):
+        if self.lightweight:
+            from cmonkey.lite import LiteSession
+            return LiteSession()
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        session = requests.Session()
+        # 接続できなかった場合のみ再送する (リクエストは送られていないので安全)
+        retries = Retry(
+            total=self._max_retries,
+            connect=self._max_retries,
+            read=0,
+            redirect=0,
+            status=0,
+            backoff_factor=self._retry_backoff,
+        )
+        adapter = HTTPAdapter(max_retries=retries, **self._pool_options)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method=None, params=None, headers=None, data=None,
+                stream=False):
         params = params or {}
         headers = headers or {}
         data = data or {}
+        throttle = self.throttle
+        if throttle is None:
+            return self._session_request(method, params, headers, data,
+                                         stream)
+        command = params.get('command') or data.get('command')
+        attempt = 0
+        while True:
+            with throttle:
+                response = self._session_request(method, params, headers,
+                                                 data, stream)
+            if not throttle.throttled(response, command) or \
+                    attempt >= throttle.max_retries:
+                return response
+            # 制限されたら間隔を空けてから送り直す
+            response.close()
+            throttle.pause(attempt, response)
+            attempt += 1
+
+    def _session_request(self, method, params, headers, data, stream):
         return self.session.request(
             method or 'GET',
             self.entry_point,
             params=params,
             headers=headers,
             data=data,
+            timeout=self.timeout,
+            stream=stream,
         )
 
+    def pool_stats(self):
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                if pool is None:
+                    continue
+                url = '%s://%s:%s' % (pool.scheme, pool.host, pool.port)
+                stats[url] = {
+                    'connections': pool.num_connections,
+                    'requests': pool.num_requests,
+                    # 既存の接続を使い回したリクエストの数
+                    'reused': max(pool.num_requests - pool.num_connections,
+                                  0),
+                }
+        return stats
+
+
+class Observer(object):
+
+    def before_request(self, command, params):
+        pass
+
+    def after_response(self, command, status_code, timings, size):
+        pass
+
+    def login(self, username, elapsed):
+        pass
+
+    def job_poll(self, command, job_id, job_status, elapsed):
+        pass
+
+    def job_done(self, command, job_id, job_status, elapsed, polls):
+        pass
+
+
+class ObservableMixin(object):
+
+    def __init__(self, observers=None):
+        self.observers = list(observers or [])
+        # 呼び出し毎の内訳はスレッド毎に集める
+        self._call_timings = threading.local()
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def _notify(self, event, *args):
+        for observer in self.observers:
+            getattr(observer, event)(*args)
+
+    def _timed(self, name, func, *args):
+        timings = getattr(self._call_timings, 'timings', None)
+        if timings is None:
+            return func(*args)
+        started = time.time()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.time() - started
+            timings[name] = timings.get(name, 0.0) + elapsed
+
 
 class RetryLimitExceededException(BaseException):
 
@@ -71,89 +214,647 @@ class RetryLimitExceededException(BaseException):
         super(RetryLimitExceededException, self).__init__(msg)
 
 
+class DeadlineExceededException(RetryLimitExceededException):
+
+    def __init__(self, msg):
+        super(DeadlineExceededException, self).__init__(msg)
+
+
+class ApiErrorException(BaseException):
+
+    def __init__(self, msg, status_code=None, content_body=None):
+        super(ApiErrorException, self).__init__(msg)
+        self.status_code = status_code
+        self.content_body = content_body
+
+
+# queryAsyncJobResult の jobstatus
+JOB_STATUS_PENDING = 0
+JOB_STATUS_SUCCEEDED = 1
+JOB_STATUS_FAILED = 2
+
+
+class JobResult(collections.namedtuple('JobResult',
+                                       [
+                                           'job_id',
+                                           'job_status',
+                                           'job_result',
+                                           'content_body',
+                                       ]
+                                       )):
+
+    @classmethod
+    def from_content_body(cls, inner_content_body):
+        return cls(
+            inner_content_body.get('jobid'),
+            inner_content_body['jobstatus'],
+            inner_content_body.get('jobresult'),
+            inner_content_body,
+        )
+
+    @property
+    def succeeded(self):
+        return self.job_status == JOB_STATUS_SUCCEEDED
+
+
+class FanOutResult(collections.namedtuple('FanOutResult',
+                                          [
+                                              'params',
+                                              'response',
+                                              'error',
+                                          ]
+                                          )):
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class PollingPolicy(object):
+
+    # コマンド毎の最初の待ち時間 (秒)
+    DEFAULT_HINTS = {
+        'deployVirtualMachine': 5.0,
+        'startVirtualMachine': 3.0,
+        'stopVirtualMachine': 3.0,
+        'rebootVirtualMachine': 3.0,
+        'destroyVirtualMachine': 2.0,
+        'migrateVirtualMachine': 5.0,
+        'createSnapshot': 5.0,
+        'createTemplate': 10.0,
+        'copyTemplate': 10.0,
+        'attachVolume': 0.5,
+        'detachVolume': 0.5,
+        'associateIpAddress': 0.5,
+        'disassociateIpAddress': 0.5,
+        'createPortForwardingRule': 0.5,
+        'deletePortForwardingRule': 0.5,
+        'createFirewallRule': 0.5,
+        'deleteFirewallRule': 0.5,
+        'addVpnUser': 0.5,
+        'removeVpnUser': 0.5,
+    }
+
+    def __init__(self, min_interval=0.2, max_interval=10.0, multiplier=2.0,
+                 jitter=0.1, timeout=None, hints=None):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self.hints = dict(self.DEFAULT_HINTS)
+        self.hints.update(hints or {})
+
+    @classmethod
+    def fixed(cls, interval, timeout=None):
+        return cls(
+            min_interval=interval,
+            max_interval=interval,
+            multiplier=1.0,
+            jitter=0.0,
+            timeout=timeout,
+            hints={},
+        )
+
+    @classmethod
+    def resolve(cls, policy=None, interval=None):
+        # 間隔が明示されていれば固定間隔で待つ
+        if interval is not None:
+            return cls.fixed(interval)
+        return policy or cls()
+
+    def deadline(self):
+        if self.timeout is None:
+            return None
+        return time.time() + self.timeout
+
+    def intervals(self, command=None):
+        interval = self.hints.get(command, self.min_interval)
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        while True:
+            yield self._jittered(interval)
+            interval = min(interval * self.multiplier, self.max_interval)
+
+    def _jittered(self, interval):
+        if not self.jitter:
+            return interval
+        ratio = random.uniform(-self.jitter, self.jitter)
+        return max(interval * (1.0 + ratio), 0.0)
+
+    def wait_time(self, wait, deadline):
+        if deadline is None:
+            return wait
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            msg = 'Deadline exceeded (%s sec)' % self.timeout
+            raise DeadlineExceededException(msg)
+        return min(wait, remaining)
+
+    def sleep(self, wait, deadline):
+        time.sleep(self.wait_time(wait, deadline))
+
+
+def list_items_of(content_body):
+    inner_body = next(iter(content_body.values()), None)
+    if not isinstance(inner_body, dict):
+        return None, []
+    count = inner_body.get('count')
+    # エンティティの配列はコマンド毎にキーが異なる
+    for value in inner_body.values():
+        if isinstance(value, list):
+            return count, value
+    return count, []
+
+
+def api_error_of(status_code, content_body):
+    # 成功していればエラーの内容は None
+    inner_body = next(iter(content_body.values()), None) \
+        if isinstance(content_body, dict) else None
+    if isinstance(inner_body, dict) and 'errorcode' in inner_body:
+        return inner_body.get('errortext') or inner_body['errorcode']
+    if status_code != 200:
+        return 'HTTP %d' % status_code
+    return None
+
+
+def check_api_response(command, api_response):
+    error = api_error_of(api_response.status_code, api_response.content_body)
+    if error is not None:
+        msg = '%s: %s' % (command, error)
+        raise ApiErrorException(msg, api_response.status_code,
+                                api_response.content_body)
+    return api_response
+
+
+def job_id_of(content_body):
+    if not content_body:
+        return None
+    inner_body = next(iter(content_body.values()))
+    if not isinstance(inner_body, dict):
+        return None
+    return inner_body.get('jobid')
+
+
 class AsyncBlockMixin(object):
 
     def __init__(self):
         super(AsyncBlockMixin, self).__init__()
 
-    def block(self, response, retry=-1, interval=1):
-        inner_body = next(iter(response.values()))
-        job_id = inner_body.get('jobid')
+    def query_job(self, job_id):
+        command = 'queryAsyncJobResult'
+        params = {
+            'response': 'json',
+            'jobid': job_id,
+        }
+        # 同じ JOB を待っている呼び出しとは問い合わせを共有する
+        content_body = self._coalesce(self._query_job_body, command, params)
+        return content_body['queryasyncjobresultresponse']
+
+    def _query_job_body(self, command, params):
+        return self._execute(command, params).json()
+
+    def block(self, response, retry=-1, interval=None, command=None):
+        job_id = job_id_of(response)
         if not job_id:
             msg = 'JOB id not found (maybe synchronous request)'
             LOG.debug(msg)
-            return
+            return None
+        policy = PollingPolicy.resolve(self.polling_policy, interval)
+        deadline = policy.deadline()
+        intervals = policy.intervals(command)
         retry = sys.maxsize if retry < 0 else retry
-        for _i in range(retry):
-            command = 'queryAsyncJobResult'
-            params = {
-                'response': 'json',
-                'jobid': job_id,
-            }
-            api_req_params = self.produce(command, params)
-            response = self.request(
-                api_req_params.method,
-                api_req_params.params,
-                api_req_params.headers,
-                api_req_params.data
-            )
-            content_body = response.json()
-            inner_content_body = content_body['queryasyncjobresultresponse']
+        started = time.time()
+        for polls in range(1, retry + 1):
+            inner_content_body = self.query_job(job_id)
             job_status = inner_content_body['jobstatus']
-            if job_status != 0:
+            elapsed = time.time() - started
+            self._notify('job_poll', command, job_id, job_status, elapsed)
+            if job_status != JOB_STATUS_PENDING:
                 msg = 'JOB status changed: %s' % job_status
                 LOG.debug(msg)
-                return
-            time.sleep(interval)
+                self._notify('job_done', command, job_id, job_status,
+                             elapsed, polls)
+                return JobResult.from_content_body(inner_content_body)
+            policy.sleep(next(intervals), deadline)
         raise RetryLimitExceededException('Retried %d times' % retry)
 
 
+_END_OF_INPUT = object()
+
+
+def imap_ordered(func, iterable, workers):
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+    # 実行中と未読の結果は合わせて workers 個までにする
+    window = threading.Semaphore(workers)
+    stopped = threading.Event()
+    from concurrent import futures
+    submitted = queue.Queue()
+    executor = futures.ThreadPoolExecutor(workers)
+
+    def feed():
+        # 入力の読み込みが止まっても終わった結果は返せるよう別スレッドで読む
+        try:
+            for item in iterable:
+                window.acquire()
+                if stopped.is_set():
+                    return
+                submitted.put(executor.submit(func, item))
+        except Exception as e:
+            failed = futures.Future()
+            failed.set_exception(e)
+            submitted.put(failed)
+        finally:
+            submitted.put(_END_OF_INPUT)
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    try:
+        while True:
+            future = submitted.get()
+            if future is _END_OF_INPUT:
+                return
+            try:
+                yield future.result()
+            finally:
+                window.release()
+    finally:
+        # 途中で止められたら待っているものは取り消す
+        stopped.set()
+        window.release()
+        while True:
+            try:
+                future = submitted.get_nowait()
+            except queue.Empty:
+                break
+            if future is not _END_OF_INPUT:
+                future.cancel()
+        executor.shutdown(wait=False)
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                from concurrent import futures
+                call = futures.Future()
+                self._calls[key] = call
+        if not leader:
+            # 先に始まった呼び出しの結果を待つ
+            return call.result()
+        try:
+            result = func()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def flight_key(name, command, params):
+    pairs = frozenset(
+        (k, six.text_type(v)) for k, v in params.items()
+    )
+    return (name, command, pairs)
+
+
 @six.add_metaclass(ABCMeta)
 class ClientBase(AttributeInvokeMixin,
                  RequestMixin,
-                 AsyncBlockMixin):
+                 AsyncBlockMixin,
+                 ObservableMixin):
+
+    # CloudStack の default.page.size の既定値
+    DEFAULT_PAGE_SIZE = 500
+    # 同時に呼ばれたときに 1 回のリクエストにまとめる参照系のコマンド
+    COALESCED_PREFIXES = ('list', 'get', 'query')
 
-    def __init__(self, entry_point, async_block=True):
-        super(ClientBase, self).__init__()
+    def __init__(self, entry_point, async_block=True, polling_policy=None,
+                 cache=None, coalesce=False, observers=None,
+                 **request_options):
+        super(ClientBase, self).__init__(**request_options)
+        ObservableMixin.__init__(self, observers)
         self.entry_point = entry_point
         self.async_block = async_block
+        self.polling_policy = polling_policy
+        self.cache = cache
+        self._single_flight = SingleFlight() if coalesce else None
 
-    def invoke(self, command, params):
+    def invoke(self, command, params, stream=False):
+        # 呼び出し元の辞書は書き換えない (スレッド間で共有されることがある)
+        params = dict(params)
         params['response'] = 'json'
 
+        if stream:
+            return self._invoke(command, params, stream)
+        cache = self.cache
+        if cache is None or not cache.cacheable(command):
+            return self._coalesce(self._invoke, command, params)
+        namespace = self.cache_namespace()
+        cached = cache.get(namespace, command, params)
+        if cached is not None:
+            return ApiResponse(*cached)
+        api_response = self._coalesce(self._invoke, command, params)
+        if api_response.status_code == 200:
+            cache.put(namespace, command, params, [
+                api_response.status_code,
+                api_response.headers,
+                api_response.content_body,
+            ])
+        return api_response
+
+    def cache_namespace(self):
+        # 認証情報が違えば見える結果も違う
+        return self.entry_point
+
+    def _coalesce(self, func, command, params):
+        single_flight = self._single_flight
+        if single_flight is None or \
+                not command.startswith(self.COALESCED_PREFIXES):
+            return func(command, params)
+        key = flight_key(func.__name__, command, params)
+        return single_flight.do(key, lambda: func(command, params))
+
+    def _invoke(self, command, params, stream=False):
+        observed = bool(self.observers)
+        if observed:
+            self._notify('before_request', command, params)
+            timings = self._call_timings.timings = {}
+        started = time.time()
+
         # HTTP リクエスト
-        api_req_params = self.produce(command, params)
-        response = self.request(
-            api_req_params.method,
-            api_req_params.params,
-            api_req_params.headers,
-            api_req_params.data,
-        )
+        response = self._execute(command, params, stream)
 
         # HTTP レスポンス
         status_code = response.status_code
         headers = dict(response.headers)
+        if stream:
+            if observed:
+                self._call_timings.timings = None
+                timings['total'] = time.time() - started
+                self._notify('after_response', command, status_code,
+                             timings, None)
+            # 配列の要素を読み込みながら 1 件ずつ返す
+            from cmonkey.stream import StreamedList
+            return ApiResponse(status_code, headers, StreamedList(response))
+        decode_started = time.time()
         content_body = response.json()
 
+        job_started = time.time()
+        if observed:
+            # JOB の問い合わせはこの呼び出しの HTTP の時間に含めない
+            self._call_timings.timings = None
+        job = None
         if self.async_block:
-            self.block(content_body)
+            try:
+                job = self.block(content_body, command=command)
+            except FAN_OUT_ERRORS as e:
+                # JOB は登録されているので呼び出し元が待ち合わせを再開できる
+                e.job_id = job_id_of(content_body)
+                raise
+
+        if observed:
+            finished = time.time()
+            timings['decode'] = job_started - decode_started
+            timings['job'] = finished - job_started
+            timings['total'] = finished - started
+            self._notify('after_response', command, status_code, timings,
+                         self._response_size(response))
+        return ApiResponse(status_code, headers, content_body, job)
+
+    def _response_size(self, response):
+        content_length = response.headers.get('Content-Length')
+        if content_length is not None:
+            return int(content_length)
+        return len(response.content)
+
+    def _execute(self, command, params, stream=False):
+        api_req_params = self._produce(command, dict(params))
+        return self._send(api_req_params, stream)
+
+    def _produce(self, command, params):
+        # 署名の計算やログインにかかった時間
+        return self._timed('produce', self.produce, command, params)
+
+    def _send(self, api_req_params, stream=False):
+        request_args = [
+            api_req_params.method,
+            api_req_params.params,
+            api_req_params.headers,
+            api_req_params.data,
+        ]
+        if stream:
+            return self._timed('http', lambda: self.request(*request_args,
+                                                            stream=True))
+        return self._timed('http', self.request, *request_args)
+
+    def map(self, command, params_list, workers=4):
+        results = imap_ordered(
+            lambda params: self.invoke(command, params),
+            params_list,
+            workers,
+        )
+        return list(results)
+
+    def fan_out(self, command, params_iterable, workers=8):
+        # 失敗した呼び出しがあっても残りは続けて、結果に入力を添えて返す
+        return imap_ordered(
+            lambda params: self._fan_out_call(command, params),
+            params_iterable,
+            workers,
+        )
+
+    def _fan_out_call(self, command, params):
+        try:
+            return FanOutResult(params, self.invoke(command, params), None)
+        except FAN_OUT_ERRORS as e:
+            return FanOutResult(params, None, e)
+
+    def iter_list(self, command, pagesize=None, prefetch=False, stream=False,
+                  fields=None, **params):
+        if stream:
+            items = self._iter_list_stream(command, params, pagesize)
+        else:
+            pages = self.iter_pages(command, params, pagesize, prefetch)
+            items = (item for items in pages for item in items)
+        if fields:
+            items = _projection(fields).iter(items)
+        for item in items:
+            yield item
+
+    def _iter_list_stream(self, command, params, pagesize=None):
+        pagesize = int(pagesize or params.get('pagesize') or
+                       self.DEFAULT_PAGE_SIZE)
+        page = int(params.get('page', 1))
+        while True:
+            page_params = self._page_params(params, page, pagesize)
+            api_response = self.invoke(command, page_params, stream=True)
+            items = api_response.content_body
+            if api_response.status_code != 200:
+                # エラーのレスポンスを空のページとして読まない
+                items.close()
+                raise ApiErrorException(
+                    '%s: HTTP %d' % (command, api_response.status_code),
+                    api_response.status_code,
+                )
+            received = 0
+            for item in items:
+                received += 1
+                yield item
+            fetched = (page - 1) * pagesize + received
+            if received < pagesize:
+                return
+            if items.count is not None and fetched >= items.count:
+                return
+            page += 1
+
+    def iter_pages(self, command, params, pagesize=None, prefetch=False):
+        pagesize = int(pagesize or params.get('pagesize') or
+                       self.DEFAULT_PAGE_SIZE)
+        page = int(params.get('page', 1))
+        from concurrent import futures
+        executor = futures.ThreadPoolExecutor(1) if prefetch else None
+        try:
+            future = self._fetch_page(command, params, page, pagesize,
+                                      executor)
+            while future is not None:
+                count, items = future.result()
+                # count は先頭のページからの件数
+                fetched = (page - 1) * pagesize + len(items)
+                last = len(items) < pagesize or (
+                    count is not None and fetched >= count
+                )
+                future = None
+                if not last:
+                    # 次のページは呼び出し元が処理している間に取得しておく
+                    page += 1
+                    future = self._fetch_page(command, params, page,
+                                              pagesize, executor)
+                yield items
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def list_all(self, command, pagesize=None, workers=4, fields=None,
+                 **params):
+        pages = self.iter_pages_parallel(command, params, pagesize, workers)
+        items = (item for items in pages for item in items)
+        if fields:
+            # ページ毎に必要なフィールドだけを残して元の辞書は捨てる
+            return _projection(fields).project(items)
+        return list(items)
 
-        return ApiResponse(status_code, headers, content_body)
+    def iter_pages_parallel(self, command, params, pagesize=None, workers=4):
+        pagesize = int(pagesize or params.get('pagesize') or
+                       self.DEFAULT_PAGE_SIZE)
+        first_page = int(params.get('page', 1))
+        # 最初のページで全体の件数を知る
+        count, items = self._list_page(
+            command,
+            self._page_params(params, first_page, pagesize),
+        )
+        yield items
+        if len(items) < pagesize:
+            return
+        if count is None:
+            # 件数が分からなければ順番に取得するしかない
+            next_params = dict(params, page=first_page + 1)
+            for items in self.iter_pages(command, next_params, pagesize):
+                yield items
+            return
+        # 残りのページは並列に取得して順番通りに返す
+        remaining = count - (first_page - 1) * pagesize - len(items)
+        last_page = first_page + (remaining + pagesize - 1) // pagesize
+        pages = range(first_page + 1, last_page + 1)
+        results = imap_ordered(
+            lambda page: self._list_page(
+                command,
+                self._page_params(params, page, pagesize),
+            ),
+            pages,
+            workers,
+        )
+        for _count, items in results:
+            yield items
+
+    def _page_params(self, params, page, pagesize):
+        page_params = dict(params)
+        page_params['page'] = str(page)
+        page_params['pagesize'] = str(pagesize)
+        return page_params
+
+    def _fetch_page(self, command, params, page, pagesize, executor=None):
+        page_params = self._page_params(params, page, pagesize)
+        if executor is not None:
+            return executor.submit(self._list_page, command, page_params)
+        from concurrent import futures
+        future = futures.Future()
+        future.set_result(self._list_page(command, page_params))
+        return future
+
+    def _list_page(self, command, params):
+        api_response = check_api_response(command,
+                                          self.invoke(command, params))
+        return list_items_of(api_response.content_body)
+
+    def wait_jobs(self, jobs, retry=-1, interval=None, bulk=False,
+                  workers=8):
+        from cmonkey.jobs import JobWaiter
+        waiter = JobWaiter(self, jobs, interval=interval, bulk=bulk,
+                           workers=workers)
+        return waiter.as_completed(retry)
 
     @abstractmethod
     def produce(self, command, params):
         return None
 
 
+def _projection(fields):
+    from cmonkey.compact import Projection
+    return Projection(fields)
+
+
 class LoginFailedException(BaseException):
 
     def __init__(self, msg):
         super(LoginFailedException, self).__init__(msg)
 
 
+# fan_out やバッチモードで記録して続行するエラー
+# (cmonkey の例外は BaseException を継承している)
+FAN_OUT_ERRORS = (
+    Exception,
+    ApiErrorException,
+    LoginFailedException,
+    RetryLimitExceededException,
+)
+
+
 class LoginMixin(object):
 
     def login(self, username, password, digest=False):
+        started = time.time()
+        api_req_params = self._login_request(username, password, digest)
+        r = self.request(*api_req_params)
+        session_key = self._login_session_key(username, r)
+        self._notify('login', username, time.time() - started)
+        return session_key
+
+    def _login_request(self, username, password, digest):
         params = {
             'response': 'json',
         }
@@ -167,7 +868,9 @@ class LoginMixin(object):
             'password': password,
             'domain': '/',
         }
-        r = self.request('POST', params, headers, data)
+        return ApiRequest('POST', params, headers, data)
+
+    def _login_session_key(self, username, r):
         if r.status_code != 200:
             msg = '\'%s\' can not login' % username
             raise LoginFailedException(msg)
@@ -181,50 +884,155 @@ class LoginMixin(object):
         return m.hexdigest()
 
 
-class CookieClient(ClientBase, LoginMixin):
+class SessionStateMixin(object):
+
+    # セッションが切れたときに CloudStack が返すステータスコード
+    SESSION_EXPIRED_STATUS_CODES = (401, 432)
+
+    def _init_session_state(self, session_ttl=None):
+        self.session_ttl = session_ttl
+        self._session_key = None
+        self._session_expires = None
+
+    def _session_valid(self):
+        if self._session_key is None:
+            return False
+        if self._session_expires is None:
+            return True
+        return time.time() < self._session_expires
+
+    def _store_session_key(self, session_key):
+        self._session_key = session_key
+        if self.session_ttl is not None:
+            self._session_expires = time.time() + self.session_ttl
+        return session_key
+
+    def _discard_session_key(self, session_key=None):
+        # 他の呼び出しが既にログインし直していれば何もしない
+        if session_key is not None and session_key != self._session_key:
+            return False
+        self._session_key = None
+        self._session_expires = None
+        return True
+
+    def _session_expired_response(self, response):
+        return response.status_code in self.SESSION_EXPIRED_STATUS_CODES
+
+
+class SessionCacheMixin(SessionStateMixin):
+
+    def __init__(self, session_ttl=None):
+        self._init_session_state(session_ttl)
+        self._session_lock = threading.Lock()
+
+    def session_key(self):
+        with self._session_lock:
+            if not self._session_valid():
+                self._store_session_key(self.login(
+                    self.username,
+                    self.password,
+                    self.digest,
+                ))
+            return self._session_key
+
+    def invalidate_session(self, session_key=None):
+        with self._session_lock:
+            if self._discard_session_key(session_key):
+                # JSESSIONID も古いセッションのものなので捨てる
+                self.session.cookies.clear()
+
+
+class CookieClient(ClientBase, LoginMixin, SessionCacheMixin):
 
     def __init__(self, entry_point, username, password,
-                 digest=False, async_block=True):
-        super(CookieClient, self).__init__(entry_point, async_block)
+                 digest=False, async_block=True, session_ttl=None, **kwargs):
+        super(CookieClient, self).__init__(entry_point, async_block,
+                                           **kwargs)
+        SessionCacheMixin.__init__(self, session_ttl)
         self.username = username
         self.password = password
         self.digest = digest
 
     def produce(self, command, params):
         params['command'] = command
-        session_key = self.login(self.username, self.password, self.digest)
-        params['sessionkey'] = session_key
+        params['sessionkey'] = self.session_key()
         return ApiRequest('GET', params, None, None)
 
+    def cache_namespace(self):
+        return '%s#%s' % (self.entry_point, self.username)
+
+    def _execute(self, command, params, stream=False):
+        api_req_params = self._produce(command, dict(params))
+        response = self._send(api_req_params, stream)
+        if self._session_expired_response(response):
+            msg = 'Session expired, login again: %s' % self.username
+            LOG.debug(msg)
+            response.close()
+            # 使ったセッションキーが古ければ捨ててログインし直す
+            self.invalidate_session(api_req_params.params['sessionkey'])
+            api_req_params = self._produce(command, dict(params))
+            response = self._send(api_req_params, stream)
+        return response
+
 
 class SignatureBuilder(object):
 
+    # 値があまり変わらないためエンコード結果をキャッシュするパラメータ
+    CACHED_KEYS = frozenset(['apikey', 'command', 'response'])
+    MAX_CACHED_PAIRS = 1024
+
     def __init__(self, apikey, secretkey):
         self.apikey = apikey
         self.secretkey = secretkey
+        # 秘密鍵を処理した HMAC をリクエスト毎にコピーして使う
+        self._hmac = hmac.new(secretkey.encode(), digestmod=hashlib.sha1)
+        self._apikey_pair = self._lower_pair('apikey', apikey)
+        self._pair_cache = {}
 
     def build(self, params):
-        if not 'apikey' in [k.lower() for k in params.keys()]:
+        pairs = self._lower_pairs(params)
+        return self._sign(pairs)
+
+    def build_many(self, params_list):
+        lower_pairs = self._lower_pairs
+        sign = self._sign
+        return [sign(lower_pairs(params)) for params in params_list]
+
+    def _lower_pairs(self, params):
+        pair_cache = self._pair_cache
+        cached_keys = self.CACHED_KEYS
+        has_apikey = False
+        lower_pairs = []
+        for k, v in params.items():
+            cache_key = None
+            if k in cached_keys and isinstance(v, six.string_types):
+                cache_key = (k, v)
+            pair = pair_cache.get(cache_key) if cache_key else None
+            if pair is None:
+                pair = self._lower_pair(k, v)
+                if cache_key and len(pair_cache) < self.MAX_CACHED_PAIRS:
+                    pair_cache[cache_key] = pair
+            if not has_apikey and pair.startswith('apikey='):
+                has_apikey = True
+            lower_pairs.append(pair)
+        if not has_apikey:
             params['apikey'] = self.apikey
-        # URL エンコードする
-        quoted_params = dict([
-            (k, parse.quote(v, safe=''))
-            for k, v in params.items()
-        ])
-        # lower case にする
-        lower_pairs = [
-            ('%s=%s' % (k, v)).lower()
-            for k, v in quoted_params.items()
-        ]
+            lower_pairs.append(self._apikey_pair)
+        return lower_pairs
+
+    def _lower_pair(self, k, v):
+        if not isinstance(v, (six.binary_type, six.text_type)):
+            v = six.text_type(v)
+        # URL エンコードして lower case にする
+        return ('%s=%s' % (k, parse.quote(v, safe=''))).lower()
+
+    def _sign(self, lower_pairs):
         # アルファベット順でソートする
-        sorted_pairs = sorted(lower_pairs)
-        query_string = '&'.join(sorted_pairs)
+        lower_pairs.sort()
+        query_string = '&'.join(lower_pairs)
         # SHA1 のハッシュを計算する
-        sha1hash = hmac.new(
-            self.secretkey.encode(),
-            query_string.encode(),
-            hashlib.sha1,
-        )
+        sha1hash = self._hmac.copy()
+        sha1hash.update(query_string.encode())
         digest = sha1hash.digest()
         # Base64 エンコードする
         signature = base64.b64encode(digest)
@@ -234,12 +1042,17 @@ class SignatureBuilder(object):
 
 class SignatureClient(ClientBase):
 
-    def __init__(self, entry_point, apikey, secretkey, async_block=True):
-        super(SignatureClient, self).__init__(entry_point, async_block)
+    def __init__(self, entry_point, apikey, secretkey, async_block=True,
+                 **kwargs):
+        super(SignatureClient, self).__init__(entry_point, async_block,
+                                              **kwargs)
         self.apikey = apikey
         self.secretkey = secretkey
         self.signature_builder = SignatureBuilder(apikey, secretkey)
 
+    def cache_namespace(self):
+        return '%s#%s' % (self.entry_point, self.apikey)
+
     def produce(self, command, params):
         params['command'] = command
         signature = self.signature_builder.build(params)
@@ -250,8 +1063,9 @@ class SignatureClient(ClientBase):
 
 class IntegrationClient(ClientBase):
 
-    def __init__(self, entry_point, async_block=True):
-        super(IntegrationClient, self).__init__(entry_point, async_block)
+    def __init__(self, entry_point, async_block=True, **kwargs):
+        super(IntegrationClient, self).__init__(entry_point, async_block,
+                                                **kwargs)
 
     def produce(self, command, params):
         params['command'] = command
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+# async/await 構文を使うため Python 3.8 以降でのみ利用できる
+
+import asyncio
+import collections
+import json
+import logging
+import sys
+from abc import ABCMeta, abstractmethod
+
+import six
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from cmonkey import (
+    AttributeInvokeMixin,
+    ApiRequest,
+    ApiResponse,
+    JobResult,
+    LoginMixin,
+    PollingPolicy,
+    RetryLimitExceededException,
+    SessionStateMixin,
+    SignatureBuilder,
+    JOB_STATUS_PENDING,
+    flight_key,
+    job_id_of,
+)
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncHttpResponse(collections.namedtuple('AsyncHttpResponse',
+                                               [
+                                                   'status_code',
+                                                   'headers',
+                                                   'content',
+                                               ]
+                                               )):
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class AsyncRequestMixin(object):
+
+    def __init__(self, max_concurrency=100):
+        self.max_concurrency = max_concurrency
+        self.session = None
+        self._semaphore = None
+
+    async def request(self, method=None, params=None, headers=None,
+                      data=None):
+        params = self._stringify(params or {})
+        headers = headers or {}
+        data = data or {}
+        session = self._get_session()
+        async with self._get_semaphore():
+            async with session.request(
+                method or 'GET',
+                self.entry_point,
+                params=params,
+                headers=headers,
+                data=data,
+            ) as response:
+                content = await response.read()
+                return AsyncHttpResponse(
+                    response.status,
+                    dict(response.headers),
+                    content,
+                )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _get_session(self):
+        # イベントループの中で作る必要があるため遅延させる
+        if self.session is None:
+            if aiohttp is None:
+                msg = 'aiohttp is required to use asynchronous clients'
+                raise ImportError(msg)
+            # エントリポイントが IP アドレスでも Cookie を受け取る
+            cookie_jar = aiohttp.CookieJar(unsafe=True)
+            self.session = aiohttp.ClientSession(cookie_jar=cookie_jar)
+        return self.session
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _stringify(self, params):
+        # aiohttp は文字列以外のクエリパラメータを受け付けない
+        return dict(
+            (k, v.decode() if isinstance(v, bytes) else str(v))
+            for k, v in params.items()
+        )
+
+
+class AsyncioBlockMixin(object):
+
+    async def query_job(self, job_id):
+        command = 'queryAsyncJobResult'
+        params = {
+            'response': 'json',
+            'jobid': job_id,
+        }
+        # 同じ JOB を待っているタスクとは問い合わせを共有する
+        content_body = await self._coalesce(self._query_job_body, command,
+                                            params)
+        return content_body['queryasyncjobresultresponse']
+
+    async def _query_job_body(self, command, params):
+        response = await self._execute(command, params)
+        return response.json()
+
+    async def block(self, response, retry=-1, interval=None, command=None):
+        job_id = job_id_of(response)
+        if not job_id:
+            msg = 'JOB id not found (maybe synchronous request)'
+            LOG.debug(msg)
+            return None
+        policy = PollingPolicy.resolve(self.polling_policy, interval)
+        deadline = policy.deadline()
+        intervals = policy.intervals(command)
+        retry = sys.maxsize if retry < 0 else retry
+        for _i in range(retry):
+            inner_content_body = await self.query_job(job_id)
+            job_status = inner_content_body['jobstatus']
+            if job_status != JOB_STATUS_PENDING:
+                msg = 'JOB status changed: %s' % job_status
+                LOG.debug(msg)
+                return JobResult.from_content_body(inner_content_body)
+            # 待っている間も他のリクエストは進められる
+            await asyncio.sleep(policy.wait_time(next(intervals), deadline))
+        raise RetryLimitExceededException('Retried %d times' % retry)
+
+    async def wait_jobs(self, jobs, retry=-1, interval=None):
+        job_bodies = [
+            job.content_body if isinstance(job, ApiResponse) else job
+            for job in jobs
+        ]
+        return await asyncio.gather(*[
+            self.block(content_body, retry, interval)
+            for content_body in job_bodies
+        ])
+
+
+class AsyncSingleFlight(object):
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _task: self._calls.pop(key, None))
+        # 待っているタスクが取り消されても共有のリクエストは続ける
+        return await asyncio.shield(task)
+
+
+@six.add_metaclass(ABCMeta)
+class AsyncClientBase(AttributeInvokeMixin,
+                      AsyncRequestMixin,
+                      AsyncioBlockMixin):
+
+    COALESCED_PREFIXES = ('list', 'get', 'query')
+
+    def __init__(self, entry_point, async_block=True, polling_policy=None,
+                 max_concurrency=100, coalesce=False):
+        super(AsyncClientBase, self).__init__(max_concurrency)
+        self.entry_point = entry_point
+        self.async_block = async_block
+        self.polling_policy = polling_policy
+        self._single_flight = AsyncSingleFlight() if coalesce else None
+
+    async def invoke(self, command, params):
+        params = dict(params)
+        params['response'] = 'json'
+        return await self._coalesce(self._invoke, command, params)
+
+    async def _coalesce(self, func, command, params):
+        single_flight = self._single_flight
+        if single_flight is None or \
+                not command.startswith(self.COALESCED_PREFIXES):
+            return await func(command, params)
+        key = flight_key(func.__name__, command, params)
+        return await single_flight.do(key, lambda: func(command, params))
+
+    async def _invoke(self, command, params):
+        # HTTP リクエスト
+        response = await self._execute(command, params)
+
+        # HTTP レスポンス
+        status_code = response.status_code
+        headers = response.headers
+        content_body = response.json()
+
+        job = None
+        if self.async_block:
+            job = await self.block(content_body, command=command)
+
+        return ApiResponse(status_code, headers, content_body, job)
+
+    async def _execute(self, command, params):
+        api_req_params = await self.produce(command, params)
+        return await self.request(
+            api_req_params.method,
+            api_req_params.params,
+            api_req_params.headers,
+            api_req_params.data,
+        )
+
+    @abstractmethod
+    async def produce(self, command, params):
+        return None
+
+
+class AsyncCookieClient(AsyncClientBase, LoginMixin, SessionStateMixin):
+
+    def __init__(self, entry_point, username, password,
+                 digest=False, async_block=True, session_ttl=None, **kwargs):
+        super(AsyncCookieClient, self).__init__(entry_point, async_block,
+                                                **kwargs)
+        self._init_session_state(session_ttl)
+        # イベントループの中で作る必要があるため遅延させる
+        self._session_lock = None
+        self.username = username
+        self.password = password
+        self.digest = digest
+
+    async def login(self, username, password, digest=False):
+        api_req_params = self._login_request(username, password, digest)
+        r = await self.request(*api_req_params)
+        return self._login_session_key(username, r)
+
+    async def session_key(self):
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        async with self._session_lock:
+            if not self._session_valid():
+                self._store_session_key(await self.login(
+                    self.username,
+                    self.password,
+                    self.digest,
+                ))
+            return self._session_key
+
+    def invalidate_session(self, session_key=None):
+        if self._discard_session_key(session_key):
+            if self.session is not None:
+                self.session.cookie_jar.clear()
+
+    async def produce(self, command, params):
+        params['command'] = command
+        params['sessionkey'] = await self.session_key()
+        return ApiRequest('GET', params, None, None)
+
+    async def _execute(self, command, params):
+        response = await super(AsyncCookieClient, self)._execute(command,
+                                                                 params)
+        if self._session_expired_response(response):
+            msg = 'Session expired, login again: %s' % self.username
+            LOG.debug(msg)
+            self.invalidate_session(params.get('sessionkey'))
+            response = await super(AsyncCookieClient, self)._execute(command,
+                                                                     params)
+        return response
+
+
+class AsyncSignatureClient(AsyncClientBase):
+
+    def __init__(self, entry_point, apikey, secretkey, async_block=True,
+                 **kwargs):
+        super(AsyncSignatureClient, self).__init__(entry_point, async_block,
+                                                   **kwargs)
+        self.apikey = apikey
+        self.secretkey = secretkey
+        self.signature_builder = SignatureBuilder(apikey, secretkey)
+
+    async def produce(self, command, params):
+        params['command'] = command
+        signature = self.signature_builder.build(params)
+        params['apikey'] = self.apikey
+        params['signature'] = signature
+        return ApiRequest('GET', params, None, None)
+
+
+class AsyncIntegrationClient(AsyncClientBase):
+
+    def __init__(self, entry_point, async_block=True, **kwargs):
+        super(AsyncIntegrationClient, self).__init__(entry_point, async_block,
+                                                     **kwargs)
+
+    async def produce(self, command, params):
+        params['command'] = command
+        return ApiRequest('GET', params, None, None)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import six
+
+
+class MemoryBackend(object):
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                return None
+            # 最近使ったものを末尾に移す
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteBackend(object):
+
+    def __init__(self, path, maxsize=1024):
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, '
+                'expires REAL, '
+                'accessed REAL, '
+                'value TEXT)'
+            )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT expires, value FROM responses WHERE key = ?',
+                (key, ),
+            ).fetchone()
+            if row is None:
+                return None
+            expires, value = row
+            with self._conn:
+                if expires <= now:
+                    self._conn.execute(
+                        'DELETE FROM responses WHERE key = ?', (key, ))
+                    return None
+                self._conn.execute(
+                    'UPDATE responses SET accessed = ? WHERE key = ?',
+                    (now, key),
+                )
+        return json.loads(value)
+
+    def set(self, key, value, expires):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (key, expires, time.time(), json.dumps(value)),
+            )
+            # 古いものから消して件数を抑える
+            self._conn.execute(
+                'DELETE FROM responses WHERE key IN ('
+                'SELECT key FROM responses ORDER BY accessed DESC '
+                'LIMIT -1 OFFSET ?)',
+                (self.maxsize, ),
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM responses')
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()
+        return row[0]
+
+
+class ResponseCache(object):
+
+    # 参照系でも結果が刻々と変わるのでキャッシュしないコマンド
+    VOLATILE_COMMANDS = frozenset([
+        'listAsyncJobs',
+        'queryAsyncJobResult',
+        'listEvents',
+        'listAlerts',
+        'listUsageRecords',
+        'getVMPassword',
+    ])
+    READ_PREFIXES = ('list', 'get')
+    # 同じ結果になるためキーに含めないパラメータ
+    IGNORED_PARAMS = frozenset([
+        'response',
+        'sessionkey',
+        'signature',
+        'apikey',
+    ])
+
+    def __init__(self, backend=None, ttl=60.0, ttls=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cacheable(self, command):
+        if command in self.ttls:
+            return self.ttls[command] > 0
+        if command in self.VOLATILE_COMMANDS:
+            return False
+        return command.startswith(self.READ_PREFIXES) and self.ttl > 0
+
+    def key(self, namespace, command, params):
+        pairs = sorted(
+            (k, six.text_type(v)) for k, v in params.items()
+            if k not in self.IGNORED_PARAMS
+        )
+        raw = json.dumps([namespace, command, pairs])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, namespace, command, params):
+        value = self.backend.get(self.key(namespace, command, params))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, namespace, command, params, value):
+        ttl = self.ttls.get(command, self.ttl)
+        key = self.key(namespace, command, params)
+        self.backend.set(key, value, time.time() + ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.backend),
+            }
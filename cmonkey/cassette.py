@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import gzip
+import json
+import re
+import threading
+import time
+import zlib
+
+from cmonkey import FAN_OUT_ERRORS
+from cmonkey.lite import LiteHeaders
+
+FORMAT_VERSION = 1
+REDACTED = '<redacted>'
+# 記録しない認証情報 (小文字で比べる)
+REDACTED_PARAMS = frozenset([
+    'signature',
+    'sessionkey',
+    'password',
+    'apikey',
+    'secretkey',
+])
+_COOKIE_VALUE = re.compile(r'(^|,\s*)([^=;,\s]+)=([^;,]*)')
+
+
+class CassetteMissException(Exception):
+
+    def __init__(self, msg):
+        super(CassetteMissException, self).__init__(msg)
+
+
+def redact(params):
+    # 送信されるときと同じく値は文字列にする
+    return dict(
+        (k, REDACTED if k.lower() in REDACTED_PARAMS else '%s' % v)
+        for k, v in (params or {}).items()
+    )
+
+
+def _redact_value(value):
+    if isinstance(value, dict):
+        return dict(
+            (k, REDACTED if k.lower() in REDACTED_PARAMS
+             else _redact_value(v))
+            for k, v in value.items()
+        )
+    if isinstance(value, list):
+        return [_redact_value(v) for v in value]
+    return value
+
+
+def _redact_body(text):
+    # ログインのレスポンスにはセッションキーが含まれる
+    try:
+        content_body = json.loads(text)
+    except ValueError:
+        return text
+    return json.dumps(_redact_value(content_body))
+
+
+def _redact_headers(headers):
+    redacted = {}
+    for name, value in headers.items():
+        if name.lower() == 'set-cookie':
+            value = _COOKIE_VALUE.sub(
+                lambda m: '%s%s=%s' % (m.group(1), m.group(2), REDACTED),
+                value,
+            )
+        redacted[name] = value
+    return redacted
+
+
+def request_key(method, params, data):
+    # 認証情報は毎回変わるので照合に使わない
+    def stripped(values):
+        return sorted(
+            (k, '%s' % v) for k, v in (values or {}).items()
+            if k.lower() not in REDACTED_PARAMS
+        )
+    return json.dumps([method or 'GET', stripped(params), stripped(data)])
+
+
+def read_records(path):
+    with gzip.open(path, 'rb') as f:
+        lines = iter(f.readline, b'')
+        try:
+            for line in lines:
+                record = json.loads(line.decode('utf-8'))
+                if 'cassette' in record:
+                    # 先頭はヘッダ
+                    continue
+                yield record
+        except (EOFError, zlib.error):
+            # 閉じられずに終わったファイルでも書き込まれた分は読む
+            return
+
+
+class CassetteRecorder(object):
+
+    def __init__(self, path, entry_point=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wb')
+        self._started = time.time()
+        self.records = 0
+        self._write({
+            'cassette': FORMAT_VERSION,
+            'entry_point': entry_point,
+            'started': self._started,
+        })
+
+    def session(self, factory):
+        return _RecordingSession(self, factory())
+
+    def record(self, method, params, data, response, started, elapsed):
+        content = response.content
+        encoding = response.encoding or 'utf-8'
+        self._write({
+            'offset': started - self._started,
+            'elapsed': elapsed,
+            'method': method or 'GET',
+            'params': redact(params),
+            'data': redact(data),
+            'status': response.status_code,
+            'headers': _redact_headers(dict(response.headers)),
+            'body': _redact_body(content.decode(encoding, 'replace')),
+        })
+
+    def _write(self, record):
+        line = json.dumps(record, sort_keys=True).encode('utf-8') + b'\n'
+        with self._lock:
+            self._file.write(line)
+            if 'cassette' not in record:
+                self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _RecordingSession(object):
+
+    def __init__(self, recorder, session):
+        self.recorder = recorder
+        self._session = session
+
+    @property
+    def adapters(self):
+        return self._session.adapters
+
+    @property
+    def cookies(self):
+        return self._session.cookies
+
+    def request(self, method, url, params=None, headers=None, data=None,
+                timeout=None, stream=False):
+        started = time.time()
+        response = self._session.request(
+            method, url, params=params, headers=headers, data=data,
+            timeout=timeout, stream=stream,
+        )
+        # ストリーミングでも本文を読み込んでから記録する
+        response.content
+        elapsed = time.time() - started
+        self.recorder.record(method, params, data, response, started,
+                             elapsed)
+        return response
+
+    def close(self):
+        self._session.close()
+
+
+class ReplayResponse(object):
+
+    def __init__(self, record):
+        self.status_code = record['status']
+        self.headers = LiteHeaders(record['headers'])
+        self.encoding = 'utf-8'
+        self.content = record['body'].encode('utf-8')
+
+    def json(self):
+        return json.loads(self.content.decode(self.encoding))
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class CassettePlayer(object):
+
+    def __init__(self, path, speed=None):
+        self.path = path
+        # None なら待たずに返し、1.0 なら記録したときと同じだけ待つ
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._responses = collections.defaultdict(collections.deque)
+        self.records = 0
+        for record in read_records(path):
+            key = request_key(record['method'], record['params'],
+                              record['data'])
+            self._responses[key].append(record)
+            self.records += 1
+        self.served = 0
+
+    def session(self, factory):
+        # 通信しないので元のセッションは作らない
+        return _ReplaySession(self)
+
+    def response(self, method, params, data):
+        key = request_key(method, params, data)
+        with self._lock:
+            records = self._responses.get(key)
+            if not records:
+                command = (params or {}).get('command') or \
+                    (data or {}).get('command')
+                msg = 'No recorded response: %s %s' % (method, command)
+                raise CassetteMissException(msg)
+            # 同じリクエストは記録した順に返し、最後のものは繰り返す
+            record = records.popleft() if len(records) > 1 else records[0]
+            self.served += 1
+        if self.speed:
+            time.sleep(record['elapsed'] / self.speed)
+        return ReplayResponse(record)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _ReplaySession(object):
+
+    adapters = {}
+
+    def __init__(self, player):
+        self.player = player
+        self.cookies = {}
+
+    def request(self, method, url, params=None, headers=None, data=None,
+                timeout=None, stream=False):
+        return self.player.response(method, params, data)
+
+    def close(self):
+        pass
+
+
+class ReplayedCall(collections.namedtuple('ReplayedCall',
+                                          ['command',
+                                           'params',
+                                           'response',
+                                           'error',
+                                           'elapsed'])):
+    pass
+
+
+def recorded_calls(path, speed=1.0):
+    # 記録したときの間隔で (時刻, コマンド, パラメータ) を返す
+    for record in read_records(path):
+        params = dict(record['params'])
+        params.update(record['data'])
+        command = params.pop('command', None)
+        if not command or command == 'login':
+            continue
+        params = dict(
+            (k, v) for k, v in params.items()
+            if k.lower() not in REDACTED_PARAMS and k != 'response'
+        )
+        offset = record['offset'] / speed if speed else 0.0
+        yield offset, command, params
+
+
+def replay_load(client, path, speed=1.0, workers=8):
+    # 記録したトラフィックを同じ間隔 (speed 倍の速さ) で別のサーバに送る
+    from concurrent import futures
+    executor = futures.ThreadPoolExecutor(workers)
+    started = time.time()
+    submitted = []
+    try:
+        for offset, command, params in recorded_calls(path, speed):
+            delay = started + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            submitted.append(executor.submit(
+                _timed_invoke, client, command, params))
+        for future in submitted:
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True)
+
+
+def _timed_invoke(client, command, params):
+    started = time.time()
+    try:
+        response = client.invoke(command, params)
+        error = None
+    except FAN_OUT_ERRORS as e:
+        response, error = None, e
+    return ReplayedCall(command, params, response, error,
+                        time.time() - started)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import itertools
+import logging
+import threading
+import time
+
+from six.moves import http_client
+
+from cmonkey import (
+    AttributeInvokeMixin,
+    FanOutResult,
+    FAN_OUT_ERRORS,
+    imap_ordered,
+    job_id_of,
+)
+
+LOG = logging.getLogger(__name__)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_OUTSTANDING = 'least_outstanding'
+
+# ノードの障害とみなすエラー (requests の例外は IOError を継承している)
+NODE_ERRORS = (
+    IOError,
+    OSError,
+    http_client.HTTPException,
+    # HTML のエラーページなど JSON として読めないレスポンス
+    ValueError,
+)
+# ノードの障害とみなすステータスコード (530 番台は CloudStack のエラーなのでそのまま返す)
+GATEWAY_ERROR_STATUS = frozenset([502, 503, 504])
+# 別のノードで送り直しても安全なコマンド
+IDEMPOTENT_PREFIXES = ('list', 'get', 'query')
+# 結果を待っている JOB とノードの対応を覚えておく数
+MAX_PINNED_JOBS = 10000
+
+
+class NoAvailableNodeException(BaseException):
+
+    def __init__(self, msg):
+        super(NoAvailableNodeException, self).__init__(msg)
+
+
+class Node(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        self.ejected_until = 0.0
+
+    @property
+    def entry_point(self):
+        return self.client.entry_point
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+    def stats(self, now):
+        return {
+            'entry_point': self.entry_point,
+            'available': self.available(now),
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'latency': self.latency,
+        }
+
+
+class ClusterClient(AttributeInvokeMixin):
+
+    def __init__(self, clients, strategy=ROUND_ROBIN, max_failures=3,
+                 eject_seconds=30.0, slow_threshold=None,
+                 health_command='listCapabilities',
+                 health_check_interval=None):
+        if not clients:
+            raise ValueError('No clients')
+        if strategy not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError('Unknown strategy: %s' % strategy)
+        self.nodes = [Node(client) for client in clients]
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        # 平均のレイテンシ (秒) がこれを超えたノードも外す
+        self.slow_threshold = slow_threshold
+        self.health_command = health_command
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._job_nodes = collections.OrderedDict()
+        self._health_checker = None
+        self._stopped = threading.Event()
+        if health_check_interval:
+            self._start_health_checker(health_check_interval)
+
+    @classmethod
+    def create(cls, client_cls, entry_points, *args, **kwargs):
+        # ノード毎にクライアント (接続とログインのセッション) を持つ
+        cluster_options = dict(
+            (k, kwargs.pop(k)) for k in list(kwargs)
+            if k in ('strategy', 'max_failures', 'eject_seconds',
+                     'slow_threshold', 'health_command',
+                     'health_check_interval')
+        )
+        clients = [client_cls(entry_point, *args, **kwargs)
+                   for entry_point in entry_points]
+        return cls(clients, **cluster_options)
+
+    def invoke(self, command, params, stream=False):
+        idempotent = command.startswith(IDEMPOTENT_PREFIXES)
+        tried = set()
+        while True:
+            node = self._acquire(tried)
+            tried.add(node)
+            started = time.time()
+            try:
+                api_response = node.client.invoke(command, params, stream)
+            except NODE_ERRORS as e:
+                self._release(node, None, failed=True)
+                # 状態を変更するコマンドは二重に実行されないよう送り直さない
+                if not idempotent or len(tried) >= len(self.nodes):
+                    raise
+                LOG.debug('Retry on another node: %s: %s',
+                          node.entry_point, e)
+                continue
+            except BaseException:
+                self._release(node, None, failed=False)
+                raise
+            failed = api_response.status_code in GATEWAY_ERROR_STATUS
+            # JOB の待ち合わせを含む時間はノードの速さの指標にしない
+            elapsed = time.time() - started if idempotent else None
+            self._release(node, elapsed, failed=failed)
+            if failed and idempotent and len(tried) < len(self.nodes):
+                continue
+            self._pin_job(api_response, node)
+            return api_response
+
+    def query_job(self, job_id):
+        return self._job_node(job_id).client.query_job(job_id)
+
+    def block(self, response, retry=-1, interval=None, command=None):
+        job_id = job_id_of(response)
+        node = self._job_node(job_id)
+        try:
+            return node.client.block(response, retry, interval, command)
+        finally:
+            with self._lock:
+                self._job_nodes.pop(job_id, None)
+
+    def map(self, command, params_iterable, workers=8):
+        return list(imap_ordered(
+            lambda params: self.invoke(command, params),
+            params_iterable,
+            workers,
+        ))
+
+    def fan_out(self, command, params_iterable, workers=8):
+        return imap_ordered(
+            lambda params: self._fan_out_call(command, params),
+            params_iterable,
+            workers,
+        )
+
+    def _fan_out_call(self, command, params):
+        try:
+            return FanOutResult(params, self.invoke(command, params), None)
+        except FAN_OUT_ERRORS as e:
+            return FanOutResult(params, None, e)
+
+    def _acquire(self, tried):
+        with self._lock:
+            node = self._choose(tried)
+            node.outstanding += 1
+            node.requests += 1
+            return node
+
+    def _choose(self, tried):
+        # self._lock を取ってから呼ぶ
+        now = time.time()
+        candidates = [n for n in self.nodes
+                      if n.available(now) and n not in tried]
+        if not candidates:
+            # 全て外れていたら最も早く戻るノードに送る
+            candidates = sorted(
+                (n for n in self.nodes if n not in tried),
+                key=lambda n: n.ejected_until,
+            )[:1]
+        if not candidates:
+            raise NoAvailableNodeException('No available node')
+        start = next(self._round_robin)
+        rotated = [candidates[(start + i) % len(candidates)]
+                   for i in range(len(candidates))]
+        if self.strategy == LEAST_OUTSTANDING:
+            return min(rotated, key=lambda n: n.outstanding)
+        return rotated[0]
+
+    def _release(self, node, elapsed, failed):
+        with self._lock:
+            node.outstanding -= 1
+            if failed:
+                node.failures += 1
+                node.consecutive_failures += 1
+                if node.consecutive_failures >= self.max_failures:
+                    self._eject(node, 'failed %d times' %
+                                node.consecutive_failures)
+                return
+            node.consecutive_failures = 0
+            if elapsed is None:
+                return
+            # 指数移動平均
+            node.latency = elapsed if node.latency is None \
+                else node.latency * 0.8 + elapsed * 0.2
+            if self.slow_threshold is not None and \
+                    node.latency > self.slow_threshold:
+                self._eject(node, 'latency %.3f sec' % node.latency)
+                # 戻したときに前の値で再び外さない
+                node.latency = None
+
+    def _eject(self, node, reason):
+        LOG.warning('Eject %s for %.1f sec: %s', node.entry_point,
+                    self.eject_seconds, reason)
+        node.ejected_until = time.time() + self.eject_seconds
+
+    def _pin_job(self, api_response, node):
+        if api_response.job is not None:
+            # 待ち合わせが済んでいる
+            return
+        job_id = job_id_of(api_response.content_body) \
+            if isinstance(api_response.content_body, dict) else None
+        if not job_id:
+            return
+        with self._lock:
+            self._job_nodes[job_id] = node
+            while len(self._job_nodes) > MAX_PINNED_JOBS:
+                self._job_nodes.popitem(last=False)
+
+    def _job_node(self, job_id):
+        # JOB を登録したノードに問い合わせる (外れていれば他のノード)
+        now = time.time()
+        with self._lock:
+            node = self._job_nodes.get(job_id)
+            if node is not None and node.available(now):
+                return node
+            return self._choose(set())
+
+    def check_health(self):
+        # 外したノードも含めて全て確かめて、応答したノードは戻す
+        healthy = {}
+        for node in self.nodes:
+            started = time.time()
+            try:
+                api_response = node.client.invoke(self.health_command, {})
+                ok = api_response.status_code == 200
+            except FAN_OUT_ERRORS as e:
+                LOG.debug('Health check failed: %s: %s', node.entry_point, e)
+                ok = False
+            elapsed = time.time() - started
+            slow = self.slow_threshold is not None and \
+                elapsed > self.slow_threshold
+            with self._lock:
+                if ok and not slow:
+                    node.ejected_until = 0.0
+                    node.consecutive_failures = 0
+                elif node.available(time.time()):
+                    self._eject(node, 'health check')
+            healthy[node.entry_point] = ok and not slow
+        return healthy
+
+    def _start_health_checker(self, interval):
+        def run():
+            while not self._stopped.wait(interval):
+                self.check_health()
+        self._health_checker = threading.Thread(target=run)
+        self._health_checker.daemon = True
+        self._health_checker.start()
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return [node.stats(now) for node in self.nodes]
+
+    def close(self):
+        self._stopped.set()
+        if self._health_checker is not None:
+            self._health_checker.join()
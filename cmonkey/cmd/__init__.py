@@ -6,13 +6,44 @@ from __future__ import print_function
 import os
 import sys
 import json
+import shlex
+import itertools
 import collections
 import argparse
 
 from cmonkey import (
+    ApiResponse,
+    JobResult,
     SignatureClient,
     CookieClient,
-    IntegrationClient
+    IntegrationClient,
+    PollingPolicy,
+    FAN_OUT_ERRORS,
+    imap_ordered,
+)
+
+# daemon に渡してクライアントを作り直すのに使うオプション
+DAEMON_CLIENT_ARGS = (
+    'authentication_type',
+    'entry_point',
+    'api_key',
+    'secret_key',
+    'username',
+    'password',
+    'digested_password',
+    'no_block_asynchronous',
+    'poll_min_interval',
+    'poll_max_interval',
+    'poll_timeout',
+    'pool_size',
+    'pool_maxsize',
+    'connect_timeout',
+    'read_timeout',
+    'max_retries',
+    'rate_limit',
+    'max_in_flight',
+    'cache',
+    'cache_ttl',
 )
 
 
@@ -20,12 +51,81 @@ def _request(args):
     call_parameters = collections.deque(args.parameters)
     api_command = call_parameters.popleft()
     api_args = _analyze_parameters(call_parameters)
-    # クライアントを取得する
-    client = _get_client(args)
-    # API を実行する
-    api_method = getattr(client, api_command)
-    api_response = api_method(**api_args)
+    api_response = None
+    if _use_daemon(args):
+        # 起動している daemon の温まったクライアントで実行する
+        api_response = _forward(args, api_command, api_args)
+    if api_response is None:
+        # クライアントを取得する
+        client = _get_client(args)
+        # API を実行する
+        api_method = getattr(client, api_command)
+        api_response = api_method(**api_args)
     # レスポンスを表示する
+    return _format_response(args, api_response)
+
+
+def _use_daemon(args):
+    # 手元で計測や記録をするときは daemon を使わない
+    if args.no_daemon or args.timings or args.record or args.replay:
+        return False
+    if _bench(args):
+        return False
+    from cmonkey.daemon import trusted_socket
+    return trusted_socket(_socket_path(args))
+
+
+def _socket_path(args):
+    if args.socket:
+        return args.socket
+    from cmonkey.daemon import default_socket_path
+    return default_socket_path()
+
+
+def _forward(args, api_command, api_args):
+    from cmonkey.daemon import forward, DaemonUnavailableException
+    client_spec = dict(
+        (name, getattr(args, name)) for name in DAEMON_CLIENT_ARGS
+    )
+    try:
+        reply = forward(_socket_path(args), client_spec, api_command,
+                        api_args)
+    except DaemonUnavailableException:
+        # daemon が止まっていれば自分で実行する
+        return None
+    job = None
+    if reply['job'] is not None:
+        job = JobResult.from_content_body(reply['job'])
+    return ApiResponse(
+        reply['status_code'],
+        reply['headers'],
+        reply['content_body'],
+        job,
+    )
+
+
+def _run_daemon(args):
+    from cmonkey.daemon import Daemon
+    socket_path = _socket_path(args)
+    daemon = Daemon(socket_path, _daemon_client).bind()
+    print('Listening on %s' % socket_path, file=sys.stderr)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def _daemon_client(client_spec):
+    # 渡されなかったオプションは既定値にする
+    values = vars(_arg_parser().parse_args([]))
+    values.update(client_spec)
+    values['daemon'] = True
+    values['metrics'] = None
+    values['cassette'] = None
+    return _get_client(argparse.Namespace(**values))
+
+
+def _format_response(args, api_response):
     response = {}
     if not args.hide_status_code:
         response['status-code'] = api_response.status_code
@@ -33,10 +133,211 @@ def _request(args):
         response['headers'] = api_response.headers
     if not args.hide_content_body:
         response['content-body'] = api_response.content_body
+        if api_response.job is not None:
+            response['job-result'] = api_response.job.content_body
+
+    return response
+
 
+def _request_all_pages(args):
+    call_parameters = collections.deque(args.parameters)
+    api_command = call_parameters.popleft()
+    api_args = _analyze_parameters(call_parameters)
+    # クライアントを取得する
+    client = _get_client(args)
+    if args.page_workers > 1:
+        # 残りのページを並列に取得する
+        pages = client.iter_pages_parallel(
+            api_command,
+            api_args,
+            pagesize=args.page_size,
+            workers=args.page_workers,
+        )
+        return (item for items in pages for item in items)
+    # 全てのページを順に取得する
+    return client.iter_list(
+        api_command,
+        pagesize=args.page_size,
+        prefetch=True,
+        **api_args
+    )
+
+
+def _request_foreach(args):
+    call_parameters = collections.deque(args.parameters)
+    api_command = call_parameters.popleft()
+    api_args = _analyze_parameters(call_parameters)
+    foreach = _analyze_foreach(args.foreach)
+    # クライアントと接続は全ての組み合わせで使い回す
+    client = _get_client(args)
+    results = client.fan_out(
+        api_command,
+        _foreach_params(api_args, foreach),
+        args.parallel or 1,
+    )
+    keys = [key for key, _values in foreach]
+    for result in results:
+        response = {
+            'params': dict((key, result.params[key]) for key in keys),
+        }
+        if result.succeeded:
+            response.update(_format_response(args, result.response))
+        else:
+            response['error'] = '%s' % result.error
+        yield response
+
+
+def _analyze_foreach(foreach_options):
+    # key=v1,v2,... を (key, [v1, v2, ...]) にする
+    foreach = []
+    for option in foreach_options:
+        key, sep, values = option.partition('=')
+        if not sep or not key or not values:
+            _invalid_argument('--foreach %s' % option)
+        foreach.append((key, values.split(',')))
+    return foreach
+
+
+def _foreach_params(api_args, foreach):
+    keys = [key for key, _values in foreach]
+    # 複数指定されたら全ての組み合わせで実行する
+    for values in itertools.product(*[values for _key, values in foreach]):
+        params = dict(api_args)
+        params.update(zip(keys, values))
+        yield params
+
+
+def _workflow_path(args):
+    # cmonkey run workflow.yaml
+    if len(args.parameters) == 2 and args.parameters[0] == 'run' and \
+            '=' not in args.parameters[1]:
+        return args.parameters[1]
+    return None
+
+
+def _request_workflow(args):
+    from cmonkey.workflow import DEFAULT_WORKERS, WorkflowRunner, \
+        load_workflow
+    workflow = load_workflow(_workflow_path(args))
+    # --parallel を指定しなければワークフローに書かれた並列数で実行する
+    if args.parallel is None:
+        args.parallel = workflow.workers or DEFAULT_WORKERS
+    runner = WorkflowRunner(_get_client(args), args.parallel)
+    for result in runner.iter_run(workflow):
+        response = {
+            'step': result.name,
+            'status': result.status,
+            'attempts': result.attempts,
+            'elapsed': result.elapsed,
+        }
+        if result.error is not None:
+            response['error'] = '%s' % result.error
+        else:
+            response['output'] = result.output
+        yield response
+
+
+def _bench(args):
+    # cmonkey bench
+    return args.parameters == ['bench']
+
+
+def _analyze_mix(mix_options):
+    # [重み:]コマンド key=value ... (重みの既定値は 1)
+    commands = []
+    for option in mix_options or ['listZones']:
+        weight, _sep, line = option.partition(':')
+        try:
+            weight = float(weight)
+        except ValueError:
+            weight, line = 1.0, option
+        api_command, api_args = _analyze_batch_line(line.strip())
+        commands.append((weight, api_command, api_args))
+    return commands
+
+
+def _request_bench(args):
+    from cmonkey.loadgen import CommandMix
+    mix = CommandMix(_analyze_mix(args.mix))
+    if not args.fake_server:
+        return _load(args, mix)
+    # 手元の代わりのサーバに負荷をかける
+    from cmonkey.fakeserver import FakeCloudStack
+    server = FakeCloudStack(
+        apikey=args.api_key,
+        secretkey=args.secret_key,
+        username=args.username,
+        password=args.password,
+        job_duration=0.1,
+    )
+    with server:
+        args.entry_point = server.entry_point
+        return _load(args, mix)
+
+
+def _load(args, mix):
+    from cmonkey.loadgen import LoadGenerator
+    generator = LoadGenerator(
+        _get_client(args),
+        mix,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        requests=args.requests,
+    )
+    return generator.run()
+
+
+def _request_batch(args):
+    # クライアントと接続は全てのコマンドで使い回す
+    client = _get_client(args)
+    stream = sys.stdin if args.batch == '-' else open(args.batch)
+    try:
+        results = imap_ordered(
+            lambda entry: _batch_call(args, client, *entry),
+            enumerate(stream, 1),
+            args.parallel or 1,
+        )
+        for result in results:
+            if result is not None:
+                yield result
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _batch_call(args, client, line_number, line):
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    response = {
+        'line': line_number,
+    }
+    try:
+        api_command, api_args = _analyze_batch_line(line)
+        response['command'] = api_command
+        api_response = client.invoke(api_command, api_args)
+        response.update(_format_response(args, api_response))
+    except FAN_OUT_ERRORS as e:
+        # 失敗しても残りのコマンドは実行する
+        response['error'] = '%s' % e
     return response
 
 
+def _analyze_batch_line(line):
+    if line.startswith('{'):
+        # JSON Lines 形式: {"command": "listUsers", "account": "admin"}
+        api_args = json.loads(line)
+        api_command = api_args.pop('command', None)
+        if not api_command:
+            _invalid_parameter('command')
+        return api_command, api_args
+    call_parameters = collections.deque(shlex.split(line))
+    api_command = call_parameters.popleft()
+    api_args = _analyze_parameters(call_parameters)
+    return api_command, api_args
+
+
 def _analyze_parameters(call_parameters):
     api_args = {}
     for call_param in call_parameters:
@@ -78,10 +379,113 @@ def _get_client(args):
         ),
     }
     client_cls, init_args = clients[args.authentication_type]
-    return client_cls(*init_args)
+    init_kwargs = {
+        'polling_policy': _get_polling_policy(args),
+        'cache': _get_cache(args),
+        'observers': [args.metrics] if args.metrics else None,
+    }
+    init_kwargs.update(_get_request_options(args))
+    return client_cls(*init_args, **init_kwargs)
+
+
+def _get_request_options(args):
+    # 並列に実行するときはその数だけ接続を使い回せるようにする
+    pool_maxsize = args.pool_maxsize or max(
+        10,
+        args.parallel or 1,
+        args.page_workers,
+        args.concurrency,
+    )
+    timeout = None
+    if args.connect_timeout is not None or args.read_timeout is not None:
+        timeout = (args.connect_timeout, args.read_timeout)
+    return {
+        'pool_connections': args.pool_size,
+        'pool_maxsize': pool_maxsize,
+        'timeout': timeout,
+        'max_retries': args.max_retries,
+        'throttle': _get_throttle(args),
+        'lightweight': _single_shot(args),
+        'cassette': args.cassette,
+    }
+
+
+def _single_shot(args):
+    # 1 回だけ実行するときは requests を読み込まずに済ませる
+    if args.batch or args.all_pages or args.foreach or args.daemon:
+        return False
+    if _workflow_path(args) or _bench(args):
+        return False
+    if args.max_retries:
+        return False
+    # プロキシや CA 証明書の設定は requests でなければ読まれない
+    from cmonkey.lite import supported_environment
+    return supported_environment()
+
+
+def _get_throttle(args):
+    if not args.rate_limit and not args.max_in_flight:
+        return None
+    from cmonkey.throttle import Throttle
+    return Throttle.shared(
+        args.entry_point,
+        rate=args.rate_limit,
+        max_in_flight=args.max_in_flight,
+    )
+
+
+def _get_cache(args):
+    if not args.cache:
+        return None
+    # 呼び出しをまたいで使えるようにファイルに保存する
+    from cmonkey.cache import ResponseCache, SqliteBackend
+    backend = SqliteBackend(os.path.expanduser(args.cache))
+    return ResponseCache(backend, ttl=args.cache_ttl)
+
+
+def _get_polling_policy(args):
+    policy = PollingPolicy(timeout=args.poll_timeout)
+    if args.poll_min_interval is not None:
+        policy.min_interval = args.poll_min_interval
+    if args.poll_max_interval is not None:
+        policy.max_interval = args.poll_max_interval
+    policy.max_interval = max(policy.min_interval, policy.max_interval)
+    return policy
 
 
 def _parse_args():
+    args = _arg_parser().parse_args()
+    if args.fake_server:
+        _fake_server_credentials(args)
+    _validate(args)
+    args.metrics = None
+    if args.timings:
+        from cmonkey.metrics import MetricsCollector
+        args.metrics = MetricsCollector()
+    args.cassette = _get_cassette(args)
+
+    return args
+
+
+def _fake_server_credentials(args):
+    # 指定されなければ代わりのサーバの既定値を使う
+    args.api_key = args.api_key or 'apikey'
+    args.secret_key = args.secret_key or 'secretkey'
+    args.username = args.username or 'admin'
+    args.password = args.password or 'password'
+
+
+def _get_cassette(args):
+    if args.replay:
+        from cmonkey.cassette import CassettePlayer
+        return CassettePlayer(args.replay, args.replay_speed)
+    if args.record:
+        from cmonkey.cassette import CassetteRecorder
+        return CassetteRecorder(args.record, args.entry_point)
+    return None
+
+
+def _arg_parser():
     description = 'Simple client script for Apache CloudStack'
     arg_parser = argparse.ArgumentParser(description=description)
 
@@ -187,20 +591,282 @@ def _parse_args():
         help=option_n_help,
     )
 
+    option_poll_min_help = 'Minimum polling interval (default: 0.2)'
+    arg_parser.add_argument(
+        '--poll-min-interval',
+        type=float,
+        required=False, default=None,
+        help=option_poll_min_help,
+    )
+
+    option_poll_max_help = 'Maximum polling interval (default: 10.0)'
+    arg_parser.add_argument(
+        '--poll-max-interval',
+        type=float,
+        required=False, default=None,
+        help=option_poll_max_help,
+    )
+
+    option_poll_timeout_help = 'Asynchronous job timeout (default: None)'
+    arg_parser.add_argument(
+        '--poll-timeout',
+        type=float,
+        required=False, default=None,
+        help=option_poll_timeout_help,
+    )
+
+    option_all_pages_help = 'Print all items of list command line by line'
+    arg_parser.add_argument(
+        '--all-pages',
+        action='store_true',
+        required=False, default=False,
+        help=option_all_pages_help,
+    )
+
+    option_page_size_help = 'Page size used with --all-pages (default: 500)'
+    arg_parser.add_argument(
+        '--page-size',
+        type=int,
+        required=False, default=None,
+        help=option_page_size_help,
+    )
+
+    option_page_workers_help = 'Pages fetched in parallel (default: 1)'
+    arg_parser.add_argument(
+        '--page-workers',
+        type=int,
+        required=False, default=1,
+        help=option_page_workers_help,
+    )
+
+    option_batch_help = 'Run commands read from the file (\'-\': stdin)'
+    arg_parser.add_argument(
+        '--batch',
+        type=str,
+        required=False, default=None,
+        help=option_batch_help,
+    )
+
+    option_foreach_help = 'Run the command for each value (key=v1,v2,...)'
+    arg_parser.add_argument(
+        '--foreach',
+        action='append',
+        required=False, default=[],
+        help=option_foreach_help,
+    )
+
+    option_parallel_help = 'Parallelism of --batch/--foreach (default: 1) ' \
+        'and run (default: workers of the workflow or 16)'
+    arg_parser.add_argument(
+        '--parallel',
+        type=int,
+        required=False, default=None,
+        help=option_parallel_help,
+    )
+
+    option_pool_size_help = 'Connection pools to cache (default: 10)'
+    arg_parser.add_argument(
+        '--pool-size',
+        type=int,
+        required=False, default=10,
+        help=option_pool_size_help,
+    )
+
+    option_pool_maxsize_help = 'Max connections per host (default: 10)'
+    arg_parser.add_argument(
+        '--pool-maxsize',
+        type=int,
+        required=False, default=None,
+        help=option_pool_maxsize_help,
+    )
+
+    option_connect_timeout_help = 'Connect timeout seconds (default: None)'
+    arg_parser.add_argument(
+        '--connect-timeout',
+        type=float,
+        required=False, default=None,
+        help=option_connect_timeout_help,
+    )
+
+    option_read_timeout_help = 'Read timeout seconds (default: None)'
+    arg_parser.add_argument(
+        '--read-timeout',
+        type=float,
+        required=False, default=None,
+        help=option_read_timeout_help,
+    )
+
+    option_max_retries_help = 'Retries on connection error (default: 0)'
+    arg_parser.add_argument(
+        '--max-retries',
+        type=int,
+        required=False, default=0,
+        help=option_max_retries_help,
+    )
+
+    option_rate_limit_help = 'Max requests per second (default: None)'
+    arg_parser.add_argument(
+        '--rate-limit',
+        type=float,
+        required=False, default=None,
+        help=option_rate_limit_help,
+    )
+
+    option_max_in_flight_help = 'Max concurrent requests (default: None)'
+    arg_parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        required=False, default=None,
+        help=option_max_in_flight_help,
+    )
+
+    option_cache_help = 'Cache list/get responses in the file'
+    environ_cache = os.environ.get('CLOUDSTACK_API_CACHE')
+    arg_parser.add_argument(
+        '--cache',
+        type=str,
+        required=False, default=environ_cache,
+        help=option_cache_help,
+    )
+
+    option_cache_ttl_help = 'Seconds to keep cached responses (default: 60)'
+    arg_parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        required=False, default=60.0,
+        help=option_cache_ttl_help,
+    )
+
+    option_timings_help = 'Print a timing summary to stderr'
+    arg_parser.add_argument(
+        '--timings',
+        action='store_true',
+        required=False, default=False,
+        help=option_timings_help,
+    )
+
+    option_record_help = 'Record requests and responses to a file'
+    arg_parser.add_argument(
+        '--record',
+        type=str,
+        required=False, default=None,
+        help=option_record_help,
+    )
+
+    option_replay_help = 'Replay responses from a recorded file'
+    arg_parser.add_argument(
+        '--replay',
+        type=str,
+        required=False, default=None,
+        help=option_replay_help,
+    )
+
+    option_replay_speed_help = 'Replay with recorded latency scaled by ' \
+                               'this speed (default: no wait)'
+    arg_parser.add_argument(
+        '--replay-speed',
+        type=float,
+        required=False, default=None,
+        help=option_replay_speed_help,
+    )
+
+    option_mix_help = 'Command of "cmonkey bench" ([WEIGHT:]command ' \
+                      'key=value ...)'
+    arg_parser.add_argument(
+        '--mix',
+        action='append',
+        required=False, default=[],
+        help=option_mix_help,
+    )
+
+    option_rate_help = 'Requests per second of "cmonkey bench" ' \
+                       '(open loop, default: closed loop)'
+    arg_parser.add_argument(
+        '--rate',
+        type=float,
+        required=False, default=None,
+        help=option_rate_help,
+    )
+
+    option_concurrency_help = 'Concurrent requests of "cmonkey bench" ' \
+                              '(default: 8)'
+    arg_parser.add_argument(
+        '--concurrency',
+        type=int,
+        required=False, default=8,
+        help=option_concurrency_help,
+    )
+
+    option_duration_help = 'Seconds to run "cmonkey bench" (default: 10)'
+    arg_parser.add_argument(
+        '--duration',
+        type=float,
+        required=False, default=10.0,
+        help=option_duration_help,
+    )
+
+    option_requests_help = 'Requests to send by "cmonkey bench"'
+    arg_parser.add_argument(
+        '--requests',
+        type=int,
+        required=False, default=None,
+        help=option_requests_help,
+    )
+
+    option_fake_server_help = 'Run "cmonkey bench" against a local ' \
+                              'stand-in server'
+    arg_parser.add_argument(
+        '--fake-server',
+        action='store_true',
+        required=False, default=False,
+        help=option_fake_server_help,
+    )
+
+    option_daemon_help = 'Run as a daemon keeping clients warm'
+    arg_parser.add_argument(
+        '--daemon',
+        action='store_true',
+        required=False, default=False,
+        help=option_daemon_help,
+    )
+
+    option_socket_help = 'Unix socket of the daemon'
+    arg_parser.add_argument(
+        '--socket',
+        type=str,
+        required=False, default=None,
+        help=option_socket_help,
+    )
+
+    option_no_daemon_help = 'Do not forward the request to the daemon'
+    arg_parser.add_argument(
+        '--no-daemon',
+        action='store_true',
+        required=False, default=False,
+        help=option_no_daemon_help,
+    )
+
     parameters_help = 'command and key=value pairs'
     arg_parser.add_argument(
         'parameters',
-        nargs='+',
+        nargs='*',
         help=parameters_help,
     )
 
-    args = arg_parser.parse_args()
-    _validate(args)
-
-    return args
+    return arg_parser
 
 
 def _validate(args):
+    # daemon は接続してきたクライアントの認証情報を使う
+    if args.daemon:
+        return
+    # バッチモード以外ではコマンドが必要
+    if not args.batch:
+        _require_argument(args.parameters, 'parameters')
+    if args.record and args.replay:
+        _invalid_argument('--record/--replay')
+    # --foreach の書式はリクエストを出す前に確かめる
+    _analyze_foreach(args.foreach)
     # 認証タイプ別のバリデーション
     auth_types = {
         'signature': _validate_params_signature,
@@ -256,11 +922,49 @@ def _invalid(entry, reason):
 def main():
     try:
         args = _parse_args()
-        response = _request(args)
-        indent = 4 if args.pretty_print else None
-        print(json.dumps(response, indent=indent))
+        try:
+            _run(args)
+        finally:
+            if args.metrics is not None:
+                print(args.metrics.format_summary(), file=sys.stderr)
+            if args.cassette is not None:
+                args.cassette.close()
     except BaseException as e:
         print('Error: %s' % e, file=sys.stderr)
 
+
+def _run(args):
+    if args.daemon:
+        _run_daemon(args)
+        return
+    indent = 4 if args.pretty_print else None
+    if args.batch:
+        for response in _request_batch(args):
+            print(json.dumps(response))
+            sys.stdout.flush()
+        return
+    if args.foreach:
+        for response in _request_foreach(args):
+            print(json.dumps(response))
+            sys.stdout.flush()
+        return
+    if _bench(args):
+        from cmonkey.loadgen import format_report
+        report = _request_bench(args)
+        print(format_report(report), file=sys.stderr)
+        print(json.dumps(report, indent=indent))
+        return
+    if _workflow_path(args):
+        for response in _request_workflow(args):
+            print(json.dumps(response))
+            sys.stdout.flush()
+        return
+    if args.all_pages:
+        for item in _request_all_pages(args):
+            print(json.dumps(item, indent=indent))
+        return
+    response = _request(args)
+    print(json.dumps(response, indent=indent))
+
 if __name__ == '__main__':
     main()
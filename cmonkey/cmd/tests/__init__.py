@@ -1,13 +1,42 @@
 # -*- coding: utf-8 -*-
 
+import json
 import sys
+import tempfile
 
 import nose
+import six
 from nose.tools.trivial import eq_, ok_
 from nose.tools.nontrivial import raises
 
-from cmonkey.cmd import _parse_args, _request, _get_client
-from cmonkey import SignatureClient, CookieClient, IntegrationClient
+from cmonkey.cmd import (
+    _daemon_client,
+    _get_client,
+    _parse_args,
+    _request,
+    _analyze_mix,
+    _request_batch,
+    _request_bench,
+    _request_foreach,
+    _request_workflow,
+    _single_shot,
+    main,
+)
+from cmonkey.daemon import DaemonUnavailableException
+from cmonkey.fakeserver import FakeCloudStack
+from cmonkey import (
+    ApiResponse,
+    DeadlineExceededException,
+    FanOutResult,
+    SignatureClient,
+    CookieClient,
+    IntegrationClient,
+)
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
 
 
 class Test_Main(object):
@@ -151,6 +180,494 @@ class Test_Main(object):
         client = _get_client(args)
         ok_(isinstance(client, CookieClient))
 
+    def test_get_client_polling_policy(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--poll-min-interval', '0.5',
+            '--poll-timeout', '60',
+            'deployVirtualMachine',
+        ]
+        args = _parse_args()
+        client = _get_client(args)
+        eq_(client.polling_policy.min_interval, 0.5)
+        eq_(client.polling_policy.max_interval, 10.0)
+        eq_(client.polling_policy.timeout, 60)
+
+    def test_parse_all_pages(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--all-pages',
+            '--page-size', '100',
+            'listVirtualMachines',
+        ]
+        args = _parse_args()
+        eq_(args.all_pages, True)
+        eq_(args.page_size, 100)
+
+    @raises(ValueError)
+    def test_parse_error_required_parameters(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+        ]
+        _parse_args()
+
+    def test_batch(self):
+        lines = [
+            '# comment',
+            'listUsers account=admin',
+            '',
+            '{"command": "listZones", "available": "true"}',
+            'listUsers a',
+        ]
+        batch_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt')
+        batch_file.write('\n'.join(lines))
+        batch_file.flush()
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--batch', batch_file.name,
+            '--parallel', '2',
+            '-d',
+        ]
+        args = _parse_args()
+        # モックアウト
+        client = mock.Mock()
+        client.invoke = mock.Mock(return_value=ApiResponse(200, {}, {}))
+        with mock.patch('cmonkey.cmd._get_client', return_value=client):
+            # 実行
+            results = list(_request_batch(args))
+        batch_file.close()
+        # 検証
+        eq_(len(results), 3)
+        eq_(results[0], {
+            'line': 2,
+            'command': 'listUsers',
+            'status-code': 200,
+            'content-body': {},
+        })
+        eq_(results[1]['line'], 4)
+        eq_(results[1]['command'], 'listZones')
+        eq_(results[2]['line'], 5)
+        ok_('error' in results[2])
+        calls = [
+            mock.call('listUsers', {'account': 'admin'}),
+            mock.call('listZones', {'available': 'true'}),
+        ]
+        client.invoke.assert_has_calls(calls, any_order=True)
+        eq_(client.invoke.call_count, 2)
+
+    def test_foreach(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--foreach', 'zoneid=z1,z2',
+            '--foreach', 'type=Routing',
+            '--parallel', '4',
+            '-d',
+            'listHosts',
+            'listall=true',
+        ]
+        args = _parse_args()
+
+        # モックアウト
+        def fan_out(command, params_iterable, workers):
+            for params in params_iterable:
+                if params['zoneid'] == 'z2':
+                    error = DeadlineExceededException('Deadline exceeded')
+                    yield FanOutResult(params, None, error)
+                else:
+                    response = ApiResponse(200, {}, {})
+                    yield FanOutResult(params, response, None)
+        client = mock.Mock()
+        client.fan_out = mock.Mock(side_effect=fan_out)
+        with mock.patch('cmonkey.cmd._get_client', return_value=client):
+            # 実行
+            results = list(_request_foreach(args))
+        # 検証
+        eq_(results, [
+            {
+                'params': {'zoneid': 'z1', 'type': 'Routing'},
+                'status-code': 200,
+                'content-body': {},
+            },
+            {
+                'params': {'zoneid': 'z2', 'type': 'Routing'},
+                'error': 'Deadline exceeded',
+            },
+        ])
+        eq_(client.fan_out.call_args[0][0], 'listHosts')
+        eq_(client.fan_out.call_args[0][2], 4)
+
+    def test_foreach_product(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--foreach', 'zoneid=z1,z2',
+            '--foreach', 'type=Routing,Storage',
+            'listHosts',
+        ]
+        args = _parse_args()
+        # モックアウト
+        client = mock.Mock()
+        client.fan_out = mock.Mock(return_value=[])
+        with mock.patch('cmonkey.cmd._get_client', return_value=client):
+            # 実行
+            list(_request_foreach(args))
+        # 検証
+        params_list = list(client.fan_out.call_args[0][1])
+        eq_(len(params_list), 4)
+        ok_({'zoneid': 'z2', 'type': 'Storage'} in params_list)
+
+    @raises(ValueError)
+    def test_parse_error_invalid_foreach(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--foreach', 'zoneid',
+            'listHosts',
+        ]
+        _parse_args()
+
+    def test_run_workflow(self):
+        workflow_file = tempfile.NamedTemporaryFile(mode='w', suffix='.json')
+        workflow_file.write(json.dumps({
+            'steps': [
+                {'name': 'network', 'command': 'createNetwork'},
+                {'name': 'tags', 'command': 'createTags',
+                 'params': {'resourceids': '${network.network.id}'}},
+            ],
+        }))
+        workflow_file.flush()
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            'run', workflow_file.name,
+        ]
+        args = _parse_args()
+        # モックアウト
+        client = mock.Mock()
+        client.invoke = mock.Mock(side_effect=[
+            ApiResponse(200, {}, {
+                'createnetworkresponse': {'network': {'id': 'net-1'}},
+            }),
+            ApiResponse(200, {}, {'createtagsresponse': {}}),
+        ])
+        with mock.patch('cmonkey.cmd._get_client', return_value=client):
+            # 実行
+            results = list(_request_workflow(args))
+        # 検証
+        eq_([(r['step'], r['status']) for r in results],
+            [('network', 'succeeded'), ('tags', 'succeeded')])
+        eq_(results[0]['output'], {'network': {'id': 'net-1'}})
+        client.invoke.assert_called_with('createTags',
+                                         {'resourceids': 'net-1'})
+        eq_(_single_shot(args), False)
+        eq_(args.parallel, 16)
+        # --parallel 1 なら直列に実行する
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--parallel', '1',
+            'run', workflow_file.name,
+        ]
+        args = _parse_args()
+        with mock.patch('cmonkey.cmd._get_client', return_value=client), \
+                mock.patch('cmonkey.workflow.WorkflowRunner') as runner:
+            runner.return_value.iter_run.return_value = []
+            list(_request_workflow(args))
+        workflow_file.close()
+        eq_(runner.call_args[0][1], 1)
+
+    def test_record_and_replay(self):
+        cassette_file = tempfile.NamedTemporaryFile(suffix='.ndjson.gz')
+        options = [
+            '-a', 'apikey',
+            '-s', 'secretkey',
+            '--no-daemon',
+            '-d',
+            'listZones',
+            'page=1',
+            'pagesize=1',
+        ]
+        outputs = []
+        with FakeCloudStack() as server:
+            for cassette_options in [
+                ['--record', cassette_file.name],
+                ['--replay', cassette_file.name],
+            ]:
+                sys.argv = ['cmonkey', '-e', server.entry_point] + \
+                    cassette_options + options
+                stdout = six.StringIO()
+                # 実行
+                with mock.patch('sys.stdout', stdout):
+                    main()
+                outputs.append(json.loads(stdout.getvalue()))
+            stats = server.stats()
+        cassette_file.close()
+        # 検証
+        eq_(outputs[0], outputs[1])
+        eq_(outputs[1]['content-body']['listzonesresponse']['count'], 100)
+        # 再生したときはサーバにリクエストを送らない
+        eq_(stats['requests'], 1)
+
+    def test_all_pages_error(self):
+        with FakeCloudStack() as server:
+            sys.argv = [
+                'cmonkey',
+                '-e', server.entry_point,
+                '-a', 'apikey',
+                '-s', 'wrongkey',
+                '--no-daemon',
+                '--all-pages',
+                'listZones',
+            ]
+            stdout = six.StringIO()
+            stderr = six.StringIO()
+            # 実行
+            with mock.patch('sys.stdout', stdout), \
+                    mock.patch('sys.stderr', stderr):
+                main()
+        # 検証
+        # エラーのレスポンスを空の一覧として表示しない
+        eq_(stdout.getvalue(), '')
+        eq_(stderr.getvalue(), 'Error: listZones: '
+            'unable to verify user credentials\n')
+
+    @raises(ValueError)
+    def test_parse_error_record_and_replay(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--record', 'a.ndjson.gz',
+            '--replay', 'b.ndjson.gz',
+            'listZones',
+        ]
+        _parse_args()
+
+    def test_analyze_mix(self):
+        # 実行
+        mix = _analyze_mix([
+            '5:listVirtualMachines page=1 pagesize=20',
+            'listZones',
+            '{"command": "listHosts", "type": "Routing"}',
+        ])
+        # 検証
+        eq_(mix, [
+            (5.0, 'listVirtualMachines', {'page': '1', 'pagesize': '20'}),
+            (1.0, 'listZones', {}),
+            (1.0, 'listHosts', {'type': 'Routing'}),
+        ])
+
+    def test_bench_fake_server(self):
+        sys.argv = [
+            'cmonkey',
+            '--fake-server',
+            '--requests', '10',
+            '--concurrency', '2',
+            '--mix', 'listZones',
+            'bench',
+        ]
+        args = _parse_args()
+        # 実行
+        report = _request_bench(args)
+        # 検証
+        eq_(report['requests'], 10)
+        eq_(report['errors'], 0)
+        eq_(report['commands']['listZones']['requests'], 10)
+
+    def test_get_client_request_options(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--parallel', '32',
+            '--connect-timeout', '3',
+            '--read-timeout', '30',
+            '--max-retries', '2',
+            'listZones',
+        ]
+        args = _parse_args()
+        client = _get_client(args)
+        adapter = client.session.get_adapter(args.entry_point)
+        eq_(adapter._pool_maxsize, 32)
+        eq_(adapter.max_retries.connect, 2)
+        eq_(client.timeout, (3, 30))
+
+    def test_batch_deadline_exceeded(self):
+        batch_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt')
+        batch_file.write('deployVirtualMachine\nlistZones\n')
+        batch_file.flush()
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--batch', batch_file.name,
+        ]
+        args = _parse_args()
+        # モックアウト
+        client = mock.Mock()
+        client.invoke = mock.Mock(side_effect=[
+            DeadlineExceededException('Deadline exceeded (1 sec)'),
+            ApiResponse(200, {}, {}),
+        ])
+        with mock.patch('cmonkey.cmd._get_client', return_value=client):
+            # 実行
+            results = list(_request_batch(args))
+        batch_file.close()
+        # 検証
+        eq_(len(results), 2)
+        eq_(results[0]['error'], 'Deadline exceeded (1 sec)')
+        eq_(results[1]['status-code'], 200)
+
+    def test_get_client_cache(self):
+        cache_file = tempfile.NamedTemporaryFile(suffix='.sqlite')
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--cache', cache_file.name,
+            '--cache-ttl', '300',
+            'listZones',
+        ]
+        args = _parse_args()
+        client = _get_client(args)
+        eq_(client.cache.ttl, 300)
+        eq_(client.cache.backend.path, cache_file.name)
+        client.cache.backend.close()
+        cache_file.close()
+
+    def test_get_client_throttle(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '-e', 'http://throttled.example.com/client/api',
+            '--rate-limit', '20',
+            '--max-in-flight', '4',
+            'listZones',
+        ]
+        args = _parse_args()
+        client = _get_client(args)
+        eq_(client.throttle._bucket.rate, 20)
+        # 同じエントリポイントのクライアントで共有する
+        ok_(_get_client(args).throttle is client.throttle)
+
+    def test_get_client_lightweight(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            'listZones',
+        ]
+        # モックアウト
+        with mock.patch('cmonkey.lite.supported_environment',
+                        return_value=True):
+            ok_(_get_client(_parse_args()).lightweight)
+        # プロキシなどを設定しているときは requests を使う
+        with mock.patch('cmonkey.lite.supported_environment',
+                        return_value=False):
+            ok_(not _get_client(_parse_args()).lightweight)
+        # 接続を使い回すときは requests を使う
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--all-pages',
+            'listZones',
+        ]
+        ok_(not _get_client(_parse_args()).lightweight)
+
+    def test_request_daemon(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--socket', __file__,
+            '-d',
+            'listZones', 'available=true',
+        ]
+        args = _parse_args()
+        reply = {
+            'status_code': 200,
+            'headers': {},
+            'content_body': {'listzonesresponse': {}},
+            'job': None,
+        }
+        # モックアウト
+        with mock.patch('cmonkey.daemon.forward',
+                        return_value=reply) as forward, \
+                mock.patch('cmonkey.daemon.trusted_socket',
+                           return_value=True):
+            # 実行
+            response = _request(args)
+        # 検証
+        eq_(response, {
+            'status-code': 200,
+            'content-body': {'listzonesresponse': {}},
+        })
+        client_spec, command, params = forward.call_args[0][1:]
+        eq_(client_spec['authentication_type'], 'integration')
+        eq_((command, params), ('listZones', {'available': 'true'}))
+
+    def test_request_daemon_unavailable(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--socket', __file__,
+            'listZones',
+        ]
+        args = _parse_args()
+        client = mock.Mock()
+        client.listZones = mock.Mock(return_value=ApiResponse(200, {}, {}))
+        # モックアウト
+        forward = mock.Mock(side_effect=DaemonUnavailableException('down'))
+        with mock.patch('cmonkey.daemon.forward', forward), \
+                mock.patch('cmonkey.daemon.trusted_socket',
+                           return_value=True), \
+                mock.patch('cmonkey.cmd._get_client', return_value=client):
+            # 実行
+            response = _request(args)
+        # 検証
+        # daemon が応答しなければ自分で実行する
+        eq_(response['status-code'], 200)
+        eq_(client.listZones.call_count, 1)
+
+    def test_request_daemon_untrusted(self):
+        sys.argv = [
+            'cmonkey',
+            '-t', 'integration',
+            '--socket', __file__,
+            'listZones',
+        ]
+        args = _parse_args()
+        client = mock.Mock()
+        client.listZones = mock.Mock(return_value=ApiResponse(200, {}, {}))
+        # モックアウト
+        forward = mock.Mock()
+        with mock.patch('cmonkey.daemon.forward', forward), \
+                mock.patch('cmonkey.cmd._get_client', return_value=client):
+            # 実行
+            response = _request(args)
+        # 検証
+        # ソケットでないファイルには認証情報を送らない
+        eq_(response['status-code'], 200)
+        eq_(forward.call_count, 0)
+
+    def test_parse_daemon(self):
+        sys.argv = [
+            'cmonkey',
+            '--daemon',
+        ]
+        args = _parse_args()
+        ok_(args.daemon)
+
+    def test_daemon_client(self):
+        client = _daemon_client({
+            'authentication_type': 'cookie',
+            'entry_point': 'http://localhost:8080/client/api',
+            'username': 'admin',
+            'password': 'password',
+        })
+        ok_(isinstance(client, CookieClient))
+        # daemon では接続を使い回す
+        ok_(not client.lightweight)
+
     def test_get_client_integration(self):
         sys.argv = [
             'cmonkey',
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+
+import six
+
+# 値の種類がこれより多いフィールド (id など) は共有しても効果がない
+DEFAULT_INTERN_LIMIT = 4096
+
+
+class Interner(object):
+
+    def __init__(self, limit=DEFAULT_INTERN_LIMIT):
+        self.limit = limit
+        self._values = {}
+        self.enabled = True
+
+    def __call__(self, value):
+        if not self.enabled or not isinstance(value, six.string_types):
+            return value
+        interned = self._values.get(value)
+        if interned is not None:
+            return interned
+        if len(self._values) >= self.limit:
+            # 使い回されない値ばかりなので表を捨てる
+            self.enabled = False
+            self._values = {}
+            return value
+        self._values[value] = value
+        return value
+
+
+class Projection(object):
+
+    def __init__(self, fields, intern_limit=DEFAULT_INTERN_LIMIT,
+                 name='Row'):
+        self.fields = tuple(fields)
+        # フィールド名が識別子として使えなければ _0, _1 ... になる
+        self.record = collections.namedtuple(name, self.fields, rename=True)
+        self._interners = [Interner(intern_limit) for _ in self.fields]
+
+    def __call__(self, item):
+        return self.record._make([
+            intern(item.get(field))
+            for field, intern in zip(self.fields, self._interners)
+        ])
+
+    def iter(self, items):
+        # 元の辞書は 1 件ずつ捨てられる
+        for item in items:
+            yield self(item)
+
+    def project(self, items):
+        return list(self.iter(items))
+
+
+def project(items, fields, intern_limit=DEFAULT_INTERN_LIMIT):
+    return Projection(fields, intern_limit).project(items)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import socket
+import stat
+import threading
+
+from six.moves import socketserver
+
+
+def default_socket_path():
+    path = os.environ.get('CLOUDSTACK_API_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'cmonkey.sock')
+    # 共有の /tmp には直接置かずに自分だけが使えるディレクトリを作る
+    tmpdir = os.environ.get('TMPDIR', '/tmp')
+    return os.path.join(tmpdir, 'cmonkey-%d' % os.getuid(), 'cmonkey.sock')
+
+
+def _private(st):
+    # 自分が所有していて、グループと他人には権限がない
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def trusted_socket(socket_path):
+    # 他のユーザが先に作ったソケットに認証情報を送らない
+    try:
+        st = os.lstat(socket_path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and _private(st)
+
+
+class DaemonUnavailableException(Exception):
+
+    def __init__(self, msg):
+        super(DaemonUnavailableException, self).__init__(msg)
+
+
+class DaemonErrorException(Exception):
+
+    def __init__(self, msg):
+        super(DaemonErrorException, self).__init__(msg)
+
+
+def forward(socket_path, client_spec, command, params):
+    message = {
+        'client': client_spec,
+        'command': command,
+        'params': params,
+    }
+    if not trusted_socket(socket_path):
+        msg = '%s: not a socket owned only by the current user' % socket_path
+        raise DaemonUnavailableException(msg)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error as e:
+            raise DaemonUnavailableException('%s: %s' % (socket_path, e))
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        reader = sock.makefile('rb')
+        try:
+            line = reader.readline()
+        finally:
+            reader.close()
+    finally:
+        sock.close()
+    if not line:
+        raise DaemonUnavailableException('%s: no response' % socket_path)
+    reply = json.loads(line.decode('utf-8'))
+    if 'error' in reply:
+        raise DaemonErrorException(reply['error'])
+    return reply
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # 1 行に 1 件の JSON でリクエストを受け取る
+        for line in iter(self.rfile.readline, b''):
+            reply = self.server.cmonkey_daemon.execute(json.loads(line.decode()))
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+
+class Daemon(object):
+
+    def __init__(self, socket_path, client_factory):
+        self.socket_path = socket_path
+        self.client_factory = client_factory
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def client(self, client_spec):
+        # エントリポイントと認証情報毎にクライアントを使い回す
+        key = json.dumps(client_spec, sort_keys=True)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.client_factory(client_spec)
+                self._clients[key] = client
+            return client
+
+    def execute(self, message):
+        try:
+            client = self.client(message['client'])
+            api_response = client.invoke(message['command'],
+                                         message.get('params') or {})
+        except BaseException as e:
+            if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                raise
+            return {'error': '%s' % e}
+        job = api_response.job
+        return {
+            'status_code': api_response.status_code,
+            'headers': api_response.headers,
+            'content_body': api_response.content_body,
+            'job': job.content_body if job is not None else None,
+        }
+
+    def bind(self):
+        self._prepare_directory()
+        self._remove_stale_socket()
+        # 認証情報を受け取るので自分以外は接続できないようにする
+        umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(self.socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        self._server.cmonkey_daemon = self
+        return self
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            self._server.serve_forever(poll_interval=poll_interval)
+        finally:
+            self.close()
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def close(self):
+        self._server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def _prepare_directory(self):
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+        # 他人がソケットを差し替えられるディレクトリには置かない
+        st = os.lstat(directory)
+        shared = st.st_mode & 0o022 and not st.st_mode & stat.S_ISVTX
+        if not stat.S_ISDIR(st.st_mode) or \
+                st.st_uid not in (os.getuid(), 0) or shared:
+            msg = 'directory is not safe for the socket: %s' % directory
+            raise DaemonErrorException(msg)
+
+    def _remove_stale_socket(self):
+        try:
+            os.lstat(self.socket_path)
+        except OSError:
+            return
+        if not trusted_socket(self.socket_path):
+            # 自分のものでないファイルは消さない
+            msg = 'not a socket owned only by the current user: %s' % \
+                self.socket_path
+            raise DaemonErrorException(msg)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            # 前回の daemon が残したファイル
+            os.remove(self.socket_path)
+            return
+        finally:
+            sock.close()
+        msg = 'daemon is already running: %s' % self.socket_path
+        raise DaemonErrorException(msg)
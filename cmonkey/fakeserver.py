@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import itertools
+import json
+import threading
+import time
+import uuid
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib import parse
+
+from cmonkey import SignatureBuilder
+
+# テストやベンチマークで使う CloudStack の代わりの HTTP サーバ
+
+JOB_STATUS_PENDING = 0
+JOB_STATUS_SUCCEEDED = 1
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # ヘッダとボディを別々に送っても遅延させない
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        query = self.path.partition('?')[2]
+        self._handle(self._parse(query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        params = self._parse(self.path.partition('?')[2])
+        params.update(self._parse(body))
+        self._handle(params)
+
+    def _parse(self, query):
+        return dict(parse.parse_qsl(query, keep_blank_values=True))
+
+    def _handle(self, params):
+        cookie = self.headers.get('Cookie') or ''
+        status_code, content_body, headers = self.server.cloudstack.handle(
+            params,
+            cookie,
+        )
+        body = json.dumps(content_body).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeCloudStack(object):
+
+    def __init__(self, apikey='apikey', secretkey='secretkey',
+                 username='admin', password='password', integration=True,
+                 items=100, job_duration=0.0, latency=0.0,
+                 session_ttl=None, host='127.0.0.1', port=0):
+        self.apikey = apikey
+        self.username = username
+        self.password = password
+        self.integration = integration
+        self.items = items
+        self.job_duration = job_duration
+        self.latency = latency
+        self.session_ttl = session_ttl
+        self._signature_builder = SignatureBuilder(apikey, secretkey)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._jobs = collections.OrderedDict()
+        self._job_ids = itertools.count(1)
+        self.requests = 0
+        self.logins = 0
+        self.commands = collections.Counter()
+        self._server = _HTTPServer((host, port), _Handler)
+        self._server.cloudstack = self
+        self._thread = None
+
+    @property
+    def entry_point(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d/client/api' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            # 停止を待たされないように短くする
+            kwargs={'poll_interval': 0.05},
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'logins': self.logins,
+                'commands': dict(self.commands),
+            }
+
+    def handle(self, params, cookie=''):
+        if self.latency:
+            time.sleep(self.latency)
+        command = params.get('command', '')
+        with self._lock:
+            self.requests += 1
+            self.commands[command] += 1
+        if command == 'login':
+            return self._login(params)
+        if not self._authenticated(params, cookie):
+            return self._error(command, 401, 'unable to verify user '
+                                             'credentials')
+        handler = {
+            'listAsyncJobs': self._list_async_jobs,
+            'queryAsyncJobResult': self._query_async_job_result,
+        }.get(command)
+        if handler is not None:
+            return handler(params)
+        if command.startswith('list'):
+            return self._list(command, params)
+        return self._start_job(command, params)
+
+    def _authenticated(self, params, cookie):
+        if 'signature' in params:
+            signed = dict(params)
+            signature = signed.pop('signature')
+            if signed.get('apikey') != self.apikey:
+                return False
+            expected = self._signature_builder.build(signed)
+            return expected.decode() == signature
+        if 'sessionkey' in params:
+            return self._session_valid(params['sessionkey'], cookie)
+        return self.integration
+
+    def _login(self, params):
+        password = params.get('password')
+        digest = hashlib.md5(self.password.encode()).hexdigest()
+        valid = params.get('username') == self.username and \
+            password in (self.password, digest)
+        if not valid:
+            return self._error('login', 531, 'Failed to authenticate user')
+        session_key = uuid.uuid4().hex
+        jsessionid = uuid.uuid4().hex
+        with self._lock:
+            self.logins += 1
+            self._sessions[session_key] = (jsessionid, time.time())
+        content_body = {
+            'loginresponse': {
+                'sessionkey': session_key,
+                'username': self.username,
+                'timeout': str(self.session_ttl or 1800),
+            }
+        }
+        headers = [
+            ('Set-Cookie', 'JSESSIONID=%s; Path=/client' % jsessionid),
+        ]
+        return 200, content_body, headers
+
+    def _session_valid(self, session_key, cookie):
+        with self._lock:
+            session = self._sessions.get(session_key)
+            if session is None:
+                return False
+            jsessionid, created = session
+            if self.session_ttl is not None and \
+                    time.time() - created > self.session_ttl:
+                del self._sessions[session_key]
+                return False
+        return 'JSESSIONID=%s' % jsessionid in cookie
+
+    def expire_sessions(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def _list(self, command, params):
+        entity = command[len('list'):].lower()
+        if entity.endswith('s'):
+            entity = entity[:-1]
+        items = [
+            {
+                'id': '%s-%d' % (entity, i),
+                'name': '%s%d' % (entity, i),
+                'state': 'Running',
+            }
+            for i in self._page_range(params, self.items)
+        ]
+        inner = {'count': self.items}
+        if items:
+            inner[entity] = items
+        return 200, {'%sresponse' % command.lower(): inner}, []
+
+    def _page_range(self, params, count):
+        if 'page' not in params:
+            return range(count)
+        page = int(params['page'])
+        pagesize = int(params.get('pagesize', 500))
+        start = (page - 1) * pagesize
+        return range(min(start, count), min(start + pagesize, count))
+
+    def _start_job(self, command, params):
+        job_id = 'job-%d' % next(self._job_ids)
+        with self._lock:
+            self._jobs[job_id] = (command, time.time())
+        content_body = {
+            '%sresponse' % command.lower(): {
+                'jobid': job_id,
+            }
+        }
+        return 200, content_body, []
+
+    def _job(self, job_id):
+        command, created = self._jobs[job_id]
+        done = time.time() - created >= self.job_duration
+        job = {
+            'jobid': job_id,
+            'cmd': command,
+            'jobstatus': JOB_STATUS_SUCCEEDED if done else JOB_STATUS_PENDING,
+        }
+        if done:
+            job['jobresult'] = {'success': True}
+        return job
+
+    def _list_async_jobs(self, params):
+        with self._lock:
+            job_ids = list(self._jobs)
+            jobs = [self._job(job_id) for job_id in job_ids]
+        content_body = {
+            'listasyncjobsresponse': {
+                'count': len(jobs),
+                'asyncjobs': jobs,
+            }
+        }
+        return 200, content_body, []
+
+    def _query_async_job_result(self, params):
+        job_id = params.get('jobid')
+        with self._lock:
+            if job_id not in self._jobs:
+                return self._error('queryAsyncJobResult', 431,
+                                   'Unable to find job %s' % job_id)
+            job = self._job(job_id)
+        return 200, {'queryasyncjobresultresponse': job}, []
+
+    def _error(self, command, errorcode, errortext):
+        content_body = {
+            '%sresponse' % command.lower(): {
+                'errorcode': errorcode,
+                'errortext': errortext,
+            }
+        }
+        return errorcode, content_body, []
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from cmonkey import check_api_response, list_items_of
+
+
+class EntityType(collections.namedtuple('EntityType',
+                                        ['name',
+                                         'list_command',
+                                         'instance_type',
+                                         'event_prefixes'])):
+    pass
+
+
+# instance_type は JOB の jobinstancetype とイベントの resourcetype の値
+DEFAULT_ENTITY_TYPES = (
+    EntityType('virtualmachine', 'listVirtualMachines', 'VirtualMachine',
+               ('VM.', )),
+    EntityType('volume', 'listVolumes', 'Volume',
+               ('VOLUME.', )),
+    EntityType('publicipaddress', 'listPublicIpAddresses', 'IpAddress',
+               ('NET.IPASSIGN', 'NET.IPRELEASE', 'STATICNAT.')),
+    EntityType('network', 'listNetworks', 'Network',
+               ('NETWORK.', )),
+)
+
+# ID を指定した一覧で対象が見つからないときに返すバージョンがある
+PARAM_ERROR_STATUS = 431
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+
+class Change(collections.namedtuple('Change',
+                                    ['kind',
+                                     'entity_type',
+                                     'id',
+                                     'before',
+                                     'after'])):
+    pass
+
+
+def _digest(item):
+    encoded = json.dumps(item, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class InventorySnapshot(object):
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entities ('
+                'type TEXT, '
+                'id TEXT, '
+                'digest TEXT, '
+                'body TEXT, '
+                'PRIMARY KEY (type, id))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'key TEXT PRIMARY KEY, '
+                'value TEXT)'
+            )
+
+    def get(self, entity_type, entity_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest, body FROM entities '
+                'WHERE type = ? AND id = ?',
+                (entity_type, entity_id),
+            ).fetchone()
+        if row is None:
+            return None, None
+        digest, body = row
+        return digest, json.loads(body)
+
+    def ids(self, entity_type):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id FROM entities WHERE type = ?',
+                (entity_type, ),
+            ).fetchall()
+        return set(row[0] for row in rows)
+
+    def items(self, entity_type):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT body FROM entities WHERE type = ? ORDER BY id',
+                (entity_type, ),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def apply(self, changes, last_sync):
+        # 差分と同期した時刻は 1 つのトランザクションで書き込む
+        with self._lock, self._conn:
+            for change in changes:
+                if change.kind == REMOVED:
+                    self._conn.execute(
+                        'DELETE FROM entities WHERE type = ? AND id = ?',
+                        (change.entity_type, change.id),
+                    )
+                else:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO entities '
+                        'VALUES (?, ?, ?, ?)',
+                        (change.entity_type, change.id,
+                         _digest(change.after), json.dumps(change.after)),
+                    )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO state VALUES (?, ?)',
+                ('last_sync', repr(last_sync)),
+            )
+
+    @property
+    def last_sync(self):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM state WHERE key = ?',
+                ('last_sync', ),
+            ).fetchone()
+        return float(row[0]) if row is not None else None
+
+    def close(self):
+        self._conn.close()
+
+
+class InventorySync(object):
+
+    def __init__(self, client, snapshot=None,
+                 entity_types=DEFAULT_ENTITY_TYPES, overlap=300.0,
+                 workers=8, pagesize=None):
+        self.client = client
+        self.snapshot = snapshot if snapshot is not None \
+            else InventorySnapshot()
+        self.entity_types = dict((t.name, t) for t in entity_types)
+        # 時計のずれやイベントの記録の遅れを見込んで前回より少し前から調べる
+        self.overlap = overlap
+        self.workers = workers
+        self.pagesize = pagesize
+        self.fetched = collections.Counter()
+
+    def sync(self, full=False):
+        started = time.time()
+        last_sync = self.snapshot.last_sync
+        if full or last_sync is None:
+            full_types = set(self.entity_types)
+            dirty_ids = {}
+        else:
+            full_types, dirty_ids = self._dirty(last_sync - self.overlap)
+        changes = []
+        for name in sorted(full_types):
+            changes.extend(self._sync_type(name))
+        for name, entity_ids in sorted(dirty_ids.items()):
+            if name in full_types:
+                continue
+            type_changes = self._sync_ids(name, entity_ids)
+            if type_changes is None:
+                type_changes = self._sync_type(name)
+            changes.extend(type_changes)
+        # エラーがあればここまで来ないので同期した時刻は進まない
+        self.snapshot.apply(changes, started)
+        return changes
+
+    def _dirty(self, since):
+        startdate = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since))
+        full_types = set()
+        dirty_ids = collections.defaultdict(set)
+        jobs = self._list('listAsyncJobs', startdate=startdate)
+        for job in jobs:
+            entity_type = self._by_instance_type(job.get('jobinstancetype'))
+            if entity_type is None:
+                continue
+            entity_id = job.get('jobinstanceid')
+            if entity_id:
+                dirty_ids[entity_type.name].add(entity_id)
+            else:
+                full_types.add(entity_type.name)
+        events = self._list('listEvents', startdate=startdate)
+        for event in events:
+            entity_type = self._by_instance_type(event.get('resourcetype')) \
+                or self._by_event_type(event.get('type') or '')
+            if entity_type is None:
+                continue
+            entity_id = event.get('resourceid')
+            if entity_id:
+                dirty_ids[entity_type.name].add(entity_id)
+            else:
+                # 古い CloudStack のイベントには対象の ID が含まれない
+                full_types.add(entity_type.name)
+        return full_types, dirty_ids
+
+    def _by_instance_type(self, instance_type):
+        for entity_type in self.entity_types.values():
+            if instance_type and entity_type.instance_type == instance_type:
+                return entity_type
+        return None
+
+    def _by_event_type(self, event_type):
+        for entity_type in self.entity_types.values():
+            if event_type.startswith(entity_type.event_prefixes):
+                return entity_type
+        return None
+
+    def _list(self, command, **params):
+        params['listall'] = 'true'
+        items = self.client.list_all(command, pagesize=self.pagesize,
+                                     **params)
+        self.fetched[command] += len(items)
+        return items
+
+    def _sync_type(self, name):
+        entity_type = self.entity_types[name]
+        items = self._list(entity_type.list_command)
+        current = dict((item['id'], item) for item in items)
+        changes = []
+        for entity_id, item in current.items():
+            change = self._compare(name, entity_id, item)
+            if change is not None:
+                changes.append(change)
+        for entity_id in self.snapshot.ids(name) - set(current):
+            changes.append(self._compare(name, entity_id, None))
+        return changes
+
+    def _sync_ids(self, name, entity_ids):
+        entity_type = self.entity_types[name]
+        entity_ids = sorted(entity_ids)
+        results = self.client.fan_out(
+            entity_type.list_command,
+            [{'id': entity_id, 'listall': 'true'} for entity_id in entity_ids],
+            self.workers,
+        )
+        changes = []
+        for entity_id, result in zip(entity_ids, results):
+            if not result.succeeded:
+                # 同期した時刻を進めずに次回もう一度調べる
+                raise result.error
+            if result.response.status_code == PARAM_ERROR_STATUS:
+                # 削除されたのかどうかは一覧全体と比べて確かめる
+                return None
+            # エラーのレスポンスを削除されたものとして読まない
+            api_response = check_api_response(entity_type.list_command,
+                                              result.response)
+            _count, items = list_items_of(api_response.content_body)
+            self.fetched[entity_type.list_command] += len(items)
+            item = next((i for i in items if i.get('id') == entity_id), None)
+            change = self._compare(name, entity_id, item)
+            if change is not None:
+                changes.append(change)
+        return changes
+
+    def _compare(self, name, entity_id, item):
+        digest, before = self.snapshot.get(name, entity_id)
+        if item is None:
+            if before is None:
+                return None
+            return Change(REMOVED, name, entity_id, before, None)
+        if before is None:
+            return Change(ADDED, name, entity_id, None, item)
+        if digest != _digest(item):
+            return Change(CHANGED, name, entity_id, before, item)
+        return None
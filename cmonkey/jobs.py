@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import collections
+import sys
+import time
+from concurrent import futures
+
+import six
+from six.moves import range
+
+from cmonkey import (
+    ApiResponse,
+    JobResult,
+    PollingPolicy,
+    RetryLimitExceededException,
+    JOB_STATUS_PENDING,
+    job_id_of,
+)
+
+LOG = logging.getLogger(__name__)
+
+
+class JobWaiter(object):
+
+    def __init__(self, client, jobs=None, interval=None, bulk=False,
+                 policy=None, workers=8):
+        self.client = client
+        self.policy = policy or PollingPolicy.resolve(client.polling_policy,
+                                                      interval)
+        self.bulk = bulk
+        self.workers = workers
+        self._pending = collections.OrderedDict()
+        for job in jobs or []:
+            self.add(job)
+
+    def add(self, job):
+        job_id = self._job_id(job)
+        if not job_id:
+            msg = 'JOB id not found (maybe synchronous request)'
+            LOG.debug(msg)
+            return None
+        self._pending[job_id] = None
+        return job_id
+
+    def pending(self):
+        return list(self._pending.keys())
+
+    def as_completed(self, retry=-1):
+        deadline = self.policy.deadline()
+        intervals = self.policy.intervals()
+        retry = sys.maxsize if retry < 0 else retry
+        executor = None
+        if self.workers > 1:
+            executor = futures.ThreadPoolExecutor(self.workers)
+        try:
+            for result in self._as_completed(retry, deadline, intervals,
+                                             executor):
+                yield result
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def _as_completed(self, retry, deadline, intervals, executor):
+        started = time.time()
+        polls = {}
+        for _i in range(retry):
+            # 1 周のポーリングで全ての JOB の状態を確認する
+            for job_id, inner_body in self._poll(executor):
+                job_status = inner_body['jobstatus']
+                command = inner_body.get('cmd')
+                elapsed = time.time() - started
+                polls[job_id] = polls.get(job_id, 0) + 1
+                self.client._notify('job_poll', command, job_id, job_status,
+                                    elapsed)
+                if job_status == JOB_STATUS_PENDING:
+                    continue
+                del self._pending[job_id]
+                msg = 'JOB status changed: %s: %s' % (job_id, job_status)
+                LOG.debug(msg)
+                self.client._notify('job_done', command, job_id, job_status,
+                                    elapsed, polls.pop(job_id))
+                yield JobResult.from_content_body(inner_body)
+            if not self._pending:
+                return
+            self.policy.sleep(next(intervals), deadline)
+        raise RetryLimitExceededException('Retried %d times' % retry)
+
+    def wait(self, retry=-1):
+        order = self.pending()
+        results = dict(
+            (result.job_id, result)
+            for result in self.as_completed(retry)
+        )
+        return [results[job_id] for job_id in order]
+
+    def _poll(self, executor=None):
+        job_ids = self.pending()
+        listed = self._list_jobs() if self.bulk else {}
+        for job_id in job_ids:
+            if job_id in listed:
+                yield job_id, listed[job_id]
+        # 一覧に含まれない JOB は個別に問い合わせる
+        unlisted = [job_id for job_id in job_ids if job_id not in listed]
+        if executor is not None and len(unlisted) > 1:
+            # 1 周にかかる時間が JOB の数に比例しないよう並列に問い合わせる
+            inner_bodies = executor.map(self.client.query_job, unlisted)
+        else:
+            inner_bodies = (self.client.query_job(job_id)
+                            for job_id in unlisted)
+        for job_id, inner_body in zip(unlisted, inner_bodies):
+            yield job_id, inner_body
+
+    def _list_jobs(self):
+        params = {
+            'listall': 'true',
+        }
+        api_response = self.client.invoke('listAsyncJobs', params)
+        inner_body = next(iter(api_response.content_body.values()), {})
+        jobs = inner_body.get('asyncjobs', [])
+        return dict((job['jobid'], job) for job in jobs)
+
+    def _job_id(self, job):
+        if isinstance(job, ApiResponse):
+            return job_id_of(job.content_body)
+        if isinstance(job, dict):
+            return job_id_of(job)
+        if isinstance(job, six.string_types + six.integer_types):
+            return job
+        return None
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import select
+import socket
+import ssl
+import threading
+
+from six.moves import http_client
+from six.moves.urllib import parse
+
+# requests を読み込むと起動に時間がかかるため、
+# 1 回だけ実行するコマンドラインツールでは標準ライブラリで HTTP を話す
+
+# requests が読み込む環境変数 (これらを使う環境では requests に任せる)
+REQUESTS_ENVIRONMENT = (
+    'HTTP_PROXY',
+    'HTTPS_PROXY',
+    'ALL_PROXY',
+    'NO_PROXY',
+    'REQUESTS_CA_BUNDLE',
+    'CURL_CA_BUNDLE',
+)
+# 使い回した接続が相手に閉じられていたときのエラー
+_STALE_CONNECTION_ERRORS = (http_client.BadStatusLine, socket.error)
+
+
+def supported_environment(environ=None):
+    environ = os.environ if environ is None else environ
+    for name in REQUESTS_ENVIRONMENT:
+        if environ.get(name) or environ.get(name.lower()):
+            return False
+    # .netrc の認証情報は requests だけが読む
+    netrc_paths = [environ.get('NETRC')] if environ.get('NETRC') else [
+        os.path.expanduser(os.path.join('~', name))
+        for name in ('.netrc', '_netrc')
+    ]
+    return not any(os.path.exists(path) for path in netrc_paths)
+
+
+class LiteHeaders(dict):
+
+    def get(self, name, default=None):
+        for k, v in self.items():
+            if k.lower() == name.lower():
+                return v
+        return default
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+
+class LiteResponse(object):
+
+    def __init__(self, raw, stream=False):
+        self.raw = raw
+        self.status_code = raw.status
+        self.headers = LiteHeaders()
+        for name, value in raw.getheaders():
+            if name in self.headers:
+                value = '%s, %s' % (self.headers[name], value)
+            self.headers[name] = value
+        self.encoding = self._charset(self.headers.get('Content-Type', ''))
+        self._content = None
+        if not stream:
+            self._content = raw.read()
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.raw.read()
+        return self._content
+
+    def json(self):
+        return json.loads(self.content.decode(self.encoding or 'utf-8'))
+
+    def iter_content(self, chunk_size=1):
+        if self._content is not None:
+            yield self._content
+            return
+        while True:
+            chunk = self.raw.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.raw.close()
+
+    def _charset(self, content_type):
+        for param in content_type.split(';')[1:]:
+            k, _sep, v = param.strip().partition('=')
+            if k.lower() == 'charset':
+                return v.strip('"')
+        return None
+
+
+class LiteSession(object):
+
+    # pool_stats() から参照される (接続プールは持たない)
+    adapters = {}
+
+    def __init__(self):
+        self.cookies = {}
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, params=None, headers=None, data=None,
+                timeout=None, stream=False):
+        url_parts = parse.urlsplit(url)
+        query = parse.urlencode(params or {})
+        path = url_parts.path or '/'
+        if url_parts.query:
+            query = '%s&%s' % (url_parts.query, query) if query \
+                else url_parts.query
+        if query:
+            path = '%s?%s' % (path, query)
+        headers = dict(headers or {})
+        body = None
+        if data:
+            body = parse.urlencode(data)
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+        with self._lock:
+            if self.cookies:
+                headers['Cookie'] = '; '.join(
+                    '%s=%s' % pair for pair in self.cookies.items()
+                )
+            response = self._send(url_parts, timeout, method, path, body,
+                                  headers, stream)
+            self._store_cookies(response)
+        return response
+
+    def _send(self, url_parts, timeout, method, path, body, headers,
+              stream):
+        # self._lock を取ってから呼ぶ
+        for attempt in range(2):
+            connection = self._connection(url_parts, timeout)
+            # まだ接続していなければ sock は None
+            reused = connection.sock is not None
+            try:
+                connection.request(method, path, body, headers)
+                return LiteResponse(connection.getresponse(), stream)
+            except BaseException as e:
+                # 壊れた接続は使い回さない
+                connection.close()
+                self._connections.pop(url_parts.netloc, None)
+                # 待っている間にサーバが閉じた keep-alive の接続なら
+                # 1 度だけつなぎ直す
+                if attempt > 0 or not reused or not _stale(e):
+                    raise
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+
+    def _connection(self, url_parts, timeout):
+        connection = self._connections.get(url_parts.netloc)
+        if connection is not None and _dropped(connection):
+            connection.close()
+            connection = None
+        if connection is None:
+            if isinstance(timeout, tuple):
+                # 接続と読み込みのタイムアウトを分けられない
+                timeout = max(t for t in timeout if t is not None) \
+                    if any(t is not None for t in timeout) else None
+            if url_parts.scheme == 'https':
+                connection = http_client.HTTPSConnection(
+                    url_parts.netloc,
+                    timeout=timeout,
+                    context=_ssl_context(),
+                )
+            else:
+                connection = http_client.HTTPConnection(url_parts.netloc,
+                                                        timeout=timeout)
+            self._connections[url_parts.netloc] = connection
+        return connection
+
+    def _store_cookies(self, response):
+        set_cookie = response.headers.get('Set-Cookie')
+        if not set_cookie:
+            return
+        # 属性 (Path など) は無視して名前と値だけを覚えておく
+        for cookie in set_cookie.split(','):
+            name, sep, value = cookie.split(';')[0].strip().partition('=')
+            if sep and name:
+                self.cookies[name] = value
+
+
+def _stale(e):
+    return isinstance(e, _STALE_CONNECTION_ERRORS) and \
+        not isinstance(e, socket.timeout)
+
+
+def _dropped(connection):
+    sock = connection.sock
+    if sock is None:
+        return False
+    try:
+        readable, _writable, _errors = select.select([sock], [], [], 0)
+    except (ValueError, select.error):
+        return True
+    # 応答を待っていない接続が読めるのは相手が閉じたとき
+    return bool(readable)
+
+
+def _ssl_context():
+    # requests と同じく certifi の CA 証明書があればそれを使う
+    try:
+        import certifi
+    except ImportError:
+        return ssl.create_default_context()
+    return ssl.create_default_context(cafile=certifi.where())
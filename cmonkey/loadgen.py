@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import collections
+import random
+import threading
+import time
+
+from cmonkey import (
+    FAN_OUT_ERRORS,
+    JOB_STATUS_SUCCEEDED,
+    Observer,
+)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = int(round((len(sorted_values) - 1) * p / 100.0))
+    return sorted_values[index]
+
+
+def _latency_summary(values):
+    values = sorted(values)
+    return {
+        'mean': sum(values) / len(values) if values else 0.0,
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else 0.0,
+    }
+
+
+class CommandMix(object):
+
+    def __init__(self, commands, seed=None):
+        # [(重み, コマンド, パラメータ), ...]
+        self.commands = [(w, c, dict(p)) for w, c, p in commands if w > 0]
+        if not self.commands:
+            raise ValueError('Command mix is empty')
+        self._cumulative = []
+        total = 0.0
+        for weight, _command, _params in self.commands:
+            total += weight
+            self._cumulative.append(total)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def choose(self):
+        with self._lock:
+            point = self._random.random() * self._cumulative[-1]
+        index = bisect.bisect_right(self._cumulative, point)
+        _weight, command, params = self.commands[index]
+        return command, params
+
+
+class _Stats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = collections.Counter()
+        self.jobs = []
+        self.failed_jobs = 0
+
+
+class _JobTimer(Observer):
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def job_done(self, command, job_id, job_status, elapsed, polls):
+        self.generator._job_done(command, job_status, elapsed)
+
+
+class LoadGenerator(object):
+
+    def __init__(self, client, mix, rate=None, concurrency=8, duration=10.0,
+                 requests=None):
+        self.client = client
+        self.mix = mix
+        # rate を指定すると到着間隔を固定した open loop になる
+        self.rate = rate
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self._stats = collections.defaultdict(_Stats)
+        self._lock = threading.Lock()
+        self._issued = 0
+        client.add_observer(_JobTimer(self))
+
+    def run(self):
+        started = time.time()
+        if self.rate:
+            self._open_loop(started)
+        else:
+            self._closed_loop(started)
+        return self.report(time.time() - started)
+
+    def _next(self, started):
+        # 上限に達していなければ発行した数を進める
+        with self._lock:
+            if self.requests is not None and self._issued >= self.requests:
+                return False
+            if self.duration and time.time() - started >= self.duration:
+                return False
+            self._issued += 1
+            return True
+
+    def _closed_loop(self, started):
+        def worker():
+            while self._next(started):
+                self._call(time.time())
+        threads = [threading.Thread(target=worker)
+                   for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _open_loop(self, started):
+        from concurrent import futures
+        executor = futures.ThreadPoolExecutor(self.concurrency)
+        interval = 1.0 / self.rate
+        try:
+            i = 0
+            while self._next(started):
+                scheduled = started + i * interval
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                # 待たされた時間もレイテンシに含める
+                executor.submit(self._call, scheduled)
+                i += 1
+        finally:
+            executor.shutdown(wait=True)
+
+    def _call(self, scheduled):
+        command, params = self.mix.choose()
+        error = None
+        try:
+            api_response = self.client.invoke(command, params)
+            if api_response.status_code != 200:
+                error = 'HTTP %d' % api_response.status_code
+        except FAN_OUT_ERRORS as e:
+            error = e.__class__.__name__
+        elapsed = time.time() - scheduled
+        with self._lock:
+            stats = self._stats[command]
+            stats.latencies.append(elapsed)
+            if error is not None:
+                stats.errors[error] += 1
+
+    def _job_done(self, command, job_status, elapsed):
+        with self._lock:
+            stats = self._stats[command]
+            stats.jobs.append(elapsed)
+            if job_status != JOB_STATUS_SUCCEEDED:
+                stats.failed_jobs += 1
+                stats.errors['job failed'] += 1
+
+    def report(self, elapsed):
+        with self._lock:
+            commands = {}
+            latencies = []
+            total_errors = 0
+            for command, stats in self._stats.items():
+                requests = len(stats.latencies)
+                errors = sum(stats.errors.values())
+                latencies.extend(stats.latencies)
+                total_errors += errors
+                commands[command] = {
+                    'requests': requests,
+                    'errors': errors,
+                    'error_rate': float(errors) / requests if requests
+                    else 0.0,
+                    'errors_by_type': dict(stats.errors),
+                    'latency': _latency_summary(stats.latencies),
+                }
+                if stats.jobs:
+                    commands[command]['jobs'] = dict(
+                        _latency_summary(stats.jobs),
+                        count=len(stats.jobs),
+                        failed=stats.failed_jobs,
+                    )
+        requests = len(latencies)
+        return {
+            'mode': 'open' if self.rate else 'closed',
+            'duration': elapsed,
+            'requests': requests,
+            'errors': total_errors,
+            'error_rate': float(total_errors) / requests if requests else 0.0,
+            'throughput': requests / elapsed if elapsed else 0.0,
+            'latency': _latency_summary(latencies),
+            'commands': commands,
+        }
+
+
+def format_report(report):
+    lines = [
+        '%s loop: %d requests in %.2f s (%.1f req/s), %d errors (%.2f%%)' % (
+            report['mode'],
+            report['requests'],
+            report['duration'],
+            report['throughput'],
+            report['errors'],
+            report['error_rate'] * 100,
+        ),
+        '%-28s %7s %7s %9s %9s %9s %9s %9s' % (
+            'command', 'count', 'errors',
+            'p50(ms)', 'p90(ms)', 'p99(ms)', 'max(ms)', 'job p50',
+        ),
+    ]
+    rows = sorted(report['commands'].items()) + [('total', report)]
+    for command, summary in rows:
+        latency = summary['latency']
+        jobs = summary.get('jobs') if command != 'total' else None
+        lines.append('%-28s %7d %7d %9.2f %9.2f %9.2f %9.2f %9s' % (
+            command,
+            summary['requests'],
+            summary['errors'],
+            latency['p50'] * 1000,
+            latency['p90'] * 1000,
+            latency['p99'] * 1000,
+            latency['max'] * 1000,
+            '%.2f' % (jobs['p50'] * 1000) if jobs else '-',
+        ))
+    return '\n'.join(lines)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import socket
+import threading
+
+from cmonkey import Observer
+
+# 秒単位のバケットの上限 (Prometheus の既定値に近いもの)
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # 最後の要素は上限を超えた値の数
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if not count or cumulative + count < rank:
+                cumulative += count
+                continue
+            # バケットの中では一様に分布しているとみなす
+            lower = self.buckets[i - 1] if i > 0 else 0.0
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            upper = min(upper, self.max)
+            return lower + (upper - lower) * (rank - cumulative) / count
+        return self.max
+
+    def cumulative_counts(self):
+        cumulative = 0
+        for upper, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield upper, cumulative
+
+
+class MetricsCollector(Observer):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def after_response(self, command, status_code, timings, size):
+        with self._lock:
+            for phase, elapsed in timings.items():
+                self._observe('request_seconds', elapsed,
+                              command=command, phase=phase)
+            self._increment('requests_total', 1,
+                            command=command, status=str(status_code))
+            if size is not None:
+                self._increment('response_bytes_total', size,
+                                command=command)
+
+    def login(self, username, elapsed):
+        with self._lock:
+            self._observe('login_seconds', elapsed)
+            self._increment('logins_total', 1)
+
+    def job_poll(self, command, job_id, job_status, elapsed):
+        with self._lock:
+            self._increment('job_polls_total', 1, command=command)
+
+    def job_done(self, command, job_id, job_status, elapsed, polls):
+        with self._lock:
+            self._observe('job_seconds', elapsed, command=command)
+
+    def _observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def _increment(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self):
+        rows = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self.histograms.items(),
+                                                     key=_sort_key):
+                label_values = dict(labels)
+                rows.append({
+                    'metric': name,
+                    'command': label_values.get('command'),
+                    'phase': label_values.get('phase'),
+                    'count': histogram.count,
+                    'mean': histogram.mean(),
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                    'max': histogram.max,
+                })
+        return rows
+
+    def format_summary(self):
+        lines = ['%-16s %-28s %-8s %6s %9s %9s %9s %9s' % (
+            'metric', 'command', 'phase', 'count',
+            'mean(ms)', 'p50(ms)', 'p99(ms)', 'max(ms)',
+        )]
+        for row in self.summary():
+            lines.append('%-16s %-28s %-8s %6d %9.2f %9.2f %9.2f %9.2f' % (
+                row['metric'],
+                row['command'] or '-',
+                row['phase'] or '-',
+                row['count'],
+                row['mean'] * 1000,
+                row['p50'] * 1000,
+                row['p99'] * 1000,
+                row['max'] * 1000,
+            ))
+        return '\n'.join(lines)
+
+    def prometheus_text(self, prefix='cmonkey'):
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), histogram in sorted(self.histograms.items(),
+                                                     key=_sort_key):
+                metric = '%s_%s' % (prefix, name)
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append('# TYPE %s histogram' % metric)
+                for upper, count in histogram.cumulative_counts():
+                    bucket_labels = labels + (('le', repr(upper)), )
+                    lines.append('%s_bucket%s %d' % (
+                        metric, _format_labels(bucket_labels), count))
+                bucket_labels = labels + (('le', '+Inf'), )
+                lines.append('%s_bucket%s %d' % (
+                    metric, _format_labels(bucket_labels), histogram.count))
+                lines.append('%s_sum%s %r' % (
+                    metric, _format_labels(labels), histogram.sum))
+                lines.append('%s_count%s %d' % (
+                    metric, _format_labels(labels), histogram.count))
+            for (name, labels), value in sorted(self.counters.items(),
+                                                key=_sort_key):
+                metric = '%s_%s' % (prefix, name)
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append('# TYPE %s counter' % metric)
+                lines.append('%s%s %d' % (
+                    metric, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _sort_key(item):
+    (name, labels), _value = item
+    return name, [(k, v or '') for k, v in labels]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = [
+        '%s="%s"' % (k, ('%s' % v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels
+    ]
+    return '{%s}' % ','.join(pairs)
+
+
+class StatsdExporter(Observer):
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='cmonkey'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def after_response(self, command, status_code, timings, size):
+        lines = [
+            '%s.request.%s.%s:%.3f|ms' % (self.prefix, command, phase,
+                                          elapsed * 1000)
+            for phase, elapsed in sorted(timings.items())
+        ]
+        lines.append('%s.requests.%s.%s:1|c' % (self.prefix, command,
+                                                status_code))
+        if size is not None:
+            lines.append('%s.response_bytes.%s:%d|c' % (self.prefix,
+                                                         command, size))
+        self._send(lines)
+
+    def login(self, username, elapsed):
+        self._send(['%s.login:%.3f|ms' % (self.prefix, elapsed * 1000)])
+
+    def job_done(self, command, job_id, job_status, elapsed, polls):
+        self._send([
+            '%s.job.%s:%.3f|ms' % (self.prefix, command, elapsed * 1000),
+            '%s.job_polls.%s:%d|c' % (self.prefix, command, polls),
+        ])
+
+    def close(self):
+        self._socket.close()
+
+    def _send(self, lines):
+        try:
+            self._socket.sendto('\n'.join(lines).encode('utf-8'),
+                                self.address)
+        except socket.error:
+            # 計測のためにリクエストを失敗させない
+            pass
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+
+# 読み込んだ分を捨てるまでに溜めておく文字数
+_COMPACT_THRESHOLD = 64 * 1024
+_WHITESPACE = ' \t\n\r'
+
+
+class StreamParseError(ValueError):
+
+    def __init__(self, msg):
+        super(StreamParseError, self).__init__(msg)
+
+
+class ListStreamParser(object):
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        # 配列以外の値 (count など)
+        self.fields = {}
+        self.response_name = None
+        self.entity = None
+
+    def __iter__(self):
+        return self.items()
+
+    def items(self):
+        # {"<command>response": {"count": N, "<entity>": [...]}}
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        self.response_name = self._decode_key()
+        self._expect('{')
+        while True:
+            c = self._peek()
+            if c == '}':
+                return
+            if c == ',':
+                self._pos += 1
+                continue
+            key = self._decode_key()
+            if self._peek() == '[':
+                self._pos += 1
+                self.entity = key
+                for item in self._array_items():
+                    yield item
+            else:
+                self.fields[key] = self._decode_value()
+
+    def _array_items(self):
+        while True:
+            c = self._peek()
+            if c == ']':
+                self._pos += 1
+                return
+            if c == ',':
+                self._pos += 1
+                continue
+            yield self._decode_value()
+
+    def _decode_key(self):
+        if self._peek() != '"':
+            self._error('key')
+        key = self._decode_value()
+        self._expect(':')
+        return key
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(
+                    self._buffer,
+                    self._pos,
+                )
+            except ValueError:
+                # 値の途中でバッファが終わっている
+                if not self._read():
+                    raise
+                continue
+            if end == len(self._buffer) and not self._eof:
+                # 数値はまだ続きがあるかもしれない
+                if self._read():
+                    continue
+            self._pos = end
+            self._compact()
+            return value
+
+    def _expect(self, c):
+        if self._peek() != c:
+            self._error(repr(c))
+        self._pos += 1
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer):
+                c = self._buffer[self._pos]
+                if c not in _WHITESPACE:
+                    return c
+                self._pos += 1
+            if not self._read():
+                self._error('more data')
+
+    def _read(self):
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+        self._buffer += self._decoder.decode(b'', final=True)
+        self._eof = True
+        return False
+
+    def _compact(self):
+        # 処理済みの部分を捨ててメモリの使用量を一定に保つ
+        if self._pos > _COMPACT_THRESHOLD:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+
+    def _error(self, expected):
+        msg = 'Expecting %s at %d' % (expected, self._pos)
+        raise StreamParseError(msg)
+
+
+class StreamedList(object):
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, response):
+        self.response = response
+        self.parser = ListStreamParser(
+            response.iter_content(self.CHUNK_SIZE),
+            response.encoding or 'utf-8',
+        )
+
+    @property
+    def fields(self):
+        return self.parser.fields
+
+    @property
+    def count(self):
+        return self.parser.fields.get('count')
+
+    def __iter__(self):
+        try:
+            for item in self.parser.items():
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self.response.close()
@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import hashlib
+import threading
+import time
 
+from six.moves import BaseHTTPServer, socketserver
 import nose
-from nose.tools.trivial import eq_
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
 
 from cmonkey import (
+    ApiErrorException,
     CookieClient,
     SignatureClient,
     SignatureBuilder,
     IntegrationClient,
+    PollingPolicy,
+    DeadlineExceededException,
+    RetryLimitExceededException,
+    SingleFlight,
+    imap_ordered,
 )
 
 try:
@@ -45,6 +55,50 @@ class Test_SignatureBuilder(object):
         signature = builder.build(params)
         eq_(signature, b'4+XLXpBJuqKH/BVg2WNYRcPFjTY=')
 
+    def test_build_twice(self):
+        builder = SignatureBuilder(self.APIKEY, self.SECRETKEY)
+        for _i in range(2):
+            params = {
+                'command': 'listUsers',
+                'keyword': 'ad',
+            }
+            signature = builder.build(params)
+            eq_(signature, b'QEq3xbEHhBmSfFw4RwVzkWyQYWc=')
+            eq_(params['apikey'], self.APIKEY)
+
+    def test_build_given_apikey(self):
+        params = {
+            'command': 'listUsers',
+            'keyword': 'ad',
+            'apiKey': self.APIKEY,
+        }
+        builder = SignatureBuilder(self.APIKEY, self.SECRETKEY)
+        signature = builder.build(params)
+        eq_(signature, b'QEq3xbEHhBmSfFw4RwVzkWyQYWc=')
+        ok_('apikey' not in params)
+
+    def test_build_many(self):
+        params_list = [
+            {
+                'command': 'listUsers',
+                'keyword': 'ad',
+            },
+            {
+                'command': 'createZone',
+                'dns1': '203.0.113.1',
+                'internaldns1': '198.51.100.1',
+                'name': 'sample-zone',
+                'networktype': 'Advanced',
+                'guestcidraddress': '192.0.2.0/24',
+            },
+        ]
+        builder = SignatureBuilder(self.APIKEY, self.SECRETKEY)
+        signatures = builder.build_many(params_list)
+        eq_(signatures, [
+            b'QEq3xbEHhBmSfFw4RwVzkWyQYWc=',
+            b'4+XLXpBJuqKH/BVg2WNYRcPFjTY=',
+        ])
+
 
 class Test_CookieClient(object):
 
@@ -79,6 +133,61 @@ class Test_CookieClient(object):
         ]
         client.request.assert_has_calls(calls)
 
+    def test_session_cached(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = CookieClient(endpoint, 'admin', 'password',
+                              async_block=False)
+        # モックアウト
+        client.login = mock.MagicMock(return_value='hogehoge')
+        response = mock.Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.json = lambda: {}
+        client.request = mock.Mock(return_value=response)
+        # 実行
+        client.listUsers()
+        client.listZones()
+        # 検証
+        eq_(client.login.call_count, 1)
+        eq_(client.request.call_count, 2)
+
+    def test_session_expired_status(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = CookieClient(endpoint, 'admin', 'password',
+                              async_block=False)
+        # モックアウト
+        client.login = mock.MagicMock(side_effect=['old', 'new'])
+        r1 = mock.Mock()
+        r1.status_code = 401
+        r2 = mock.Mock()
+        r2.status_code = 200
+        r2.headers = {}
+        r2.json = lambda: {}
+        client.request = mock.Mock(side_effect=[r1, r2])
+        # 実行
+        api_response = client.listUsers()
+        # 検証
+        eq_(api_response.status_code, 200)
+        eq_(client.login.call_count, 2)
+        params = client.request.call_args[0][1]
+        eq_(params['sessionkey'], 'new')
+
+    def test_session_ttl(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = CookieClient(endpoint, 'admin', 'password',
+                              async_block=False, session_ttl=60)
+        # モックアウト
+        client.login = mock.MagicMock(side_effect=['first', 'second'])
+        # 実行
+        with mock.patch('time.time', return_value=1000):
+            eq_(client.session_key(), 'first')
+        with mock.patch('time.time', return_value=1059):
+            eq_(client.session_key(), 'first')
+        with mock.patch('time.time', return_value=1060):
+            eq_(client.session_key(), 'second')
+        # 検証
+        eq_(client.login.call_count, 2)
+
     def test_login_digest(self):
         self._test_login(digest=True)
 
@@ -176,16 +285,20 @@ class Test_IntegrationClient(object):
         r3.json = lambda: {
             'queryasyncjobresultresponse': {
                 'jobstatus': 1,
+                'jobresult': {
+                    'vpnuser': {'username': 'foo'},
+                },
             }
         }
         client.request = mock.Mock(side_effect=[r1, r2, r3])
+        client.polling_policy = PollingPolicy.fixed(0)
         # 実行
         params = {
             'username': 'foo',
             'password': 'bar',
             'response': 'json',
         }
-        client.addVpnUser(**params)
+        api_response = client.addVpnUser(**params)
         # 検証
         params['command'] = 'addVpnUser'
         async_params = {
@@ -199,6 +312,573 @@ class Test_IntegrationClient(object):
             mock.call('GET', async_params, None, None),
         ]
         client.request.assert_has_calls(calls)
+        ok_(api_response.job.succeeded)
+        eq_(api_response.job.job_result, {'vpnuser': {'username': 'foo'}})
+
+    @raises(DeadlineExceededException)
+    def test_async_block_deadline(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = IntegrationClient(
+            endpoint,
+            polling_policy=PollingPolicy.fixed(0.01, timeout=0.05),
+        )
+        # モックアウト
+        r1 = mock.Mock()
+        r1.status_code = 200
+        r1.headers = {}
+        r1.json = lambda: {
+            'deployvirtualmachineresponse': {
+                'jobid': 1,
+            }
+        }
+        r2 = mock.Mock()
+        r2.status_code = 200
+        r2.headers = {}
+        r2.json = lambda: {
+            'queryasyncjobresultresponse': {
+                'jobstatus': 0,
+            }
+        }
+        client.request = mock.Mock(side_effect=[r1] + [r2] * 100)
+        # 実行
+        client.deployVirtualMachine()
+
+
+class _JsonHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"listzonesresponse": {}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class Test_RequestMixin(object):
+
+    def _serve(self):
+        server = _HTTPServer(('127.0.0.1', 0), _JsonHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def test_pool_options(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = IntegrationClient(
+            endpoint,
+            pool_connections=2,
+            pool_maxsize=20,
+            timeout=(1, 5),
+            max_retries=3,
+        )
+        adapter = client.session.get_adapter(endpoint)
+        eq_(adapter._pool_maxsize, 20)
+        eq_(adapter.max_retries.connect, 3)
+        eq_(adapter.max_retries.read, 0)
+        eq_(client.timeout, (1, 5))
+
+    def test_pool_stats(self):
+        server = self._serve()
+        try:
+            url = 'http://127.0.0.1:%d' % server.server_address[1]
+            client = IntegrationClient(url + '/client/api', async_block=False)
+            # 実行
+            for _i in range(3):
+                client.listZones()
+            # 検証
+            stats = client.pool_stats()
+            eq_(stats[url], {
+                'connections': 1,
+                'requests': 3,
+                'reused': 2,
+            })
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class Test_IterList(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def _page(self, start, stop, count):
+        response = mock.Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.json = lambda: {
+            'listvirtualmachinesresponse': {
+                'count': count,
+                'virtualmachine': [
+                    {'id': str(i)} for i in range(start, stop)
+                ],
+            }
+        }
+        return response
+
+    def test_iter_list(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            self._page(0, 2, 5),
+            self._page(2, 4, 5),
+            self._page(4, 5, 5),
+        ])
+        # 実行
+        items = client.iter_list('listVirtualMachines', pagesize=2,
+                                 state='Running')
+        # 検証
+        eq_([item['id'] for item in items], ['0', '1', '2', '3', '4'])
+        eq_(client.request.call_count, 3)
+        params = {
+            'command': 'listVirtualMachines',
+            'response': 'json',
+            'state': 'Running',
+            'page': '3',
+            'pagesize': '2',
+        }
+        client.request.assert_called_with('GET', params, None, None)
+
+    def test_iter_list_exact_count(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            self._page(0, 2, 4),
+            self._page(2, 4, 4),
+        ])
+        # 実行
+        items = list(client.iter_list('listVirtualMachines', pagesize=2))
+        # 検証
+        eq_(len(items), 4)
+        eq_(client.request.call_count, 2)
+
+    def test_iter_list_from_page(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            self._page(4, 6, 8),
+            self._page(6, 8, 8),
+        ])
+        # 実行
+        items = list(client.iter_list('listVirtualMachines', pagesize=2,
+                                      page='3'))
+        # 検証
+        eq_([item['id'] for item in items], ['4', '5', '6', '7'])
+        eq_(client.request.call_count, 2)
+
+    def test_iter_list_prefetch(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            self._page(0, 2, 3),
+            self._page(2, 3, 3),
+        ])
+        # 実行
+        items = client.iter_list('listVirtualMachines', pagesize=2,
+                                 prefetch=True)
+        # 検証
+        eq_([item['id'] for item in items], ['0', '1', '2'])
+        eq_(client.request.call_count, 2)
+
+    def test_iter_list_fields(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            self._page(0, 2, 3),
+            self._page(2, 3, 3),
+        ])
+        # 実行
+        items = client.iter_list('listVirtualMachines', pagesize=2,
+                                 fields=['id', 'name'])
+        # 検証
+        eq_([tuple(item) for item in items],
+            [('0', None), ('1', None), ('2', None)])
+        params = client.request.call_args[0][1]
+        ok_('fields' not in params)
+
+    def test_iter_list_empty(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        response = mock.Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.json = lambda: {'listvirtualmachinesresponse': {}}
+        client.request = mock.Mock(return_value=response)
+        # 実行
+        items = list(client.iter_list('listVirtualMachines'))
+        # 検証
+        eq_(items, [])
+        eq_(client.request.call_count, 1)
+
+    def _error(self, status_code):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.headers = {}
+        response.json = lambda: {
+            'listvirtualmachinesresponse': {
+                'uuidList': [],
+                'errorcode': status_code,
+                'errortext': 'unable to verify user credentials',
+            }
+        }
+        return response
+
+    def test_iter_list_error(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            self._page(0, 2, 5),
+            self._error(432),
+        ])
+        # 実行
+        items = client.iter_list('listVirtualMachines', pagesize=2)
+        # 検証
+        try:
+            list(items)
+        except ApiErrorException as e:
+            eq_(e.status_code, 432)
+            eq_('%s' % e, 'listVirtualMachines: '
+                'unable to verify user credentials')
+        else:
+            raise AssertionError('ApiErrorException not raised')
+
+    @raises(ApiErrorException)
+    def test_list_all_error(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(return_value=self._error(530))
+        # 実行
+        client.list_all('listVirtualMachines')
+
+
+class Test_ListAll(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def _request(self, total):
+        def request(method, params, headers, data):
+            page = int(params['page'])
+            pagesize = int(params['pagesize'])
+            start = (page - 1) * pagesize
+            stop = min(start + pagesize, total)
+            response = mock.Mock()
+            response.status_code = 200
+            response.headers = {}
+            response.json = lambda: {
+                'listeventsresponse': {
+                    'count': total,
+                    'event': [{'id': i} for i in range(start, stop)],
+                }
+            }
+            return response
+        return mock.Mock(side_effect=request)
+
+    def test_list_all(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = self._request(95)
+        # 実行
+        items = client.list_all('listEvents', pagesize=10, workers=4)
+        # 検証
+        eq_([item['id'] for item in items], list(range(95)))
+        eq_(client.request.call_count, 10)
+
+    def test_list_all_fields(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = self._request(25)
+        # 実行
+        items = client.list_all('listEvents', pagesize=10, fields=['id'])
+        # 検証
+        eq_([item.id for item in items], list(range(25)))
+        eq_(items[0]._fields, ('id', ))
+
+    def test_iter_pages_parallel_close(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = self._request(1000)
+        # 実行
+        pages = client.iter_pages_parallel('listEvents', {}, pagesize=10,
+                                           workers=2)
+        next(pages)
+        next(pages)
+        pages.close()
+        # 検証
+        # 残りのページはまとめて取得されない
+        ok_(client.request.call_count <= 5)
+
+    def test_list_all_single_page(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = self._request(10)
+        # 実行
+        items = client.list_all('listEvents', pagesize=10)
+        # 検証
+        eq_(len(items), 10)
+        eq_(client.request.call_count, 1)
+
+    def test_list_all_from_page(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = self._request(45)
+        # 実行
+        items = client.list_all('listEvents', pagesize=10, page='3')
+        # 検証
+        eq_([item['id'] for item in items], list(range(20, 45)))
+        eq_(client.request.call_count, 3)
+
+
+class Test_ThreadSafety(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def _echo_request(self, method, params, headers, data):
+        response = mock.Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.json = lambda: {
+            'listusersresponse': {
+                'account': params.get('account'),
+            }
+        }
+        return response
+
+    def test_invoke_keeps_params(self):
+        client = SignatureClient(self.ENDPOINT, 'apikey', 'secretkey',
+                                 async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=self._echo_request)
+        # 実行
+        params = {'account': 'admin'}
+        client.invoke('listUsers', params)
+        # 検証
+        eq_(params, {'account': 'admin'})
+
+    def test_map(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=self._echo_request)
+        # 実行
+        params_list = [{'account': 'user%d' % i} for i in range(20)]
+        responses = client.map('listUsers', params_list, workers=4)
+        # 検証
+        eq_(
+            [r.content_body['listusersresponse']['account']
+             for r in responses],
+            ['user%d' % i for i in range(20)],
+        )
+        eq_(params_list[0], {'account': 'user0'})
+
+    def test_map_single_login(self):
+        client = CookieClient(self.ENDPOINT, 'admin', 'password',
+                              async_block=False)
+
+        # モックアウト
+        def login(username, password, digest):
+            time.sleep(0.05)
+            return 'hogehoge'
+        client.login = mock.Mock(side_effect=login)
+        client.request = mock.Mock(side_effect=self._echo_request)
+        # 実行
+        client.map('listUsers', [{}] * 10, workers=5)
+        # 検証
+        eq_(client.login.call_count, 1)
+        for call in client.request.call_args_list:
+            eq_(call[0][1]['sessionkey'], 'hogehoge')
+
+    def test_fan_out(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+
+        # モックアウト
+        def request(method, params, headers, data):
+            if params['account'] == 'user1':
+                raise RetryLimitExceededException('Retry limit exceeded')
+            return self._echo_request(method, params, headers, data)
+        client.request = mock.Mock(side_effect=request)
+        # 実行
+        params_list = [{'account': 'user%d' % i} for i in range(4)]
+        results = list(client.fan_out('listUsers', params_list, workers=2))
+        # 検証
+        eq_([r.params for r in results], params_list)
+        eq_([r.succeeded for r in results], [True, False, True, True])
+        eq_(results[0].response.content_body['listusersresponse']['account'],
+            'user0')
+        eq_(results[1].response, None)
+        ok_(isinstance(results[1].error, RetryLimitExceededException))
+
+
+class Test_Coalesce(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def _slow_request(self, content_body):
+        def request(method, params, headers, data):
+            # 他のスレッドが同じリクエストを出すまで待つ
+            time.sleep(0.1)
+            response = mock.Mock()
+            response.status_code = 200
+            response.headers = {}
+            response.json = lambda: content_body
+            return response
+        return mock.Mock(side_effect=request)
+
+    def test_invoke(self):
+        client = IntegrationClient(self.ENDPOINT, coalesce=True)
+        # モックアウト
+        client.request = self._slow_request({
+            'listvirtualmachinesresponse': {'count': 1},
+        })
+        # 実行
+        responses = client.map('listVirtualMachines', [{'id': 'x'}] * 8,
+                               workers=8)
+        # 検証
+        eq_(client.request.call_count, 1)
+        eq_(len(set(id(r) for r in responses)), 1)
+
+    def test_mutating_not_coalesced(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False,
+                                   coalesce=True)
+        # モックアウト
+        client.request = self._slow_request({
+            'deployvirtualmachineresponse': {'jobid': 'a'},
+        })
+        # 実行
+        client.map('deployVirtualMachine', [{'zoneid': 'z'}] * 4, workers=4)
+        # 検証
+        eq_(client.request.call_count, 4)
+
+    def test_query_job(self):
+        client = IntegrationClient(self.ENDPOINT, coalesce=True)
+        # モックアウト
+        client.request = self._slow_request({
+            'queryasyncjobresultresponse': {'jobid': 'a', 'jobstatus': 1},
+        })
+        # 実行
+        results = imap_ordered(client.query_job, ['a'] * 8, 8)
+        # 検証
+        eq_([r['jobstatus'] for r in results], [1] * 8)
+        eq_(client.request.call_count, 1)
+
+    def test_different_params(self):
+        client = IntegrationClient(self.ENDPOINT, coalesce=True)
+        # モックアウト
+        client.request = self._slow_request({})
+        # 実行
+        client.map('listVirtualMachines', [{'id': 'x'}, {'id': 'y'}],
+                   workers=2)
+        # 検証
+        eq_(client.request.call_count, 2)
+
+
+class Test_SingleFlight(object):
+
+    def test_sequential_calls(self):
+        single_flight = SingleFlight()
+        func = mock.Mock(return_value=1)
+        eq_(single_flight.do('key', func), 1)
+        eq_(single_flight.do('key', func), 1)
+        # 終わった呼び出しの結果は使い回さない
+        eq_(func.call_count, 2)
+
+    def test_error_shared(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def func():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError('failed')
+
+        def follower():
+            started.wait(5)
+            try:
+                single_flight.do('key', func)
+            except ValueError as e:
+                errors.append(e)
+        thread = threading.Thread(target=follower)
+        thread.start()
+        try:
+            single_flight.do('key', func)
+        except ValueError as e:
+            errors.append(e)
+        thread.join()
+        eq_(len(errors), 2)
+        ok_(errors[0] is errors[1])
+
+
+class Test_ImapOrdered(object):
+
+    def test_order(self):
+        results = imap_ordered(lambda i: i * 2, range(20), 4)
+        eq_(list(results), [i * 2 for i in range(20)])
+
+    def test_inline(self):
+        results = imap_ordered(lambda i: i * 2, range(5), 1)
+        eq_(list(results), [0, 2, 4, 6, 8])
+
+    def test_yield_before_input_ends(self):
+        more_input = threading.Event()
+
+        def items():
+            yield 1
+            # 次の入力が来るまで読み込みが止まる
+            more_input.wait(5)
+            yield 2
+
+        results = imap_ordered(lambda i: i, items(), 4)
+        # 入力が止まっていても終わった結果は返る
+        eq_(next(results), 1)
+        ok_(not more_input.is_set())
+        more_input.set()
+        eq_(list(results), [2])
+
+    @raises(ValueError)
+    def test_error(self):
+        def func(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+        list(imap_ordered(func, range(10), 4))
+
+
+class Test_PollingPolicy(object):
+
+    def test_backoff(self):
+        policy = PollingPolicy(min_interval=1, max_interval=5, jitter=0)
+        intervals = policy.intervals()
+        eq_([next(intervals) for _i in range(5)], [1, 2, 4, 5, 5])
+
+    def test_hints(self):
+        policy = PollingPolicy(min_interval=0.2, max_interval=60, jitter=0)
+        intervals = policy.intervals('deployVirtualMachine')
+        eq_(next(intervals), 5.0)
+        intervals = policy.intervals('attachVolume')
+        eq_(next(intervals), 0.5)
+        intervals = policy.intervals('unknownCommand')
+        eq_(next(intervals), 0.2)
+
+    def test_jitter(self):
+        policy = PollingPolicy(min_interval=1, max_interval=1, jitter=0.1)
+        intervals = policy.intervals()
+        for _i in range(100):
+            ok_(0.9 <= next(intervals) <= 1.1)
+
+    def test_fixed(self):
+        policy = PollingPolicy.fixed(3)
+        intervals = policy.intervals('deployVirtualMachine')
+        eq_([next(intervals) for _i in range(3)], [3, 3, 3])
 
 
 class Test_SignatureClient(object):
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+import nose
+from nose.plugins.skip import SkipTest
+from nose.tools.trivial import eq_, ok_
+
+if sys.version_info < (3, 8):
+    raise SkipTest('asyncio clients require Python 3.8 or later')
+
+import asyncio
+import json
+
+from cmonkey import PollingPolicy
+from cmonkey.aio import (
+    AsyncCookieClient,
+    AsyncHttpResponse,
+    AsyncIntegrationClient,
+    AsyncSignatureClient,
+)
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _response(content_body, status_code=200):
+    content = json.dumps(content_body).encode('utf-8')
+    return AsyncHttpResponse(status_code, {}, content)
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _run_all(coroutines):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(asyncio.gather(*coroutines))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class Test_AsyncSignatureClient(object):
+
+    APIKEY = 'p-dZvP8oknG8RwRuHM_k-pTCqni9wY-_n3mdroNn4Bo9u_hG9FXO39gcjmWWCwClSJgP47-fU3JBh8yCs_Do1A'
+    SECRETKEY = 'HzlToLKEgOenK11URMpy-3arN5ZJ0JqRC-We9FDhcEbKtMIBE71kebVeYCWeLNA7SIZVDpM_yUSM6vtjU7K3MQ'
+    SIGNATURE = b'jhoz5uOKJp8707r9MeMJjCOVLqM='
+
+    def test_request(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = AsyncSignatureClient(
+            endpoint,
+            self.APIKEY,
+            self.SECRETKEY,
+            async_block=False,
+        )
+        # モックアウト
+        client.request = mock.AsyncMock(return_value=_response({}))
+        # 実行
+        params = {
+            'account': 'admin',
+            'response': 'json',
+        }
+        _run(client.listUsers(**params))
+        # 検証
+        params['command'] = 'listUsers'
+        params['apikey'] = self.APIKEY
+        params['signature'] = self.SIGNATURE
+        calls = [
+            mock.call('GET', params, None, None)
+        ]
+        client.request.assert_has_calls(calls)
+
+
+class Test_AsyncCookieClient(object):
+
+    def test_session_cached(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = AsyncCookieClient(endpoint, 'admin', 'password',
+                                   async_block=False)
+        # モックアウト
+        client.request = mock.AsyncMock(side_effect=[
+            _response({'loginresponse': {'sessionkey': 'hoge'}}),
+            _response({}),
+            _response({}),
+        ])
+        # 実行
+        _run(client.listUsers())
+        _run(client.listZones())
+        # 検証
+        eq_(client.request.call_count, 3)
+        params = client.request.call_args[0][1]
+        eq_(params['sessionkey'], 'hoge')
+
+    def test_session_expired_status(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = AsyncCookieClient(endpoint, 'admin', 'password',
+                                   async_block=False)
+        # モックアウト
+        client.request = mock.AsyncMock(side_effect=[
+            _response({'loginresponse': {'sessionkey': 'old'}}),
+            _response({}, status_code=401),
+            _response({'loginresponse': {'sessionkey': 'new'}}),
+            _response({}),
+        ])
+        # 実行
+        api_response = _run(client.listUsers())
+        # 検証
+        eq_(api_response.status_code, 200)
+        params = client.request.call_args[0][1]
+        eq_(params['sessionkey'], 'new')
+
+
+class Test_AsyncIntegrationClient(object):
+
+    def test_async_block(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = AsyncIntegrationClient(
+            endpoint,
+            polling_policy=PollingPolicy.fixed(0),
+        )
+        # モックアウト
+        client.request = mock.AsyncMock(side_effect=[
+            _response({'addvpnuserresponse': {'jobid': 'a'}}),
+            _response({'queryasyncjobresultresponse': {
+                'jobid': 'a',
+                'jobstatus': 0,
+            }}),
+            _response({'queryasyncjobresultresponse': {
+                'jobid': 'a',
+                'jobstatus': 1,
+                'jobresult': {'vpnuser': {}},
+            }}),
+        ])
+        # 実行
+        api_response = _run(client.addVpnUser(username='foo'))
+        # 検証
+        ok_(api_response.job.succeeded)
+        eq_(api_response.job.job_result, {'vpnuser': {}})
+        eq_(client.request.call_count, 3)
+
+    def test_wait_jobs(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = AsyncIntegrationClient(
+            endpoint,
+            polling_policy=PollingPolicy.fixed(0),
+        )
+        statuses = {'a': [0, 0, 1], 'b': [1]}
+
+        # モックアウト
+        def request(method, params, headers, data):
+            job_id = params['jobid']
+            return _response({'queryasyncjobresultresponse': {
+                'jobid': job_id,
+                'jobstatus': statuses[job_id].pop(0),
+            }})
+        client.request = mock.AsyncMock(side_effect=request)
+        # 実行
+        jobs = [
+            {'deployvirtualmachineresponse': {'jobid': 'a'}},
+            {'deployvirtualmachineresponse': {'jobid': 'b'}},
+        ]
+        results = _run(client.wait_jobs(jobs))
+        # 検証
+        eq_([r.job_id for r in results], ['a', 'b'])
+        eq_(statuses, {'a': [], 'b': []})
+
+    def test_coalesce(self):
+        endpoint = 'http://localhost:8080/client/api'
+        client = AsyncIntegrationClient(endpoint, coalesce=True)
+        # モックアウト
+        client.request = mock.AsyncMock(
+            return_value=_response({'listzonesresponse': {'count': 0}}),
+        )
+        # 実行
+        responses = _run_all([
+            client.listZones(available='true') for _i in range(5)
+        ])
+        # 検証
+        eq_(client.request.call_count, 1)
+        eq_(len(set(id(r) for r in responses)), 1)
+
+    def test_stringify(self):
+        client = AsyncIntegrationClient('http://localhost:8080/client/api')
+        params = client._stringify({'signature': b'abc', 'page': 1})
+        eq_(params, {'signature': 'abc', 'page': '1'})
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
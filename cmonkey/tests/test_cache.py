@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+
+import nose
+from nose.tools.trivial import eq_, ok_
+
+from cmonkey import CookieClient, IntegrationClient
+from cmonkey.cache import MemoryBackend, ResponseCache, SqliteBackend
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _response(content_body, status_code=200):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = {}
+    response.json = lambda: content_body
+    return response
+
+
+class Test_MemoryBackend(object):
+
+    def test_lru(self):
+        backend = MemoryBackend(maxsize=2)
+        expires = time.time() + 60
+        backend.set('a', 1, expires)
+        backend.set('b', 2, expires)
+        # a を使ったので b が追い出される
+        eq_(backend.get('a'), 1)
+        backend.set('c', 3, expires)
+        eq_(backend.get('b'), None)
+        eq_(backend.get('a'), 1)
+        eq_(backend.get('c'), 3)
+
+    def test_expired(self):
+        backend = MemoryBackend()
+        backend.set('a', 1, time.time() - 1)
+        eq_(backend.get('a'), None)
+        eq_(len(backend), 0)
+
+
+class Test_SqliteBackend(object):
+
+    def test_persistent(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'cache.sqlite')
+            backend = SqliteBackend(path)
+            backend.set('a', [200, {}, {'x': 1}], time.time() + 60)
+            backend.close()
+            # 別のプロセスからも読める
+            backend = SqliteBackend(path)
+            eq_(backend.get('a'), [200, {}, {'x': 1}])
+            backend.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lru(self):
+        backend = SqliteBackend(':memory:', maxsize=2)
+        expires = time.time() + 60
+        backend.set('a', 1, expires)
+        time.sleep(0.01)
+        backend.set('b', 2, expires)
+        time.sleep(0.01)
+        eq_(backend.get('a'), 1)
+        time.sleep(0.01)
+        backend.set('c', 3, expires)
+        eq_(backend.get('b'), None)
+        eq_(len(backend), 2)
+
+    def test_expired(self):
+        backend = SqliteBackend(':memory:')
+        backend.set('a', 1, time.time() - 1)
+        eq_(backend.get('a'), None)
+        eq_(len(backend), 0)
+
+
+class Test_ResponseCache(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def test_cacheable(self):
+        cache = ResponseCache(ttls={'listVirtualMachines': 0,
+                                    'queryAsyncJobResult': 5})
+        ok_(cache.cacheable('listZones'))
+        ok_(cache.cacheable('getUser'))
+        ok_(not cache.cacheable('deployVirtualMachine'))
+        ok_(not cache.cacheable('listAsyncJobs'))
+        ok_(not cache.cacheable('listVirtualMachines'))
+        ok_(cache.cacheable('queryAsyncJobResult'))
+
+    def test_key_normalized(self):
+        cache = ResponseCache()
+        key = cache.key('ns', 'listZones', {
+            'available': 'true',
+            'page': 1,
+            'response': 'json',
+            'sessionkey': 'foo',
+        })
+        eq_(key, cache.key('ns', 'listZones', {'page': '1',
+                                               'available': 'true'}))
+        ok_(key != cache.key('other', 'listZones', {'page': '1',
+                                                    'available': 'true'}))
+
+    def test_invoke(self):
+        cache = ResponseCache()
+        client = IntegrationClient(self.ENDPOINT, cache=cache)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            _response({'listzonesresponse': {'count': 1}}),
+            _response({'deployvirtualmachineresponse': {}}),
+            _response({'deployvirtualmachineresponse': {}}),
+        ])
+        # 実行
+        first = client.listZones(available='true')
+        second = client.listZones(available='true')
+        client.deployVirtualMachine(zoneid='z')
+        client.deployVirtualMachine(zoneid='z')
+        # 検証
+        eq_(first.content_body, second.content_body)
+        eq_(second.status_code, 200)
+        eq_(client.request.call_count, 3)
+        eq_(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_error_not_cached(self):
+        cache = ResponseCache()
+        client = IntegrationClient(self.ENDPOINT, cache=cache)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            _response({'errorresponse': {}}, status_code=431),
+            _response({'listzonesresponse': {}}),
+        ])
+        # 実行
+        client.listZones()
+        api_response = client.listZones()
+        # 検証
+        eq_(api_response.status_code, 200)
+        eq_(client.request.call_count, 2)
+
+    def test_namespace(self):
+        cache = ResponseCache()
+        clients = [
+            CookieClient(self.ENDPOINT, 'alice', 'password', cache=cache),
+            CookieClient(self.ENDPOINT, 'bob', 'password', cache=cache),
+        ]
+        # モックアウト
+        for client in clients:
+            client._store_session_key('key')
+            client.request = mock.Mock(return_value=_response({}))
+        # 実行
+        for client in clients:
+            client.listUsers()
+        # 検証
+        # ユーザが違えば同じコマンドでも共有しない
+        eq_(cache.stats()['misses'], 2)
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import CookieClient, PollingPolicy, SignatureClient
+from cmonkey.cassette import (
+    REDACTED,
+    CassetteMissException,
+    CassettePlayer,
+    CassetteRecorder,
+    ReplayResponse,
+    read_records,
+    recorded_calls,
+    replay_load,
+)
+from cmonkey.fakeserver import FakeCloudStack
+
+
+class _Base(object):
+
+    def _path(self):
+        self.tmpdir = tempfile.mkdtemp()
+        return os.path.join(self.tmpdir, 'cassette.ndjson.gz')
+
+    def _cleanup(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _signature_client(self, entry_point, cassette, **options):
+        return SignatureClient(entry_point, 'apikey', 'secretkey',
+                               polling_policy=PollingPolicy.fixed(0.01),
+                               cassette=cassette, **options)
+
+    def _record(self, path, **server_options):
+        with FakeCloudStack(job_duration=0.05, **server_options) as server:
+            with CassetteRecorder(path, server.entry_point) as recorder:
+                client = self._signature_client(server.entry_point, recorder)
+                listed = client.listZones(page=1, pagesize=2)
+                deployed = client.deployVirtualMachine(zoneid='zone-0')
+        return listed, deployed
+
+
+class Test_CassetteRecorder(_Base):
+
+    def test_record(self):
+        path = self._path()
+        # 実行
+        self._record(path)
+        # 検証
+        records = list(read_records(path))
+        commands = [r['params']['command'] for r in records]
+        eq_(commands[:2], ['listZones', 'deployVirtualMachine'])
+        ok_(all(c == 'queryAsyncJobResult' for c in commands[2:]))
+        ok_(len(commands) >= 3)
+        for record in records:
+            eq_(record['params']['signature'], REDACTED)
+            eq_(record['params']['apikey'], REDACTED)
+        with gzip.open(path, 'rb') as f:
+            eq_(json.loads(f.readline().decode())['cassette'], 1)
+        self._cleanup()
+
+    def test_record_cookie(self):
+        path = self._path()
+        with FakeCloudStack() as server:
+            with CassetteRecorder(path) as recorder:
+                client = CookieClient(server.entry_point, 'admin',
+                                      'password', cassette=recorder)
+                # 実行
+                client.listZones()
+        # 検証
+        login, listed = list(read_records(path))
+        eq_(login['data']['password'], REDACTED)
+        eq_(json.loads(login['body'])['loginresponse']['sessionkey'],
+            REDACTED)
+        eq_(login['headers']['Set-Cookie'],
+            'JSESSIONID=%s; Path=/client' % REDACTED)
+        eq_(listed['params']['sessionkey'], REDACTED)
+        self._cleanup()
+
+    def test_record_secretkey(self):
+        path = self._path()
+        user = {'id': 'user-1', 'apikey': 'key', 'secretkey': 's3cr3t'}
+        response = ReplayResponse({
+            'status': 200,
+            'headers': {},
+            'body': json.dumps({'registeruserkeysresponse': {
+                'userkeys': user,
+            }}),
+        })
+        # 実行
+        with CassetteRecorder(path) as recorder:
+            recorder.record('GET', {'command': 'updateUser',
+                                    'secretkey': 's3cr3t'},
+                            {}, response, time.time(), 0.1)
+        # 検証
+        record, = list(read_records(path))
+        eq_(record['params']['secretkey'], REDACTED)
+        userkeys = json.loads(record['body'])[
+            'registeruserkeysresponse']['userkeys']
+        eq_(userkeys, {'id': 'user-1', 'apikey': REDACTED,
+                       'secretkey': REDACTED})
+        ok_('s3cr3t' not in json.dumps(record))
+        self._cleanup()
+
+    def test_read_unclosed(self):
+        path = self._path()
+        with FakeCloudStack() as server:
+            recorder = CassetteRecorder(path)
+            client = self._signature_client(server.entry_point, recorder)
+            client.listZones()
+            client.listHosts()
+            # 実行
+            # 閉じる前にプロセスが終わったときと同じ状態にする
+            recorder._file.flush()
+            shutil.copy(path, path + '.copy')
+            recorder.close()
+        # 検証
+        records = list(read_records(path + '.copy'))
+        eq_([r['params']['command'] for r in records],
+            ['listZones', 'listHosts'])
+        self._cleanup()
+
+
+class Test_CassettePlayer(_Base):
+
+    def test_replay(self):
+        path = self._path()
+        listed, deployed = self._record(path)
+        player = CassettePlayer(path)
+        # 認証情報が違っても同じリクエストとみなす
+        client = SignatureClient('http://localhost:1/client/api',
+                                 'other', 'other',
+                                 polling_policy=PollingPolicy.fixed(0.01),
+                                 cassette=player)
+        # 実行
+        replayed_list = client.listZones(page=1, pagesize=2)
+        replayed_deploy = client.deployVirtualMachine(zoneid='zone-0')
+        # 検証
+        eq_(replayed_list.content_body, listed.content_body)
+        eq_(replayed_deploy.job.content_body, deployed.job.content_body)
+        eq_(player.served, player.records)
+        self._cleanup()
+
+    def test_replay_lightweight(self):
+        path = self._path()
+        listed, _deployed = self._record(path)
+        client = self._signature_client('http://localhost:1/client/api',
+                                        CassettePlayer(path),
+                                        lightweight=True)
+        # 実行
+        replayed = client.listZones(page=1, pagesize=2)
+        # 検証
+        eq_(replayed.content_body, listed.content_body)
+        self._cleanup()
+
+    def test_replay_stream(self):
+        path = self._path()
+        self._record(path, items=2)
+        client = self._signature_client('http://localhost:1/client/api',
+                                        CassettePlayer(path))
+        # 実行
+        items = list(client.iter_list('listZones', pagesize=2, stream=True,
+                                      page=1))
+        # 検証
+        eq_([item['id'] for item in items], ['zone-0', 'zone-1'])
+        self._cleanup()
+
+    @raises(CassetteMissException)
+    def test_miss(self):
+        path = self._path()
+        self._record(path)
+        client = self._signature_client('http://localhost:1/client/api',
+                                        CassettePlayer(path))
+        try:
+            client.listZones(page=2, pagesize=2)
+        finally:
+            self._cleanup()
+
+    def test_speed(self):
+        path = self._path()
+        self._record(path, latency=0.1)
+        # 実行
+        client = self._signature_client('http://localhost:1/client/api',
+                                        CassettePlayer(path, speed=2.0))
+        started = time.time()
+        client.listZones(page=1, pagesize=2)
+        elapsed = time.time() - started
+        # 検証
+        ok_(0.05 <= elapsed < 0.1)
+        self._cleanup()
+
+
+class Test_ReplayLoad(_Base):
+
+    def test_recorded_calls(self):
+        path = self._path()
+        self._record(path)
+        # 実行
+        calls = list(recorded_calls(path, speed=None))
+        # 検証
+        eq_(calls[0], (0.0, 'listZones', {'page': '1', 'pagesize': '2'}))
+        eq_(calls[1][1:], ('deployVirtualMachine', {'zoneid': 'zone-0'}))
+        self._cleanup()
+
+    def test_replay_load(self):
+        path = self._path()
+        self._record(path)
+        with FakeCloudStack() as server:
+            client = self._signature_client(server.entry_point, None,
+                                            async_block=False)
+            # 実行
+            calls = list(replay_load(client, path, speed=10.0, workers=2))
+            stats = server.stats()
+        # 検証
+        eq_([c.command for c in calls[:2]],
+            ['listZones', 'deployVirtualMachine'])
+        ok_(all(c.error is None for c in calls))
+        eq_(stats['commands']['listZones'], 1)
+        eq_(stats['requests'], len(calls))
+        self._cleanup()
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
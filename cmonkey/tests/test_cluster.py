@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import (
+    ApiResponse,
+    CookieClient,
+    PollingPolicy,
+    SignatureClient,
+)
+from cmonkey.cluster import (
+    LEAST_OUTSTANDING,
+    ClusterClient,
+    NoAvailableNodeException,
+)
+from cmonkey.fakeserver import FakeCloudStack
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _unused_entry_point():
+    # 何も待ち受けていないポート
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:%d/client/api' % port
+
+
+def _mock_client(entry_point, responses):
+    client = mock.Mock()
+    client.entry_point = entry_point
+    client.invoke = mock.Mock(side_effect=responses)
+    return client
+
+
+class Test_ClusterClient(object):
+
+    def test_round_robin(self):
+        servers = [FakeCloudStack().start() for _ in range(3)]
+        try:
+            cluster = ClusterClient.create(
+                SignatureClient,
+                [server.entry_point for server in servers],
+                'apikey', 'secretkey',
+            )
+            # 実行
+            responses = cluster.map('listZones', [{}] * 9, workers=3)
+            # 検証
+            ok_(all(r.status_code == 200 for r in responses))
+            eq_([server.stats()['requests'] for server in servers],
+                [3, 3, 3])
+        finally:
+            for server in servers:
+                server.stop()
+
+    def test_least_outstanding(self):
+        clients = [
+            _mock_client('http://node%d/client/api' % i,
+                         lambda command, params, stream: ApiResponse(
+                             200, {}, {}))
+            for i in range(3)
+        ]
+        cluster = ClusterClient(clients, strategy=LEAST_OUTSTANDING)
+        # モックアウト
+        cluster.nodes[0].outstanding = 2
+        cluster.nodes[1].outstanding = 1
+        # 実行
+        for _ in range(3):
+            cluster.listZones()
+        # 検証
+        eq_(clients[2].invoke.call_count, 3)
+        eq_(clients[0].invoke.call_count, 0)
+
+    def test_failover(self):
+        with FakeCloudStack() as server:
+            cluster = ClusterClient.create(
+                SignatureClient,
+                [_unused_entry_point(), server.entry_point],
+                'apikey', 'secretkey',
+                max_failures=2,
+            )
+            # 実行
+            responses = [cluster.listZones() for _ in range(4)]
+            stats = cluster.stats()
+        # 検証
+        ok_(all(r.status_code == 200 for r in responses))
+        eq_(stats[0]['failures'], 2)
+        eq_(stats[0]['available'], False)
+        eq_(stats[1]['requests'], 4)
+
+    def test_server_error_failover(self):
+        clients = [
+            _mock_client('http://node0/client/api',
+                         [ApiResponse(503, {}, {})]),
+            _mock_client('http://node1/client/api',
+                         [ApiResponse(200, {}, {})]),
+        ]
+        cluster = ClusterClient(clients)
+        # 実行
+        response = cluster.listZones()
+        # 検証
+        eq_(response.status_code, 200)
+        eq_(cluster.stats()[0]['failures'], 1)
+
+    def test_api_error_returned(self):
+        body = {'listhostsresponse': {
+            'errorcode': 531,
+            'errortext': 'not allowed',
+        }}
+        clients = [
+            _mock_client('http://node%d/client/api' % i,
+                         lambda command, params, stream: ApiResponse(
+                             531, {}, body))
+            for i in range(2)
+        ]
+        cluster = ClusterClient(clients, max_failures=1)
+        # 実行
+        responses = [cluster.listHosts() for _ in range(4)]
+        # 検証
+        # CloudStack のエラーはノードの障害ではない
+        eq_([r.status_code for r in responses], [531] * 4)
+        eq_([c.invoke.call_count for c in clients], [2, 2])
+        stats = cluster.stats()
+        eq_([s['failures'] for s in stats], [0, 0])
+        eq_([s['available'] for s in stats], [True, True])
+
+    @raises(IOError)
+    def test_no_failover_for_mutation(self):
+        clients = [
+            _mock_client('http://node0/client/api', IOError('reset')),
+            _mock_client('http://node1/client/api',
+                         [ApiResponse(200, {}, {})]),
+        ]
+        cluster = ClusterClient(clients)
+        try:
+            # 実行
+            cluster.deployVirtualMachine(zoneid='zone1')
+        finally:
+            # 検証
+            # 送られたかもしれないので他のノードでは実行しない
+            eq_(clients[1].invoke.call_count, 0)
+
+    def test_all_ejected(self):
+        clients = [
+            _mock_client('http://node%d/client/api' % i,
+                         IOError('refused'))
+            for i in range(2)
+        ]
+        cluster = ClusterClient(clients, max_failures=1)
+        for _ in range(2):
+            try:
+                cluster.listZones()
+            except IOError:
+                pass
+        clients[1].invoke = mock.Mock(return_value=ApiResponse(200, {}, {}))
+        cluster.nodes[1].ejected_until = 1.0
+        # 実行
+        # 全て外れていても最も早く戻るノードには送る
+        response = cluster.listZones()
+        # 検証
+        eq_(response.status_code, 200)
+
+    @raises(NoAvailableNodeException)
+    def test_no_node(self):
+        clients = [
+            _mock_client('http://node0/client/api', IOError('refused')),
+        ]
+        cluster = ClusterClient(clients)
+        cluster._acquire(set(cluster.nodes))
+
+    def test_slow_node_ejected(self):
+        def slow(command, params, stream):
+            time.sleep(0.05)
+            return ApiResponse(200, {}, {})
+        clients = [
+            _mock_client('http://node0/client/api', slow),
+            _mock_client('http://node1/client/api',
+                         lambda command, params, stream: ApiResponse(
+                             200, {}, {})),
+        ]
+        cluster = ClusterClient(clients, slow_threshold=0.03)
+        # 実行
+        for _ in range(4):
+            cluster.listZones()
+        # 検証
+        stats = cluster.stats()
+        eq_([s['available'] for s in stats], [False, True])
+        eq_(clients[0].invoke.call_count, 1)
+        eq_(clients[1].invoke.call_count, 3)
+
+    def test_cookie_login_per_node(self):
+        servers = [FakeCloudStack().start() for _ in range(2)]
+        try:
+            cluster = ClusterClient.create(
+                CookieClient,
+                [server.entry_point for server in servers],
+                'admin', 'password',
+            )
+            # 実行
+            for _ in range(6):
+                cluster.listZones()
+            # 検証
+            eq_([server.stats()['logins'] for server in servers], [1, 1])
+        finally:
+            for server in servers:
+                server.stop()
+
+    def test_job_pinned(self):
+        servers = [FakeCloudStack(job_duration=0.05).start()
+                   for _ in range(2)]
+        try:
+            cluster = ClusterClient.create(
+                SignatureClient,
+                [server.entry_point for server in servers],
+                'apikey', 'secretkey',
+                async_block=False,
+                polling_policy=PollingPolicy.fixed(0.01),
+            )
+            # 実行
+            response = cluster.deployVirtualMachine(zoneid='zone1')
+            job = cluster.block(response.content_body)
+            # 検証
+            ok_(job.succeeded)
+            queried = [
+                server.stats()['commands'].get('queryAsyncJobResult', 0)
+                for server in servers
+            ]
+            # JOB を登録したノードにだけ問い合わせる
+            ok_(queried[0] > 0)
+            eq_(queried[1], 0)
+        finally:
+            for server in servers:
+                server.stop()
+
+    def test_check_health(self):
+        with FakeCloudStack() as server:
+            dead = _unused_entry_point()
+            cluster = ClusterClient.create(
+                SignatureClient,
+                [server.entry_point, dead],
+                'apikey', 'secretkey',
+            )
+            cluster.nodes[0].ejected_until = float('inf')
+            # 実行
+            healthy = cluster.check_health()
+            stats = cluster.stats()
+        # 検証
+        eq_(healthy, {server.entry_point: True, dead: False})
+        eq_([s['available'] for s in stats], [True, False])
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+
+import nose
+from nose.tools.trivial import eq_, ok_
+
+from cmonkey.compact import Interner, Projection, project
+
+
+def _vm(i):
+    return {
+        'id': 'vm-%06d' % i,
+        'name': 'vm%d' % i,
+        'state': 'Running',
+        'zonename': 'zone%d' % (i % 3),
+        'nic': [{'id': 'nic-%d' % i, 'ipaddress': '10.0.0.%d' % (i % 250)}],
+        'tags': [{'key': 'role', 'value': 'web'}],
+    }
+
+
+class Test_Interner(object):
+
+    def test_intern(self):
+        interner = Interner()
+        # 実行
+        # 同じ値の別々の文字列オブジェクトを作る
+        first = interner(json.loads('"Running"'))
+        second = interner(json.loads('"Running"'))
+        # 検証
+        ok_(first is second)
+
+    def test_not_string(self):
+        interner = Interner()
+        # 実行
+        value = interner(10)
+        # 検証
+        eq_(value, 10)
+        eq_(interner(None), None)
+
+    def test_limit(self):
+        interner = Interner(limit=2)
+        # 実行
+        for i in range(3):
+            interner('value%d' % i)
+        # 検証
+        ok_(not interner.enabled)
+        eq_(interner('value0'), 'value0')
+
+
+class Test_Projection(object):
+
+    def test_project(self):
+        # 実行
+        rows = project([_vm(i) for i in range(4)], ['id', 'state', 'owner'])
+        # 検証
+        eq_(len(rows), 4)
+        eq_(rows[1].id, 'vm-000001')
+        eq_(rows[1].state, 'Running')
+        eq_(rows[1].owner, None)
+        eq_(rows[0]._asdict()['id'], 'vm-000000')
+        ok_(rows[0].state is rows[3].state)
+
+    def test_invalid_field_name(self):
+        projection = Projection(['id', 'class'])
+        # 実行
+        row = projection({'id': '1', 'class': 'x'})
+        # 検証
+        eq_(tuple(row), ('1', 'x'))
+        eq_(row._fields, ('id', '_1'))
+
+    def test_iter(self):
+        projection = Projection(['id'])
+        # 実行
+        rows = projection.iter(iter([_vm(0), _vm(1)]))
+        # 検証
+        eq_(next(rows).id, 'vm-000000')
+        eq_(next(rows).id, 'vm-000001')
+
+    def test_smaller_than_dict(self):
+        vm = json.loads(json.dumps(_vm(0)))
+        # 実行
+        row = Projection(['id', 'name', 'state'])(vm)
+        # 検証
+        ok_(sys.getsizeof(row) < sys.getsizeof(vm))
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
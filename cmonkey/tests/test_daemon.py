@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import ApiResponse, JobResult
+from cmonkey.daemon import (
+    Daemon,
+    DaemonErrorException,
+    DaemonUnavailableException,
+    default_socket_path,
+    forward,
+    trusted_socket,
+)
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _serve(client_factory, func):
+    tmpdir = tempfile.mkdtemp()
+    socket_path = os.path.join(tmpdir, 'cmonkey.sock')
+    daemon = Daemon(socket_path, client_factory).bind()
+    thread = threading.Thread(target=daemon.serve_forever,
+                              kwargs={'poll_interval': 0.05})
+    thread.start()
+    try:
+        return func(socket_path)
+    finally:
+        daemon.shutdown()
+        thread.join()
+        shutil.rmtree(tmpdir)
+
+
+class Test_Daemon(object):
+
+    def test_forward(self):
+        client = mock.Mock()
+        client.invoke = mock.Mock(return_value=ApiResponse(
+            200,
+            {'Content-Type': 'application/json'},
+            {'deployvirtualmachineresponse': {'jobid': 'a'}},
+            JobResult('a', 1, {}, {'jobid': 'a', 'jobstatus': 1}),
+        ))
+        client_factory = mock.Mock(return_value=client)
+        spec = {'entry_point': 'http://localhost:8080/client/api'}
+
+        def run(socket_path):
+            forward(socket_path, spec, 'deployVirtualMachine', {'a': '1'})
+            return forward(socket_path, spec, 'deployVirtualMachine', {})
+        # 実行
+        reply = _serve(client_factory, run)
+        # 検証
+        eq_(reply['status_code'], 200)
+        eq_(reply['job'], {'jobid': 'a', 'jobstatus': 1})
+        # 同じ認証情報のクライアントは使い回す
+        eq_(client_factory.call_count, 1)
+        client.invoke.assert_called_with('deployVirtualMachine', {})
+
+    def test_client_per_spec(self):
+        client_factory = mock.Mock()
+        client_factory.return_value.invoke.return_value = ApiResponse(
+            200, {}, {})
+
+        def run(socket_path):
+            forward(socket_path, {'username': 'alice'}, 'listUsers', {})
+            forward(socket_path, {'username': 'bob'}, 'listUsers', {})
+        _serve(client_factory, run)
+        eq_(client_factory.call_count, 2)
+
+    @raises(DaemonErrorException)
+    def test_error(self):
+        client_factory = mock.Mock()
+        client_factory.return_value.invoke.side_effect = ValueError('x')
+        _serve(client_factory,
+               lambda socket_path: forward(socket_path, {}, 'listUsers', {}))
+
+    @raises(DaemonUnavailableException)
+    def test_unavailable(self):
+        forward('/nonexistent/cmonkey.sock', {}, 'listUsers', {})
+
+    def test_stale_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            socket_path = os.path.join(tmpdir, 'cmonkey.sock')
+            # 誰も待ち受けていないソケットファイルを残す
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(socket_path)
+            sock.close()
+            # 前回の daemon と同じく自分だけが使える権限にしておく
+            os.chmod(socket_path, 0o600)
+            daemon = Daemon(socket_path, mock.Mock()).bind()
+            mode = os.stat(socket_path).st_mode & 0o777
+            daemon.close()
+            eq_(mode, 0o600)
+            ok_(not os.path.exists(socket_path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_untrusted_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            socket_path = os.path.join(tmpdir, 'cmonkey.sock')
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(socket_path)
+            sock.listen(1)
+            os.chmod(socket_path, 0o600)
+            ok_(trusted_socket(socket_path))
+            # 他のユーザも接続できるソケットは使わない
+            os.chmod(socket_path, 0o666)
+            ok_(not trusted_socket(socket_path))
+            try:
+                forward(socket_path, {}, 'listUsers', {})
+            except DaemonUnavailableException:
+                pass
+            else:
+                raise AssertionError('forwarded to untrusted socket')
+            sock.close()
+            ok_(not trusted_socket(os.path.join(tmpdir, 'missing.sock')))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @raises(DaemonErrorException)
+    def test_bind_not_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            socket_path = os.path.join(tmpdir, 'cmonkey.sock')
+            with open(socket_path, 'w') as f:
+                f.write('')
+            # ソケットでないファイルは消さずに諦める
+            try:
+                Daemon(socket_path, mock.Mock()).bind()
+            finally:
+                ok_(os.path.exists(socket_path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_private_directory(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # モックアウト
+            environ = {'TMPDIR': tmpdir}
+            with mock.patch.dict('os.environ', environ, clear=True):
+                socket_path = default_socket_path()
+            # 実行
+            daemon = Daemon(socket_path, mock.Mock()).bind()
+            mode = os.stat(os.path.dirname(socket_path)).st_mode & 0o777
+            daemon.close()
+            # 検証
+            eq_(os.path.dirname(os.path.dirname(socket_path)), tmpdir)
+            eq_(mode, 0o700)
+            environ = {'XDG_RUNTIME_DIR': '/run/user/1000'}
+            with mock.patch.dict('os.environ', environ, clear=True):
+                eq_(default_socket_path(), '/run/user/1000/cmonkey.sock')
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import nose
+from nose.tools.trivial import eq_, ok_
+
+from cmonkey import (
+    CookieClient,
+    IntegrationClient,
+    PollingPolicy,
+    SignatureClient,
+)
+from cmonkey.fakeserver import FakeCloudStack
+
+
+class Test_FakeCloudStack(object):
+
+    def test_signature(self):
+        with FakeCloudStack(apikey='foo', secretkey='bar') as server:
+            client = SignatureClient(server.entry_point, 'foo', 'bar')
+            eq_(client.listZones().status_code, 200)
+            client = SignatureClient(server.entry_point, 'foo', 'baz')
+            eq_(client.listZones().status_code, 401)
+
+    def test_cookie(self):
+        with FakeCloudStack() as server:
+            client = CookieClient(server.entry_point, 'admin', 'password')
+            eq_(client.listZones().status_code, 200)
+            eq_(client.listZones().status_code, 200)
+            eq_(server.stats()['logins'], 1)
+            # セッションが切れたらログインし直す
+            server.expire_sessions()
+            eq_(client.listZones().status_code, 200)
+            eq_(server.stats()['logins'], 2)
+
+    def test_cookie_digest(self):
+        with FakeCloudStack() as server:
+            client = CookieClient(server.entry_point, 'admin', 'password',
+                                  digest=True)
+            eq_(client.listZones().status_code, 200)
+
+    def test_integration_disabled(self):
+        with FakeCloudStack(integration=False) as server:
+            client = IntegrationClient(server.entry_point)
+            eq_(client.listZones().status_code, 401)
+
+    def test_pages(self):
+        with FakeCloudStack(items=25) as server:
+            client = IntegrationClient(server.entry_point)
+            items = client.list_all('listVirtualMachines', pagesize=10)
+            eq_([item['id'] for item in items],
+                ['virtualmachine-%d' % i for i in range(25)])
+            eq_(server.stats()['commands']['listVirtualMachines'], 3)
+
+    def test_async_job(self):
+        with FakeCloudStack(job_duration=0.1) as server:
+            client = IntegrationClient(
+                server.entry_point,
+                polling_policy=PollingPolicy.fixed(0.05),
+            )
+            api_response = client.deployVirtualMachine(zoneid='z')
+            ok_(api_response.job.succeeded)
+            ok_(server.stats()['commands']['queryAsyncJobResult'] >= 2)
+            jobs = client.listAsyncJobs().content_body
+            eq_(jobs['listasyncjobsresponse']['count'], 1)
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
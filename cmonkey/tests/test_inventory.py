@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import tempfile
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import (
+    ApiErrorException,
+    IntegrationClient,
+    RetryLimitExceededException,
+)
+from cmonkey.inventory import (
+    ADDED,
+    CHANGED,
+    REMOVED,
+    InventorySnapshot,
+    InventorySync,
+)
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+class _Cloud(object):
+
+    def __init__(self):
+        self.entities = {
+            'listVirtualMachines': [
+                {'id': 'vm-%d' % i, 'state': 'Running'} for i in range(5)
+            ],
+            'listVolumes': [{'id': 'vol-1', 'size': 10}],
+            'listPublicIpAddresses': [],
+            'listNetworks': [{'id': 'net-1', 'state': 'Implemented'}],
+            'listEvents': [],
+            'listAsyncJobs': [],
+        }
+        # (コマンド, ID) 毎に返すエラーのステータスコード
+        self.errors = {}
+        self.calls = []
+
+    def set(self, command, entity_id, item):
+        items = [i for i in self.entities[command] if i['id'] != entity_id]
+        if item is not None:
+            items.append(item)
+        self.entities[command] = items
+
+    def request(self, method, params, headers, data):
+        command = params['command']
+        self.calls.append((command, params.get('id')))
+        response = mock.Mock()
+        response.headers = {}
+        errorcode = self.errors.get((command, params.get('id')))
+        if errorcode is not None:
+            response.status_code = errorcode
+            response.json = lambda: {
+                '%sresponse' % command.lower(): {
+                    'errorcode': errorcode,
+                    'errortext': 'internal error',
+                }
+            }
+            return response
+        items = self.entities[command]
+        if 'id' in params:
+            items = [i for i in items if i['id'] == params['id']]
+        response.status_code = 200
+        response.json = lambda: {
+            '%sresponse' % command.lower(): {
+                'count': len(items),
+                'item': list(items),
+            }
+        }
+        return response
+
+
+class Test_InventorySync(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def _prepare(self):
+        self.cloud = _Cloud()
+        self.client = IntegrationClient(self.ENDPOINT, async_block=False)
+        self.client.request = mock.Mock(side_effect=self.cloud.request)
+        self.inventory = InventorySync(self.client)
+
+    def test_first_sync(self):
+        self._prepare()
+        # 実行
+        changes = self.inventory.sync()
+        # 検証
+        eq_(len(changes), 7)
+        ok_(all(change.kind == ADDED for change in changes))
+        eq_(len(self.inventory.snapshot.ids('virtualmachine')), 5)
+        ok_(self.inventory.snapshot.last_sync is not None)
+
+    def test_no_changes(self):
+        self._prepare()
+        self.inventory.sync()
+        self.cloud.calls = []
+        # 実行
+        changes = self.inventory.sync()
+        # 検証
+        eq_(changes, [])
+        # 変更がなければイベントと JOB だけを調べる
+        eq_(sorted(self.cloud.calls),
+            [('listAsyncJobs', None), ('listEvents', None)])
+
+    def test_incremental(self):
+        self._prepare()
+        self.inventory.sync()
+        self.cloud.calls = []
+        # モックアウト
+        self.cloud.set('listVirtualMachines', 'vm-1',
+                       {'id': 'vm-1', 'state': 'Stopped'})
+        self.cloud.set('listVirtualMachines', 'vm-2', None)
+        self.cloud.set('listVolumes', 'vol-2', {'id': 'vol-2', 'size': 20})
+        self.cloud.entities['listAsyncJobs'] = [
+            {'jobid': 'job-1', 'jobinstancetype': 'VirtualMachine',
+             'jobinstanceid': 'vm-1'},
+            {'jobid': 'job-2', 'jobinstancetype': 'Template',
+             'jobinstanceid': 'template-1'},
+        ]
+        self.cloud.entities['listEvents'] = [
+            {'id': 'event-1', 'type': 'VM.DESTROY',
+             'resourcetype': 'VirtualMachine', 'resourceid': 'vm-2'},
+            {'id': 'event-2', 'type': 'VOLUME.CREATE',
+             'resourceid': 'vol-2'},
+        ]
+        # 実行
+        changes = self.inventory.sync()
+        # 検証
+        eq_(sorted((c.kind, c.entity_type, c.id) for c in changes), [
+            (ADDED, 'volume', 'vol-2'),
+            (CHANGED, 'virtualmachine', 'vm-1'),
+            (REMOVED, 'virtualmachine', 'vm-2'),
+        ])
+        changed = [c for c in changes if c.kind == CHANGED][0]
+        eq_(changed.before['state'], 'Running')
+        eq_(changed.after['state'], 'Stopped')
+        # 一覧の取得は変更されたものだけ
+        ok_(('listVirtualMachines', None) not in self.cloud.calls)
+        eq_(len(self.inventory.snapshot.ids('virtualmachine')), 4)
+
+    def test_event_without_resource_id(self):
+        self._prepare()
+        self.inventory.sync()
+        self.cloud.calls = []
+        # モックアウト
+        self.cloud.set('listNetworks', 'net-1', None)
+        self.cloud.entities['listEvents'] = [
+            {'id': 'event-1', 'type': 'NETWORK.DELETE'},
+        ]
+        # 実行
+        changes = self.inventory.sync()
+        # 検証
+        eq_([(c.kind, c.id) for c in changes], [(REMOVED, 'net-1')])
+        ok_(('listNetworks', None) in self.cloud.calls)
+
+    def test_full(self):
+        self._prepare()
+        self.inventory.sync()
+        # モックアウト
+        self.cloud.set('listVolumes', 'vol-1', {'id': 'vol-1', 'size': 30})
+        # 実行
+        # イベントがなくても全件を比べる
+        changes = self.inventory.sync(full=True)
+        # 検証
+        eq_([(c.kind, c.id) for c in changes], [(CHANGED, 'vol-1')])
+
+    @raises(RetryLimitExceededException)
+    def test_error_keeps_last_sync(self):
+        self._prepare()
+        self.inventory.sync()
+        last_sync = self.inventory.snapshot.last_sync
+        self.cloud.entities['listAsyncJobs'] = [
+            {'jobid': 'job-1', 'jobinstancetype': 'Volume',
+             'jobinstanceid': 'vol-1'},
+        ]
+
+        # モックアウト
+        def request(method, params, headers, data):
+            if params.get('id') == 'vol-1':
+                raise RetryLimitExceededException('Retry limit exceeded')
+            return self.cloud.request(method, params, headers, data)
+        self.client.request = mock.Mock(side_effect=request)
+        # 実行
+        try:
+            self.inventory.sync()
+        finally:
+            # 検証
+            eq_(self.inventory.snapshot.last_sync, last_sync)
+
+    def test_list_error(self):
+        self._prepare()
+        self.inventory.sync()
+        ids = self.inventory.snapshot.ids('virtualmachine')
+        last_sync = self.inventory.snapshot.last_sync
+        # モックアウト
+        self.cloud.errors[('listVirtualMachines', None)] = 530
+        # 実行
+        try:
+            self.inventory.sync(full=True)
+        except ApiErrorException as e:
+            eq_(e.status_code, 530)
+        else:
+            raise AssertionError('ApiErrorException not raised')
+        # 検証
+        # エラーのレスポンスを空の一覧として全て削除しない
+        eq_(self.inventory.snapshot.ids('virtualmachine'), ids)
+        eq_(self.inventory.snapshot.last_sync, last_sync)
+
+    def test_refetch_error(self):
+        self._prepare()
+        self.inventory.sync()
+        last_sync = self.inventory.snapshot.last_sync
+        # モックアウト
+        self.cloud.entities['listAsyncJobs'] = [
+            {'jobid': 'job-1', 'jobinstancetype': 'VirtualMachine',
+             'jobinstanceid': 'vm-1'},
+        ]
+        self.cloud.errors[('listVirtualMachines', 'vm-1')] = 530
+        # 実行
+        try:
+            self.inventory.sync()
+        except ApiErrorException:
+            pass
+        else:
+            raise AssertionError('ApiErrorException not raised')
+        # 検証
+        ok_('vm-1' in self.inventory.snapshot.ids('virtualmachine'))
+        eq_(self.inventory.snapshot.last_sync, last_sync)
+
+    def test_refetch_not_found(self):
+        self._prepare()
+        self.inventory.sync()
+        self.cloud.calls = []
+        # モックアウト
+        self.cloud.set('listVirtualMachines', 'vm-1', None)
+        self.cloud.entities['listEvents'] = [
+            {'id': 'event-1', 'type': 'VM.EXPUNGE',
+             'resourcetype': 'VirtualMachine', 'resourceid': 'vm-1'},
+        ]
+        self.cloud.errors[('listVirtualMachines', 'vm-1')] = 431
+        # 実行
+        changes = self.inventory.sync()
+        # 検証
+        # 見つからなければ一覧全体と比べて削除されたことを確かめる
+        eq_([(c.kind, c.id) for c in changes], [(REMOVED, 'vm-1')])
+        ok_(('listVirtualMachines', None) in self.cloud.calls)
+
+
+class Test_InventorySnapshot(object):
+
+    def test_persistent(self):
+        snapshot_file = tempfile.NamedTemporaryFile(suffix='.sqlite')
+        cloud = _Cloud()
+        client = IntegrationClient('http://localhost:8080/client/api',
+                                   async_block=False)
+        client.request = mock.Mock(side_effect=cloud.request)
+        InventorySync(client, InventorySnapshot(snapshot_file.name)).sync()
+        # 実行
+        snapshot = InventorySnapshot(snapshot_file.name)
+        # 検証
+        eq_(snapshot.items('volume'), [{'id': 'vol-1', 'size': 10}])
+        ok_(snapshot.last_sync is not None)
+        snapshot.close()
+        snapshot_file.close()
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import (
+    ApiResponse,
+    IntegrationClient,
+    RetryLimitExceededException,
+)
+from cmonkey.jobs import JobWaiter
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _response(content_body):
+    response = mock.Mock()
+    response.status_code = 200
+    response.headers = {}
+    response.json = lambda: content_body
+    return response
+
+
+def _job_response(job_id, job_status, job_result=None):
+    return _response({
+        'queryasyncjobresultresponse': {
+            'jobid': job_id,
+            'jobstatus': job_status,
+            'jobresult': job_result,
+        }
+    })
+
+
+def _job_request(statuses):
+    # JOB 毎に順番に状態を返す
+    def request(method, params, headers, data):
+        job_id = params['jobid']
+        job_status, job_result = statuses[job_id].pop(0)
+        return _job_response(job_id, job_status, job_result)
+    return mock.Mock(side_effect=request)
+
+
+class Test_JobWaiter(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def test_as_completed(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = _job_request({
+            'a': [(0, None), (2, {'errortext': 'failed'})],
+            'b': [(1, {'id': 'vm-b'})],
+        })
+        # 実行
+        jobs = [
+            ApiResponse(200, {}, {'deployvirtualmachineresponse': {
+                'jobid': 'a',
+            }}),
+            'b',
+        ]
+        waiter = JobWaiter(client, jobs, interval=0)
+        results = list(waiter.as_completed())
+        # 検証
+        eq_([r.job_id for r in results], ['b', 'a'])
+        ok_(results[0].succeeded)
+        eq_(results[0].job_result, {'id': 'vm-b'})
+        ok_(not results[1].succeeded)
+        eq_(client.request.call_count, 3)
+
+    def test_wait_keeps_order(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = _job_request({
+            'a': [(0, None), (1, None)],
+            'b': [(1, None)],
+        })
+        # 実行
+        results = JobWaiter(client, ['a', 'b'], interval=0).wait()
+        # 検証
+        eq_([r.job_id for r in results], ['a', 'b'])
+
+    def test_poll_concurrently(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        job_ids = ['job-%d' % i for i in range(8)]
+        lock = threading.Lock()
+        active = [0, 0]
+
+        # モックアウト
+        def request(method, params, headers, data):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return _job_response(params['jobid'], 1)
+        client.request = mock.Mock(side_effect=request)
+        # 実行
+        results = JobWaiter(client, job_ids, interval=0, workers=4).wait()
+        # 検証
+        eq_([r.job_id for r in results], job_ids)
+        # 同時に問い合わせるのは workers 個まで
+        eq_(active[1], 4)
+
+    def test_poll_sequentially(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            _job_response('a', 0),
+            _job_response('b', 1),
+            _job_response('a', 1),
+        ])
+        # 実行
+        results = JobWaiter(client, ['a', 'b'], interval=0, workers=1).wait()
+        # 検証
+        eq_([r.job_id for r in results], ['a', 'b'])
+        eq_(client.request.call_count, 3)
+
+    def test_bulk(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            _response({
+                'listasyncjobsresponse': {
+                    'count': 1,
+                    'asyncjobs': [
+                        {'jobid': 'a', 'jobstatus': 1, 'jobresult': {}},
+                    ],
+                }
+            }),
+            # 一覧に含まれない JOB は個別に問い合わせる
+            _job_response('b', 1),
+        ])
+        # 実行
+        results = JobWaiter(client, ['a', 'b'], interval=0, bulk=True).wait()
+        # 検証
+        eq_([r.job_id for r in results], ['a', 'b'])
+        calls = [
+            mock.call('GET', {
+                'command': 'listAsyncJobs',
+                'listall': 'true',
+                'response': 'json',
+            }, None, None),
+            mock.call('GET', {
+                'command': 'queryAsyncJobResult',
+                'jobid': 'b',
+                'response': 'json',
+            }, None, None),
+        ]
+        client.request.assert_has_calls(calls)
+
+    def test_ignore_synchronous(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        waiter = JobWaiter(client, [
+            ApiResponse(200, {}, {'listusersresponse': {'count': 0}}),
+        ])
+        eq_(waiter.pending(), [])
+
+    @raises(RetryLimitExceededException)
+    def test_retry_limit(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = _job_request({
+            'a': [(0, None), (0, None)],
+        })
+        # 実行
+        list(JobWaiter(client, ['a'], interval=0).as_completed(retry=2))
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
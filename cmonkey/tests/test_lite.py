@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import threading
+
+from six.moves import BaseHTTPServer
+import nose
+from nose.tools.trivial import eq_, ok_
+
+from cmonkey import CookieClient, IntegrationClient, SignatureClient
+from cmonkey.fakeserver import FakeCloudStack
+from cmonkey.lite import LiteHeaders, LiteSession, supported_environment
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+class _OneShotHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"listzonesresponse": {}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # keep-alive のまま応答してから接続を閉じる
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_LiteHeaders(object):
+
+    def test_case_insensitive(self):
+        headers = LiteHeaders({'Content-Length': '10'})
+        eq_(headers.get('content-length'), '10')
+        eq_(headers['CONTENT-LENGTH'], '10')
+        ok_('content-length' in headers)
+        eq_(headers.get('Retry-After'), None)
+        # 元の名前のまま出力される
+        eq_(dict(headers), {'Content-Length': '10'})
+
+
+class Test_LiteSession(object):
+
+    def test_clients(self):
+        with FakeCloudStack(apikey='foo', secretkey='bar') as server:
+            clients = [
+                SignatureClient(server.entry_point, 'foo', 'bar',
+                                lightweight=True),
+                CookieClient(server.entry_point, 'admin', 'password',
+                             lightweight=True),
+                IntegrationClient(server.entry_point, lightweight=True),
+            ]
+            for client in clients:
+                ok_(isinstance(client.session, LiteSession))
+                api_response = client.listZones(page=1, pagesize=2)
+                eq_(api_response.status_code, 200)
+                inner = api_response.content_body['listzonesresponse']
+                eq_(len(inner['zone']), 2)
+            # 同じ接続で JSESSIONID を送っている
+            eq_(server.stats()['logins'], 1)
+
+    def test_session_expired(self):
+        with FakeCloudStack() as server:
+            client = CookieClient(server.entry_point, 'admin', 'password',
+                                  lightweight=True)
+            client.listZones()
+            server.expire_sessions()
+            eq_(client.listZones().status_code, 200)
+            eq_(server.stats()['logins'], 2)
+
+    def test_stream(self):
+        with FakeCloudStack(items=5) as server:
+            client = IntegrationClient(server.entry_point, lightweight=True)
+            items = client.iter_list('listVirtualMachines', pagesize=2,
+                                     stream=True)
+            eq_(len(list(items)), 5)
+
+    def test_reconnect_stale_connection(self):
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _OneShotHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            entry_point = 'http://127.0.0.1:%d/client/api' % \
+                server.server_address[1]
+            client = IntegrationClient(entry_point, lightweight=True)
+            # 実行
+            responses = [client.listZones() for _ in range(3)]
+            # 閉じられたことに気づく前に送った場合もつなぎ直す
+            with mock.patch('cmonkey.lite._dropped', return_value=False):
+                responses += [client.listZones() for _ in range(3)]
+            # 検証
+            eq_([r.status_code for r in responses], [200] * 6)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_supported_environment(self):
+        netrc = os.path.join(tempfile.gettempdir(), 'cmonkey-no-netrc')
+        eq_(supported_environment({'NETRC': netrc}), True)
+        eq_(supported_environment({'NETRC': netrc,
+                                   'https_proxy': 'http://proxy:3128'}),
+            False)
+        eq_(supported_environment({'NETRC': netrc,
+                                   'REQUESTS_CA_BUNDLE': '/etc/ca.pem'}),
+            False)
+        eq_(supported_environment({'NETRC': __file__}), False)
+
+    def test_requests_session_by_default(self):
+        client = IntegrationClient('http://localhost:8080/client/api')
+        ok_(not isinstance(client.session, LiteSession))
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import (
+    ApiResponse,
+    PollingPolicy,
+    RetryLimitExceededException,
+    SignatureClient,
+)
+from cmonkey.fakeserver import FakeCloudStack
+from cmonkey.loadgen import (
+    CommandMix,
+    LoadGenerator,
+    format_report,
+    percentile,
+)
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+class Test_CommandMix(object):
+
+    def test_choose(self):
+        mix = CommandMix([
+            (3, 'listVirtualMachines', {'page': '1'}),
+            (1, 'listZones', {}),
+            (0, 'deployVirtualMachine', {}),
+        ], seed=1)
+        # 実行
+        chosen = [mix.choose() for _ in range(4000)]
+        # 検証
+        commands = [command for command, _params in chosen]
+        ratio = commands.count('listVirtualMachines') / float(len(chosen))
+        ok_(0.7 < ratio < 0.8)
+        ok_('deployVirtualMachine' not in commands)
+        ok_(('listVirtualMachines', {'page': '1'}) in chosen)
+
+    @raises(ValueError)
+    def test_empty(self):
+        CommandMix([(0, 'listZones', {})])
+
+
+class Test_LoadGenerator(object):
+
+    def test_closed_loop(self):
+        client = mock.Mock()
+        # モックアウト
+        client.invoke = mock.Mock(side_effect=[
+            RetryLimitExceededException('Retry limit exceeded'),
+            ApiResponse(431, {}, {}),
+        ] + [ApiResponse(200, {}, {})] * 18)
+        mix = CommandMix([(1, 'listZones', {})])
+        generator = LoadGenerator(client, mix, concurrency=4, duration=None,
+                                  requests=20)
+        # 実行
+        report = generator.run()
+        # 検証
+        eq_(client.invoke.call_count, 20)
+        eq_(report['mode'], 'closed')
+        eq_(report['requests'], 20)
+        eq_(report['errors'], 2)
+        eq_(report['commands']['listZones']['errors_by_type'], {
+            'RetryLimitExceededException': 1,
+            'HTTP 431': 1,
+        })
+        ok_(report['throughput'] > 0)
+
+    def test_open_loop(self):
+        client = mock.Mock()
+        client.invoke = mock.Mock(return_value=ApiResponse(200, {}, {}))
+        mix = CommandMix([(1, 'listZones', {})])
+        generator = LoadGenerator(client, mix, rate=50, concurrency=2,
+                                  duration=None, requests=10)
+        # 実行
+        started = time.time()
+        report = generator.run()
+        elapsed = time.time() - started
+        # 検証
+        eq_(report['mode'], 'open')
+        eq_(report['requests'], 10)
+        # 9 回分の間隔 (0.02 秒) は待つ
+        ok_(elapsed >= 0.18)
+
+    def test_duration(self):
+        client = mock.Mock()
+        client.invoke = mock.Mock(return_value=ApiResponse(200, {}, {}))
+        mix = CommandMix([(1, 'listZones', {})])
+        generator = LoadGenerator(client, mix, rate=20, duration=0.2)
+        # 実行
+        report = generator.run()
+        # 検証
+        ok_(3 <= report['requests'] <= 5)
+
+    def test_jobs(self):
+        with FakeCloudStack(job_duration=0.05) as server:
+            client = SignatureClient(
+                server.entry_point, 'apikey', 'secretkey',
+                polling_policy=PollingPolicy.fixed(0.01),
+            )
+            mix = CommandMix([
+                (1, 'listZones', {}),
+                (1, 'deployVirtualMachine', {'zoneid': 'zone-0'}),
+            ], seed=0)
+            generator = LoadGenerator(client, mix, concurrency=4,
+                                      duration=None, requests=20)
+            # 実行
+            report = generator.run()
+        # 検証
+        deployed = report['commands']['deployVirtualMachine']
+        eq_(deployed['jobs']['count'], deployed['requests'])
+        eq_(deployed['jobs']['failed'], 0)
+        ok_(deployed['jobs']['p50'] >= 0.05)
+        ok_('jobs' not in report['commands']['listZones'])
+        eq_(report['errors'], 0)
+        ok_('deployVirtualMachine' in format_report(report))
+
+
+class Test_Percentile(object):
+
+    def test_percentile(self):
+        values = list(range(101))
+        # 検証
+        eq_(percentile(values, 50), 50)
+        eq_(percentile(values, 99), 99)
+        eq_(percentile([], 99), 0.0)
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
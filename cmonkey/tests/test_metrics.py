@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import json
+import socket
+
+import nose
+from nose.tools.trivial import eq_, ok_
+
+from cmonkey import (
+    CookieClient,
+    IntegrationClient,
+    Observer,
+    PollingPolicy,
+)
+from cmonkey.jobs import JobWaiter
+from cmonkey.metrics import Histogram, MetricsCollector, StatsdExporter
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _response(content_body, status_code=200):
+    content = json.dumps(content_body).encode('utf-8')
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = {'Content-Length': str(len(content))}
+    response.content = content
+    response.json = lambda: content_body
+    return response
+
+
+class _Recorder(Observer):
+
+    def __init__(self):
+        self.events = []
+
+    def before_request(self, command, params):
+        self.events.append(('before_request', command))
+
+    def after_response(self, command, status_code, timings, size):
+        self.events.append(('after_response', command, status_code,
+                            sorted(timings), size))
+
+    def login(self, username, elapsed):
+        self.events.append(('login', username))
+
+    def job_poll(self, command, job_id, job_status, elapsed):
+        self.events.append(('job_poll', command, job_id, job_status))
+
+    def job_done(self, command, job_id, job_status, elapsed, polls):
+        self.events.append(('job_done', command, job_id, job_status, polls))
+
+
+class Test_Observer(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def test_events(self):
+        recorder = _Recorder()
+        client = IntegrationClient(
+            self.ENDPOINT,
+            polling_policy=PollingPolicy.fixed(0),
+            observers=[recorder],
+        )
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            _response({'deployvirtualmachineresponse': {'jobid': 'a'}}),
+            _response({'queryasyncjobresultresponse': {
+                'jobid': 'a', 'jobstatus': 0,
+            }}),
+            _response({'queryasyncjobresultresponse': {
+                'jobid': 'a', 'jobstatus': 1,
+            }}),
+        ])
+        # 実行
+        client.deployVirtualMachine(zoneid='z')
+        # 検証
+        timings = ['decode', 'http', 'job', 'produce', 'total']
+        eq_(recorder.events, [
+            ('before_request', 'deployVirtualMachine'),
+            ('job_poll', 'deployVirtualMachine', 'a', 0),
+            ('job_poll', 'deployVirtualMachine', 'a', 1),
+            ('job_done', 'deployVirtualMachine', 'a', 1, 2),
+            ('after_response', 'deployVirtualMachine', 200, timings, 48),
+        ])
+
+    def test_login(self):
+        recorder = _Recorder()
+        client = CookieClient(self.ENDPOINT, 'admin', 'password',
+                              async_block=False)
+        client.add_observer(recorder)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            _response({'loginresponse': {'sessionkey': 'foo'}}),
+            _response({}),
+        ])
+        # 実行
+        client.listZones()
+        # 検証
+        eq_([event[0] for event in recorder.events],
+            ['before_request', 'login', 'after_response'])
+
+    def test_job_waiter(self):
+        recorder = _Recorder()
+        client = IntegrationClient(self.ENDPOINT, observers=[recorder])
+        # モックアウト
+        client.request = mock.Mock(return_value=_response({
+            'queryasyncjobresultresponse': {
+                'jobid': 'a', 'jobstatus': 1, 'cmd': 'startVirtualMachine',
+            }
+        }))
+        # 実行
+        JobWaiter(client, ['a'], interval=0).wait()
+        # 検証
+        eq_(recorder.events[-1],
+            ('job_done', 'startVirtualMachine', 'a', 1, 1))
+
+
+class Test_Histogram(object):
+
+    def test_quantile(self):
+        histogram = Histogram(buckets=(1, 2, 3, 4))
+        for value in [0.5, 1.5, 2.5, 3.5]:
+            histogram.observe(value)
+        eq_(histogram.count, 4)
+        eq_(histogram.mean(), 2.0)
+        eq_(histogram.quantile(0.5), 2.0)
+        eq_(histogram.quantile(1.0), 3.5)
+
+    def test_overflow(self):
+        histogram = Histogram(buckets=(1, ))
+        histogram.observe(5)
+        eq_(histogram.quantile(1.0), 5)
+
+    def test_empty(self):
+        eq_(Histogram().quantile(0.5), 0.0)
+
+
+class Test_MetricsCollector(object):
+
+    def _collector(self):
+        collector = MetricsCollector(buckets=(0.1, 1.0))
+        collector.after_response('listZones', 200, {
+            'http': 0.05,
+            'total': 0.5,
+        }, 100)
+        collector.login('admin', 0.2)
+        return collector
+
+    def test_summary(self):
+        rows = self._collector().summary()
+        eq_([(r['metric'], r['phase'], r['count']) for r in rows], [
+            ('login_seconds', None, 1),
+            ('request_seconds', 'http', 1),
+            ('request_seconds', 'total', 1),
+        ])
+        ok_('listZones' in self._collector().format_summary())
+
+    def test_prometheus_text(self):
+        text = self._collector().prometheus_text()
+        lines = text.splitlines()
+        ok_('# TYPE cmonkey_request_seconds histogram' in lines)
+        ok_('cmonkey_request_seconds_bucket{command="listZones",'
+            'phase="http",le="0.1"} 1' in lines)
+        ok_('cmonkey_request_seconds_bucket{command="listZones",'
+            'phase="total",le="0.1"} 0' in lines)
+        ok_('cmonkey_request_seconds_count{command="listZones",'
+            'phase="total"} 1' in lines)
+        ok_('cmonkey_requests_total{command="listZones",status="200"} 1'
+            in lines)
+        ok_('cmonkey_response_bytes_total{command="listZones"} 100'
+            in lines)
+        ok_('cmonkey_logins_total 1' in lines)
+
+
+class Test_StatsdExporter(object):
+
+    def test_send(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            exporter = StatsdExporter(port=server.getsockname()[1])
+            exporter.after_response('listZones', 200, {'total': 0.25}, 10)
+            exporter.close()
+            lines = server.recv(4096).decode('utf-8').splitlines()
+        finally:
+            server.close()
+        eq_(lines, [
+            'cmonkey.request.listZones.total:250.000|ms',
+            'cmonkey.requests.listZones.200:1|c',
+            'cmonkey.response_bytes.listZones:10|c',
+        ])
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
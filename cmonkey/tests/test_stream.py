@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import IntegrationClient
+from cmonkey.stream import ListStreamParser, StreamParseError, StreamedList
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _body(count, items):
+    content_body = {
+        'listeventsresponse': {
+            'count': count,
+            'event': items,
+        }
+    }
+    return json.dumps(content_body, indent=1).encode('utf-8')
+
+
+def _items(start, stop):
+    return [
+        {
+            'id': i,
+            'description': u'イベント %d' % i,
+            'tags': [{'key': 'k', 'value': 'v'}],
+        }
+        for i in range(start, stop)
+    ]
+
+
+class Test_ListStreamParser(object):
+
+    def test_items(self):
+        items = _items(0, 50)
+        data = _body(50, items)
+        # 1 バイトずつ渡しても同じ結果になる
+        for size in [1, 7, 4096]:
+            parser = ListStreamParser(_chunks(data, size))
+            eq_(list(parser), items)
+            eq_(parser.fields, {'count': 50})
+            eq_(parser.response_name, 'listeventsresponse')
+            eq_(parser.entity, 'event')
+
+    def test_count_after_items(self):
+        data = b'{"listeventsresponse":{"event":[{"id":1},{"id":2}],' \
+               b'"count":12345}}'
+        parser = ListStreamParser(_chunks(data, 3))
+        eq_(list(parser), [{'id': 1}, {'id': 2}])
+        # 数値が分割されていても正しく読める
+        eq_(parser.fields['count'], 12345)
+
+    def test_empty(self):
+        parser = ListStreamParser([b'{"listeventsresponse": {}}'])
+        eq_(list(parser), [])
+        eq_(parser.fields, {})
+
+    def test_error_response(self):
+        data = b'{"errorresponse": {"errorcode": 431, "errortext": "x"}}'
+        parser = ListStreamParser(_chunks(data, 5))
+        eq_(list(parser), [])
+        eq_(parser.fields['errorcode'], 431)
+
+    def test_buffer_compacted(self):
+        items = _items(0, 3000)
+        parser = ListStreamParser(_chunks(_body(3000, items), 1024))
+        for i, item in enumerate(parser):
+            eq_(item['id'], i)
+            # 処理済みの部分は溜め込まない
+            ok_(len(parser._buffer) < 128 * 1024)
+
+    @raises(StreamParseError)
+    def test_truncated(self):
+        list(ListStreamParser([b'{"listeventsresponse": {"event": [{}']))
+
+
+class Test_StreamedList(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def _response(self, data):
+        response = mock.Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.encoding = 'UTF-8'
+        response.iter_content = lambda size: iter(_chunks(data, size))
+        return response
+
+    def test_invoke_stream(self):
+        client = IntegrationClient(self.ENDPOINT)
+        # モックアウト
+        response = self._response(_body(3, _items(0, 3)))
+        client.request = mock.Mock(return_value=response)
+        # 実行
+        api_response = client.invoke('listEvents', {}, stream=True)
+        items = list(api_response.content_body)
+        # 検証
+        eq_([item['id'] for item in items], [0, 1, 2])
+        eq_(api_response.content_body.count, 3)
+        response.close.assert_called_with()
+        params = {
+            'command': 'listEvents',
+            'response': 'json',
+        }
+        client.request.assert_called_with('GET', params, None, None,
+                                          stream=True)
+
+    def test_iter_list_stream(self):
+        client = IntegrationClient(self.ENDPOINT, async_block=False)
+        # モックアウト
+        client.request = mock.Mock(side_effect=[
+            self._response(_body(5, _items(0, 2))),
+            self._response(_body(5, _items(2, 4))),
+            self._response(_body(5, _items(4, 5))),
+        ])
+        # 実行
+        items = client.iter_list('listEvents', pagesize=2, stream=True)
+        # 検証
+        eq_([item['id'] for item in items], [0, 1, 2, 3, 4])
+        eq_(client.request.call_count, 3)
+
+    def test_close_early(self):
+        response = self._response(_body(3, _items(0, 3)))
+        items = iter(StreamedList(response))
+        next(items)
+        items.close()
+        response.close.assert_called_with()
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import nose
+from nose.tools.trivial import eq_, ok_
+
+from cmonkey import IntegrationClient
+from cmonkey.throttle import Throttle, TokenBucket
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _response(status_code=200, headers=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json = lambda: {}
+    return response
+
+
+class Test_TokenBucket(object):
+
+    def test_burst(self):
+        bucket = TokenBucket(10, burst=3)
+        waits = [bucket.reserve() for _i in range(5)]
+        # バーストの分は待たずに使える
+        eq_(waits[:3], [0.0, 0.0, 0.0])
+        ok_(0.05 < waits[3] <= 0.1)
+        ok_(0.15 < waits[4] <= 0.2)
+
+    def test_rate(self):
+        bucket = TokenBucket(50, burst=1)
+        started = time.time()
+        for _i in range(6):
+            bucket.take()
+        ok_(time.time() - started >= 0.09)
+
+
+class Test_Throttle(object):
+
+    ENDPOINT = 'http://localhost:8080/client/api'
+
+    def test_max_in_flight(self):
+        throttle = Throttle(max_in_flight=2)
+        client = IntegrationClient(self.ENDPOINT, throttle=throttle)
+        lock = threading.Lock()
+        active = [0, 0]
+
+        # モックアウト
+        def request(*args, **kwargs):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return _response()
+        client.session.request = mock.Mock(side_effect=request)
+        # 実行
+        client.map('listZones', [{}] * 8, workers=8)
+        # 検証
+        eq_(client.session.request.call_count, 8)
+        eq_(active[1], 2)
+
+    def test_retry_throttled(self):
+        throttle = Throttle(max_retries=3, backoff=0.01)
+        client = IntegrationClient(self.ENDPOINT, throttle=throttle)
+        # モックアウト
+        client.session.request = mock.Mock(side_effect=[
+            _response(429, {'Retry-After': '0.05'}),
+            _response(530),
+            _response(200),
+        ])
+        # 実行
+        started = time.time()
+        api_response = client.listZones()
+        # 検証
+        eq_(api_response.status_code, 200)
+        eq_(client.session.request.call_count, 3)
+        eq_(throttle.throttled_count, 2)
+        ok_(time.time() - started >= 0.05)
+
+    def test_no_retry_mutation_on_530(self):
+        throttle = Throttle(max_retries=3, backoff=0.01)
+        client = IntegrationClient(self.ENDPOINT, async_block=False,
+                                   throttle=throttle)
+        # モックアウト
+        client.session.request = mock.Mock(side_effect=[
+            _response(530),
+            _response(200),
+        ])
+        # 実行
+        api_response = client.deployVirtualMachine(zoneid='zone1')
+        # 検証
+        # 処理されたかもしれないので送り直さない
+        eq_(api_response.status_code, 530)
+        eq_(client.session.request.call_count, 1)
+        eq_(throttle.throttled_count, 0)
+
+    def test_retry_mutation_on_429(self):
+        throttle = Throttle(max_retries=3, backoff=0.01)
+        client = IntegrationClient(self.ENDPOINT, async_block=False,
+                                   throttle=throttle)
+        # モックアウト
+        client.session.request = mock.Mock(side_effect=[
+            _response(429),
+            _response(200),
+        ])
+        # 実行
+        api_response = client.deployVirtualMachine(zoneid='zone1')
+        # 検証
+        eq_(api_response.status_code, 200)
+        eq_(client.session.request.call_count, 2)
+
+    def test_retry_limit(self):
+        throttle = Throttle(max_retries=1, backoff=0.01)
+        client = IntegrationClient(self.ENDPOINT, throttle=throttle)
+        # モックアウト
+        client.session.request = mock.Mock(return_value=_response(429))
+        # 実行
+        api_response = client.listZones()
+        # 検証
+        # 諦めたら制限されたレスポンスをそのまま返す
+        eq_(api_response.status_code, 429)
+        eq_(client.session.request.call_count, 2)
+
+    def test_shared(self):
+        entry_point = 'http://shared.example.com/client/api'
+        throttle = Throttle.shared(entry_point, rate=5)
+        eq_(Throttle.shared(entry_point, rate=100), throttle)
+        ok_(Throttle.shared(self.ENDPOINT + '/other') is not throttle)
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
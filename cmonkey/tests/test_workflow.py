@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import tempfile
+import time
+
+import nose
+from nose.tools.trivial import eq_, ok_
+from nose.tools.nontrivial import raises
+
+from cmonkey import (
+    ApiResponse,
+    DeadlineExceededException,
+    JobResult,
+    PollingPolicy,
+    SignatureClient,
+)
+from cmonkey.fakeserver import FakeCloudStack
+from cmonkey.workflow import (
+    FAILED,
+    SKIPPED,
+    SUCCEEDED,
+    StepFailedException,
+    Workflow,
+    WorkflowException,
+    WorkflowRunner,
+    load_workflow,
+    references,
+    resolve,
+)
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+def _job(inner_body):
+    return JobResult.from_content_body(dict(inner_body, jobid='job-1'))
+
+
+class _Client(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def invoke(self, command, params):
+        self.calls.append((command, params))
+        if command == 'createNetwork':
+            return ApiResponse(200, {}, {
+                'createnetworkresponse': {'network': {'id': 'net-1'}},
+            })
+        entity = {
+            'deployVirtualMachine': 'virtualmachine',
+            'associateIpAddress': 'ipaddress',
+            'createPortForwardingRule': 'portforwardingrule',
+        }[command]
+        job = _job({
+            'jobstatus': 1,
+            'jobresult': {entity: {'id': '%s-1' % entity}},
+        })
+        return ApiResponse(200, {}, {}, job)
+
+
+def _provisioning():
+    workflow = Workflow(retry_interval=0)
+    workflow.step('network', 'createNetwork', {'name': 'web'})
+    workflow.step('vm', 'deployVirtualMachine', {
+        'networkids': '${network.network.id}',
+    })
+    workflow.step('ip', 'associateIpAddress', {
+        'networkid': '${network.network.id}',
+    })
+    workflow.step('pf', 'createPortForwardingRule', {
+        'ipaddressid': '${ip.ipaddress.id}',
+        'virtualmachineid': '${vm.virtualmachine.id}',
+        'publicport': 22,
+    })
+    return workflow
+
+
+class Test_Reference(object):
+
+    def test_references(self):
+        # 実行
+        names = references({
+            'a': '${vm.virtualmachine.id}',
+            'b': ['${ip.id}', 'x'],
+            'c': 'prefix-${net.id}',
+            'd': 1,
+        })
+        # 検証
+        eq_(names, set(['vm', 'ip', 'net']))
+
+    def test_resolve(self):
+        outputs = {
+            'vm': {'virtualmachine': {'id': 'vm-1', 'nic': [{'id': 'n'}]}},
+        }
+        # 実行
+        value = resolve({
+            'a': '${vm.virtualmachine.id}',
+            'b': 'nic-${vm.virtualmachine.nic.0.id}',
+            'c': '${vm.virtualmachine.nic}',
+        }, outputs)
+        # 検証
+        eq_(value, {'a': 'vm-1', 'b': 'nic-n', 'c': [{'id': 'n'}]})
+
+    @raises(WorkflowException)
+    def test_resolve_unknown_path(self):
+        resolve('${vm.virtualmachine.id}', {'vm': {}})
+
+
+class Test_Workflow(object):
+
+    def test_order(self):
+        # 実行
+        steps = _provisioning().order()
+        # 検証
+        eq_([step.name for step in steps], ['network', 'vm', 'ip', 'pf'])
+        eq_(steps[3].depends, ['ip', 'vm'])
+
+    @raises(WorkflowException)
+    def test_unknown_step(self):
+        workflow = Workflow()
+        workflow.step('vm', 'deployVirtualMachine',
+                      {'networkids': '${network.id}'})
+        workflow.order()
+
+    @raises(WorkflowException)
+    def test_circular(self):
+        workflow = Workflow()
+        workflow.step('a', 'createNetwork', depends=['b'])
+        workflow.step('b', 'createNetwork', depends=['a'])
+        workflow.order()
+
+    def test_load_json(self):
+        definition = {
+            'retries': 2,
+            'steps': [
+                {'name': 'network', 'command': 'createNetwork'},
+                {'name': 'vm', 'command': 'deployVirtualMachine',
+                 'params': {'networkids': '${network.network.id}'},
+                 'retries': 0},
+            ],
+        }
+        workflow_file = tempfile.NamedTemporaryFile(mode='w',
+                                                    suffix='.json')
+        workflow_file.write(json.dumps(definition))
+        workflow_file.flush()
+        # 実行
+        workflow = load_workflow(workflow_file.name)
+        workflow_file.close()
+        # 検証
+        eq_(list(workflow.steps), ['network', 'vm'])
+        eq_(workflow.steps['network'].retries, 2)
+        eq_(workflow.steps['vm'].retries, 0)
+        eq_(workflow.steps['vm'].depends, ['network'])
+
+    def test_load_yaml(self):
+        try:
+            import yaml  # NOQA
+        except ImportError:
+            raise nose.SkipTest('PyYAML is not installed')
+        lines = [
+            'workers: 4',
+            'steps:',
+            '  network:',
+            '    command: createNetwork',
+            '  vm:',
+            '    command: deployVirtualMachine',
+            '    params:',
+            '      networkids: ${network.network.id}',
+        ]
+        workflow_file = tempfile.NamedTemporaryFile(mode='w',
+                                                    suffix='.yaml')
+        workflow_file.write('\n'.join(lines))
+        workflow_file.flush()
+        # 実行
+        workflow = load_workflow(workflow_file.name)
+        workflow_file.close()
+        # 検証
+        eq_(workflow.workers, 4)
+        eq_(workflow.steps['vm'].depends, ['network'])
+
+
+class Test_WorkflowRunner(object):
+
+    def test_run(self):
+        client = _Client()
+        # 実行
+        results = WorkflowRunner(client).run(_provisioning())
+        # 検証
+        ok_(all(r.status == SUCCEEDED for r in results.values()))
+        eq_(results['pf'].output,
+            {'portforwardingrule': {'id': 'portforwardingrule-1'}})
+        eq_(dict(client.calls)['createPortForwardingRule'], {
+            'ipaddressid': 'ipaddress-1',
+            'virtualmachineid': 'virtualmachine-1',
+            'publicport': '22',
+        })
+        eq_(dict(client.calls)['deployVirtualMachine'],
+            {'networkids': 'net-1'})
+
+    def test_retry(self):
+        client = _Client()
+        # モックアウト
+        invoke = client.invoke
+        client.invoke = mock.Mock(side_effect=[
+            StepFailedException('temporary'),
+            ValueError('temporary'),
+            invoke('createNetwork', {}),
+        ])
+        workflow = Workflow(retries=2, retry_interval=0)
+        workflow.step('network', 'createNetwork')
+        # 実行
+        results = WorkflowRunner(client).run(workflow)
+        # 検証
+        eq_(results['network'].status, SUCCEEDED)
+        eq_(results['network'].attempts, 3)
+
+    def test_failed_and_skipped(self):
+        client = _Client()
+        # モックアウト
+        invoke = client.invoke
+
+        def fail_ip(command, params):
+            if command == 'associateIpAddress':
+                return ApiResponse(200, {}, {}, _job({
+                    'jobstatus': 2,
+                    'jobresult': {'errortext': 'no capacity'},
+                }))
+            return invoke(command, params)
+        client.invoke = fail_ip
+        # 実行
+        results = WorkflowRunner(client).run(_provisioning())
+        # 検証
+        eq_(results['vm'].status, SUCCEEDED)
+        eq_(results['ip'].status, FAILED)
+        eq_('%s' % results['ip'].error, 'associateIpAddress: no capacity')
+        eq_(results['pf'].status, SKIPPED)
+
+    def test_error_response(self):
+        client = mock.Mock()
+        client.invoke.return_value = ApiResponse(431, {}, {
+            'createnetworkresponse': {'errortext': 'invalid zone'},
+        })
+        workflow = Workflow(retries=1, retry_interval=0)
+        workflow.step('network', 'createNetwork')
+        # 実行
+        results = WorkflowRunner(client).run(workflow)
+        # 検証
+        eq_(results['network'].status, FAILED)
+        eq_(results['network'].attempts, 2)
+        eq_('%s' % results['network'].error, 'createNetwork: invalid zone')
+
+    def test_block_job(self):
+        client = mock.Mock()
+        client.invoke.return_value = ApiResponse(200, {}, {
+            'deployvirtualmachineresponse': {'jobid': 'job-1'},
+        })
+        client.block.return_value = _job({
+            'jobstatus': 1,
+            'jobresult': {'virtualmachine': {'id': 'vm-1'}},
+        })
+        workflow = Workflow()
+        workflow.step('vm', 'deployVirtualMachine')
+        # 実行
+        results = WorkflowRunner(client).run(workflow)
+        # 検証
+        eq_(results['vm'].output, {'virtualmachine': {'id': 'vm-1'}})
+
+    def test_resume_polling(self):
+        with FakeCloudStack(job_duration=0.3) as server:
+            # 待ち合わせは 0.1 秒で諦める
+            client = SignatureClient(
+                server.entry_point, 'apikey', 'secretkey',
+                polling_policy=PollingPolicy.fixed(0.02, timeout=0.1),
+            )
+            workflow = Workflow(retries=10, retry_interval=0)
+            workflow.step('vm', 'deployVirtualMachine', {'zoneid': 'zone1'})
+            # 実行
+            results = WorkflowRunner(client).run(workflow)
+            stats = server.stats()
+        # 検証
+        ok_(results['vm'].succeeded)
+        ok_(results['vm'].attempts > 1)
+        # 登録した JOB を待ち直すだけで仮想マシンを作り直さない
+        eq_(stats['commands']['deployVirtualMachine'], 1)
+
+    def test_resume_polling_error(self):
+        client = mock.Mock()
+        error = DeadlineExceededException('Deadline exceeded')
+        error.job_id = 'job-1'
+        client.invoke.side_effect = error
+        client.block.return_value = _job({
+            'jobstatus': 1,
+            'jobresult': {'virtualmachine': {'id': 'vm-1'}},
+        })
+        workflow = Workflow(retries=2, retry_interval=0)
+        workflow.step('vm', 'deployVirtualMachine')
+        # 実行
+        results = WorkflowRunner(client).run(workflow)
+        # 検証
+        eq_(results['vm'].output, {'virtualmachine': {'id': 'vm-1'}})
+        eq_(client.invoke.call_count, 1)
+        content_body = client.block.call_args[0][0]
+        eq_(content_body, {
+            'deployvirtualmachineresponse': {'jobid': 'job-1'},
+        })
+
+    def test_retry_failed_job(self):
+        client = mock.Mock()
+        client.invoke.return_value = ApiResponse(200, {}, {
+            'deployvirtualmachineresponse': {'jobid': 'job-1'},
+        })
+        client.block.side_effect = [
+            _job({'jobstatus': 2, 'jobresult': {'errortext': 'no host'}}),
+            _job({'jobstatus': 1, 'jobresult': {}}),
+        ]
+        workflow = Workflow(retries=1, retry_interval=0)
+        workflow.step('vm', 'deployVirtualMachine')
+        # 実行
+        results = WorkflowRunner(client).run(workflow)
+        # 検証
+        # 失敗して終わった JOB はコマンドから送り直す
+        eq_(results['vm'].status, SUCCEEDED)
+        eq_(client.invoke.call_count, 2)
+
+    def test_critical_path(self):
+        server = FakeCloudStack(job_duration=0.2)
+        with server:
+            client = SignatureClient(
+                server.entry_point, 'apikey', 'secretkey',
+                pool_maxsize=16,
+                polling_policy=PollingPolicy.fixed(0.02),
+            )
+            workflow = Workflow()
+            for i in range(8):
+                workflow.step('vm%d' % i, 'deployVirtualMachine')
+            workflow.step('done', 'createTags',
+                          depends=['vm%d' % i for i in range(8)])
+            # 実行
+            started = time.time()
+            results = WorkflowRunner(client).run(workflow)
+            elapsed = time.time() - started
+        # 検証
+        ok_(all(r.succeeded for r in results.values()))
+        # 直列なら 9 * 0.2 秒かかる
+        ok_(elapsed < 1.0)
+
+
+if __name__ == "__main__":
+    nose.main(argv=['nosetests', '-s', '-v'], defaultTest=__file__)
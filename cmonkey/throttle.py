@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.time()
+            elapsed = max(now - self._updated, 0.0)
+            self._tokens = min(self.capacity,
+                               self._tokens + elapsed * self.rate)
+            self._updated = now
+            # 足りなければ前借りして、貯まるまでの時間を返す
+            self._tokens -= 1.0
+            if self._tokens >= 0.0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def take(self):
+        wait = self.reserve()
+        if wait > 0.0:
+            time.sleep(wait)
+
+
+class Throttle(object):
+
+    # api.throttling などで制限されたときのステータスコード
+    THROTTLED_STATUS = frozenset([429])
+    # 530 は内部エラーでもあり途中まで処理されていることがあるので
+    # 参照系のコマンドだけ送り直す
+    READ_ONLY_THROTTLED_STATUS = frozenset([530])
+    READ_ONLY_PREFIXES = ('list', 'get', 'query')
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None,
+                 max_retries=3, backoff=1.0, max_backoff=30.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._slots = None
+        if max_in_flight:
+            self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.throttled_count = 0
+
+    @classmethod
+    def shared(cls, entry_point, **options):
+        # 同じエントリポイントを使うクライアントは制限を共有する
+        with cls._shared_lock:
+            throttle = cls._shared.get(entry_point)
+            if throttle is None:
+                throttle = cls(**options)
+                cls._shared[entry_point] = throttle
+            return throttle
+
+    def __enter__(self):
+        self._wait_paused()
+        if self._bucket is not None:
+            self._bucket.take()
+        if self._slots is not None:
+            self._slots.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._slots is not None:
+            self._slots.release()
+
+    def throttled(self, response, command=None):
+        if response.status_code in self.THROTTLED_STATUS:
+            return True
+        return response.status_code in self.READ_ONLY_THROTTLED_STATUS and \
+            bool(command) and command.startswith(self.READ_ONLY_PREFIXES)
+
+    def pause(self, attempt, response=None):
+        delay = self._retry_after(response)
+        if delay is None:
+            delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+            delay *= random.uniform(0.5, 1.0)
+        msg = 'Throttled by server, back off %.2f sec' % delay
+        LOG.debug(msg)
+        with self._lock:
+            self.throttled_count += 1
+            # 他のスレッドのリクエストもまとめて待たせる
+            self._paused_until = max(self._paused_until, time.time() + delay)
+
+    def _wait_paused(self):
+        while True:
+            with self._lock:
+                wait = self._paused_until - time.time()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _retry_after(self, response):
+        if response is None:
+            return None
+        try:
+            return min(float(response.headers['Retry-After']),
+                       self.max_backoff)
+        except (KeyError, TypeError, ValueError):
+            return None
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import logging
+import re
+import time
+
+import six
+
+from cmonkey import FAN_OUT_ERRORS, job_id_of
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 16
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# ${step.path.to.value}
+_REFERENCE = re.compile(r'\$\{([^}]+)\}')
+
+
+class WorkflowException(BaseException):
+
+    def __init__(self, msg):
+        super(WorkflowException, self).__init__(msg)
+
+
+class StepFailedException(BaseException):
+
+    def __init__(self, msg):
+        super(StepFailedException, self).__init__(msg)
+
+
+# リトライして、それでも失敗したらステップの失敗として記録するエラー
+STEP_ERRORS = FAN_OUT_ERRORS + (StepFailedException, )
+
+
+class Step(collections.namedtuple('Step',
+                                  ['name',
+                                   'command',
+                                   'params',
+                                   'depends',
+                                   'retries',
+                                   'retry_interval'])):
+    pass
+
+
+class StepResult(collections.namedtuple('StepResult',
+                                        ['name',
+                                         'status',
+                                         'output',
+                                         'error',
+                                         'attempts',
+                                         'elapsed'])):
+
+    @property
+    def succeeded(self):
+        return self.status == SUCCEEDED
+
+
+def references(value):
+    # 参照しているステップの名前
+    if isinstance(value, dict):
+        return set().union(*[references(v) for v in value.values()])
+    if isinstance(value, (list, tuple)):
+        return set().union(*[references(v) for v in value])
+    if isinstance(value, six.string_types):
+        return set(ref.split('.')[0] for ref in _REFERENCE.findall(value))
+    return set()
+
+
+def resolve(value, outputs):
+    if isinstance(value, dict):
+        return dict((k, resolve(v, outputs)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [resolve(v, outputs) for v in value]
+    if not isinstance(value, six.string_types):
+        return value
+    matched = _REFERENCE.match(value)
+    if matched and matched.end() == len(value):
+        # 値全体が参照なら文字列にせずにそのまま使う
+        return _lookup(matched.group(1), outputs)
+    return _REFERENCE.sub(
+        lambda m: '%s' % _lookup(m.group(1), outputs),
+        value,
+    )
+
+
+def _lookup(reference, outputs):
+    path = reference.split('.')
+    value = outputs.get(path[0])
+    for key in path[1:]:
+        try:
+            if isinstance(value, list):
+                value = value[int(key)]
+            else:
+                value = value[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise WorkflowException('Unresolved reference: ${%s}' % reference)
+    return value
+
+
+def _param_value(value):
+    # CloudStack のパラメータは文字列で渡す
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return ','.join(_param_value(v) for v in value)
+    return '%s' % value
+
+
+class Workflow(object):
+
+    def __init__(self, retries=0, retry_interval=1.0, workers=None):
+        self.retries = retries
+        self.retry_interval = retry_interval
+        self.workers = workers
+        self.steps = collections.OrderedDict()
+
+    def step(self, name, command, params=None, depends=None, retries=None,
+             retry_interval=None):
+        if not name or '.' in name:
+            raise WorkflowException('Invalid step name: %s' % name)
+        if name in self.steps:
+            raise WorkflowException('Duplicate step: %s' % name)
+        params = dict(params or {})
+        step = Step(
+            name,
+            command,
+            params,
+            # 明示された依存と、パラメータで参照しているステップ
+            sorted(set(depends or []) | references(params)),
+            self.retries if retries is None else retries,
+            self.retry_interval if retry_interval is None else retry_interval,
+        )
+        self.steps[name] = step
+        return step
+
+    def order(self):
+        # トポロジカルソート (定義の順番をなるべく保つ)
+        for step in self.steps.values():
+            for depend in step.depends:
+                if depend not in self.steps:
+                    msg = 'Unknown step: %s (in %s)' % (depend, step.name)
+                    raise WorkflowException(msg)
+        ordered = []
+        done = set()
+        remaining = list(self.steps.values())
+        while remaining:
+            ready = [s for s in remaining if done.issuperset(s.depends)]
+            if not ready:
+                names = ', '.join(s.name for s in remaining)
+                raise WorkflowException('Circular dependency: %s' % names)
+            for step in ready:
+                ordered.append(step)
+                done.add(step.name)
+            remaining = [s for s in remaining if s.name not in done]
+        return ordered
+
+    @classmethod
+    def from_dict(cls, definition):
+        workflow = cls(
+            retries=definition.get('retries', 0),
+            retry_interval=definition.get('retry_interval', 1.0),
+            workers=definition.get('workers'),
+        )
+        steps = definition.get('steps') or []
+        if isinstance(steps, dict):
+            steps = [dict(spec, name=name) for name, spec in steps.items()]
+        for spec in steps:
+            if 'name' not in spec or 'command' not in spec:
+                raise WorkflowException('Step needs name and command: %s'
+                                        % json.dumps(spec))
+            workflow.step(
+                spec['name'],
+                spec['command'],
+                spec.get('params'),
+                spec.get('depends'),
+                spec.get('retries'),
+                spec.get('retry_interval'),
+            )
+        workflow.order()
+        return workflow
+
+
+def load_workflow(path):
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            msg = 'PyYAML is required to load %s' % path
+            raise WorkflowException(msg)
+        definition = yaml.safe_load(text)
+    else:
+        # ステップの定義順を保つ
+        definition = json.loads(text,
+                                object_pairs_hook=collections.OrderedDict)
+    if not isinstance(definition, dict):
+        raise WorkflowException('Invalid workflow: %s' % path)
+    return Workflow.from_dict(definition)
+
+
+class WorkflowRunner(object):
+
+    def __init__(self, client, workers=None):
+        self.client = client
+        self.workers = workers
+
+    def run(self, workflow):
+        return collections.OrderedDict(
+            (result.name, result) for result in self.iter_run(workflow)
+        )
+
+    def iter_run(self, workflow):
+        # 終わったステップから順に結果を返す
+        steps = workflow.order()
+        workers = self.workers or workflow.workers or DEFAULT_WORKERS
+        from concurrent import futures
+        executor = futures.ThreadPoolExecutor(workers)
+        results = collections.OrderedDict()
+        pending = collections.OrderedDict((s.name, s) for s in steps)
+        running = {}
+        try:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if not all(d in results for d in step.depends):
+                        continue
+                    del pending[name]
+                    failed = [d for d in step.depends
+                              if not results[d].succeeded]
+                    if failed:
+                        # 依存するステップが失敗したら実行しない
+                        error = StepFailedException(
+                            'Dependency failed: %s' % ', '.join(failed))
+                        result = StepResult(name, SKIPPED, None, error, 0,
+                                            0.0)
+                        results[name] = result
+                        yield result
+                        continue
+                    outputs = dict((d, results[d].output)
+                                   for d in step.depends)
+                    future = executor.submit(self._run_step, step, outputs)
+                    running[future] = name
+                if not running:
+                    continue
+                done, _not_done = futures.wait(
+                    running,
+                    return_when=futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    del running[future]
+                    result = future.result()
+                    LOG.debug('Step %s: %s', result.name, result.status)
+                    results[result.name] = result
+                    yield result
+        finally:
+            executor.shutdown(wait=True)
+
+    def _run_step(self, step, outputs):
+        started = time.time()
+        try:
+            params = dict((k, _param_value(v))
+                          for k, v in resolve(step.params, outputs).items())
+        except WorkflowException as e:
+            return StepResult(step.name, FAILED, None, e, 0,
+                              time.time() - started)
+        error = None
+        job_id = None
+        for attempt in range(1, step.retries + 2):
+            try:
+                if job_id is None:
+                    output = self._call(step.command, params)
+                else:
+                    # 登録済みの JOB をもう一度待つ (コマンドは送り直さない)
+                    output = self._job_output(step.command,
+                                              self._block(step.command,
+                                                          job_id))
+                return StepResult(step.name, SUCCEEDED, output, None,
+                                  attempt, time.time() - started)
+            except STEP_ERRORS as e:
+                error = e
+                # 待ち合わせに失敗しただけなら JOB は動いている
+                job_id = getattr(e, 'job_id', None)
+                LOG.debug('Step %s failed (%d): %s', step.name, attempt, e)
+                if attempt <= step.retries:
+                    time.sleep(step.retry_interval * 2 ** (attempt - 1))
+        return StepResult(step.name, FAILED, None, error, step.retries + 1,
+                          time.time() - started)
+
+    def _call(self, command, params):
+        api_response = self.client.invoke(command, params)
+        content_body = api_response.content_body
+        inner_body = next(iter(content_body.values()), None) \
+            if isinstance(content_body, dict) else None
+        if api_response.status_code != 200:
+            raise StepFailedException('%s: %s' % (
+                command, _error_text(inner_body, api_response.status_code)))
+        job = api_response.job
+        job_id = job_id_of(content_body)
+        if job is None and job_id:
+            # 非同期 API はこのステップのスレッドで待ち合わせる
+            job = self._block(command, job_id)
+        if job is None:
+            return inner_body
+        return self._job_output(command, job)
+
+    def _block(self, command, job_id):
+        content_body = {'%sresponse' % command.lower(): {'jobid': job_id}}
+        try:
+            return self.client.block(content_body, command=command)
+        except STEP_ERRORS as e:
+            e.job_id = job_id
+            raise
+
+    def _job_output(self, command, job):
+        if not job.succeeded:
+            # 失敗して終わった JOB はコマンドから送り直す
+            raise StepFailedException('%s: %s' % (
+                command, _error_text(job.job_result, job.job_status)))
+        return job.job_result
+
+
+def _error_text(body, default):
+    if isinstance(body, dict) and body.get('errortext'):
+        return body['errortext']
+    return default
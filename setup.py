@@ -56,6 +56,10 @@ if __name__ == '__main__':
         ],
         packages=_packages(),
         install_requires=_install_requires(),
+        extras_require={
+            'asyncio': ['aiohttp'],
+            'yaml': ['PyYAML'],
+        },
         tests_require=_test_requires(),
         test_suite='nose.collector',
         include_package_data=True,